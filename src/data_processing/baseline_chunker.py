@@ -1,42 +1,229 @@
 # baseline_chunker.py
+import json
+import mmap
 import re
+from collections import deque
 from pathlib import Path
-from typing import List, Iterable
+from typing import Callable, Dict, List, Iterable, Iterator, TextIO
+
+import numpy as np
+
+from chunk_index import BookBuffer, SpanChunk
+
+# a paragraph break is 2+ line endings of any platform flavour
+_PARA_BREAK = re.compile(rb"(?:\r\n|\r(?!\n)|\n){2,}")
+
+
+def iter_paragraphs(path: str | Path) -> Iterator[str]:
+    """
+    Yield the paragraphs of *path* one at a time from a memory‑mapped file.
+
+    Same output as ``load_paragraphs`` but only one paragraph is ever
+    decoded at a time, so multi‑GB dumps are read in constant memory.
+    """
+    with open(path, "rb") as f:
+        if not f.seek(0, 2):
+            return  # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            for m in _PARA_BREAK.finditer(mm):
+                p = _decode_paragraph(mm[start:m.start()])
+                if p:
+                    yield p
+                start = m.end()
+            p = _decode_paragraph(mm[start:])
+            if p:
+                yield p
+
+
+def _decode_paragraph(raw: bytes) -> str:
+    # collapse Windows/Mac line endings like text-mode reads do
+    return raw.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n").strip()
+
 
 def load_paragraphs(path: str | Path) -> List[str]:
-    raw = Path(path).read_text(encoding="utf‑8")
-    # collapse Windows/Mac line endings, then split on 2+ newlines
-    return [p.strip() for p in re.split(r"\n{2,}", raw) if p.strip()]
+    return list(iter_paragraphs(path))
 
-def chunk_paragraphs(paragraphs: Iterable[str],
-                     target_words: int = 1000,
-                     overlap_paragraphs: int = 0) -> List[str]:
-    chunks, current, cur_count = [], [], 0
+
+def word_count(text: str) -> int:
+    return len(text.split())
+
+
+def iter_chunks(paragraphs: Iterable[str],
+                target_words: int = 1000,
+                overlap_paragraphs: int = 0,
+                length_fn: Callable[[str], int] = word_count) -> Iterator[str]:
+    """
+    Streaming ``chunk_paragraphs``: yields each chunk as soon as it is full.
+
+    Sizes (words by default, or whatever ``length_fn`` measures, e.g.
+    tokens) are computed once per paragraph and carried alongside it, so
+    starting an overlapping chunk never re‑measures the overlap window.
+    """
+    current: deque[tuple[str, int]] = deque()
+    cur_count = 0
     for p in paragraphs:
-        p_words = len(p.split())
+        p_words = length_fn(p)
         # if adding this paragraph would push us *over* the target,
         # flush what we’ve got (unless empty) and start anew
         if current and cur_count + p_words > target_words:
-            chunks.append("\n\n".join(current))
+            yield "\n\n".join(para for para, _ in current)
             # start next chunk with optional overlap from the *end*
-            current = current[-overlap_paragraphs:] if overlap_paragraphs else []
-            cur_count = sum(len(x.split()) for x in current)
-        current.append(p)
+            if overlap_paragraphs:
+                while len(current) > overlap_paragraphs:
+                    current.popleft()
+            else:
+                current.clear()
+            cur_count = sum(n for _, n in current)
+        current.append((p, p_words))
         cur_count += p_words
     if current:
-        chunks.append("\n\n".join(current))
-    return chunks
+        yield "\n\n".join(para for para, _ in current)
+
+
+def chunk_paragraphs(paragraphs: Iterable[str],
+                     target_words: int = 1000,
+                     overlap_paragraphs: int = 0,
+                     length_fn: Callable[[str], int] = word_count) -> List[str]:
+    return list(iter_chunks(paragraphs, target_words, overlap_paragraphs,
+                            length_fn))
+
+
+def word_count_prefix(paragraphs: Iterable[str]) -> np.ndarray:
+    """``prefix[k]`` = words in the first *k* paragraphs (``prefix[0] == 0``)."""
+    counts = np.fromiter((len(p.split()) for p in paragraphs), dtype=np.int64)
+    return count_prefix(counts)
+
+
+def count_prefix(counts) -> np.ndarray:
+    """Prefix sums of per-paragraph sizes, with a leading 0."""
+    return np.concatenate(([0], np.cumsum(np.asarray(counts, dtype=np.int64))))
+
+
+def greedy_cut_points(prefix: np.ndarray,
+                      target_words: int = 1000,
+                      overlap_paragraphs: int = 0) -> List[tuple[int, int]]:
+    """
+    Paragraph spans ``[start, end)`` of the chunks ``chunk_paragraphs`` would
+    build, found by binary search on the word-count prefix sums: one
+    ``searchsorted`` per chunk instead of one step per paragraph.
+    """
+    n = len(prefix) - 1
+    spans = []
+    start, prev_end = 0, 0
+    while prev_end < n:
+        # furthest end keeping the chunk within target; a chunk always takes
+        # at least the paragraph that overflowed the previous one
+        end = int(np.searchsorted(prefix, prefix[start] + target_words,
+                                  side="right")) - 1
+        end = min(max(end, prev_end + 1), n)
+        spans.append((start, end))
+        if overlap_paragraphs:
+            start = max(start, end - overlap_paragraphs)
+        else:
+            start = end
+        prev_end = end
+    return spans
+
+
+def chunk_paragraphs_multi(paragraphs: List[str],
+                           targets: Iterable[int],
+                           overlap_paragraphs: int = 0) -> Dict[int, List[str]]:
+    """
+    ``chunk_paragraphs`` for several targets from one word-count pass.
+    Returns ``{target: chunks}``.
+    """
+    prefix = word_count_prefix(paragraphs)
+    return {
+        t: ["\n\n".join(paragraphs[s:e])
+            for s, e in greedy_cut_points(prefix, t, overlap_paragraphs)]
+        for t in targets
+    }
+
+
+def chunk_buffer(buffer: BookBuffer,
+                 target_words: int = 1000,
+                 overlap_paragraphs: int = 0) -> List[SpanChunk]:
+    """
+    ``chunk_paragraphs`` over a shared :class:`BookBuffer`: the chunks are
+    ``SpanChunk`` offsets into it, so no chunk text is built until written.
+    """
+    prefix = np.asarray(buffer.word_prefix, dtype=np.int64)
+    return [SpanChunk(buffer, s, e)
+            for s, e in greedy_cut_points(prefix, target_words, overlap_paragraphs)]
+
+
+def dump_chunks_json(chunks: Iterable[str | SpanChunk], fp: TextIO) -> int:
+    """
+    Stream ``{"chunks": [...], "count": n}`` to *fp* chunk by chunk.
+
+    Byte‑for‑byte the same as ``json.dumps(..., indent=2)`` of the full
+    dict, without ever holding the whole document in memory.  ``SpanChunk``
+    text is materialised here, one chunk at a time.
+    """
+    count = 0
+    fp.write('{\n  "chunks": [')
+    for chunk in chunks:
+        fp.write(",\n    " if count else "\n    ")
+        fp.write(json.dumps(str(chunk)))
+        count += 1
+    fp.write("\n  ],\n" if count else "],\n")
+    fp.write(f'  "count": {count}\n}}')
+    return count
+
+
+def dump_chunk_spans_json(chunks: List[SpanChunk], book_path: str | Path,
+                          fp: TextIO) -> int:
+    """
+    Write chunks as paragraph spans of *book_path* instead of text::
+
+        {"book_path": ..., "n_paragraphs": n, "chunks": [[start, end], ...], "count": k}
+
+    ``prepare_training_data.load_chunks_from_file`` reads this back as
+    ``SpanChunk`` objects over one shared buffer of the book.
+    """
+    if any(c.suffix for c in chunks):
+        raise ValueError("chunks with appended text cannot be stored as spans")
+    n_paragraphs = len(chunks[0].buffer) if chunks else 0
+    json.dump({"book_path": str(book_path),
+               "n_paragraphs": n_paragraphs,
+               "chunks": [[c.start, c.end] for c in chunks],
+               "count": len(chunks)}, fp)
+    return len(chunks)
+
 
 if __name__ == "__main__":
-    import argparse, json
+    import argparse, sys
     ap = argparse.ArgumentParser()
     ap.add_argument("book_path")
     ap.add_argument("--size", type=int, default=1000,
                     help="≈ words per chunk (default 1000)")
     ap.add_argument("--overlap", type=int, default=0,
                     help="paragraphs to repeat between chunks")
+    ap.add_argument("--sizes", type=int, nargs="+", default=None,
+                    help="several chunk sizes in one pass; writes one file per "
+                         "size instead of printing")
+    ap.add_argument("--output_template", default="{stem}_{size}.json",
+                    help="output path for --sizes (default {stem}_{size}.json)")
+    ap.add_argument("--spans", action="store_true",
+                    help="with --sizes, store paragraph spans of the book instead "
+                         "of chunk text")
     args = ap.parse_args()
 
-    paras = load_paragraphs(args.book_path)
-    chunks = chunk_paragraphs(paras, args.size, args.overlap)
-    print(json.dumps({"chunks": chunks, "count": len(chunks)}, indent=2))
+    if args.sizes:
+        buffer = BookBuffer(iter_paragraphs(args.book_path))
+        stem = Path(args.book_path).stem
+        for size in args.sizes:
+            chunks = chunk_buffer(buffer, size, args.overlap)
+            out = args.output_template.format(stem=stem, size=size)
+            with open(out, "w", encoding="utf-8") as f:
+                if args.spans:
+                    dump_chunk_spans_json(chunks, args.book_path, f)
+                else:
+                    dump_chunks_json(chunks, f)
+            print(f"Wrote {len(chunks)} chunks to {out}", file=sys.stderr)
+    else:
+        paras = iter_paragraphs(args.book_path)
+        chunks = iter_chunks(paras, args.size, args.overlap)
+        dump_chunks_json(chunks, sys.stdout)
+        print()
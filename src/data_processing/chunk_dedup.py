@@ -0,0 +1,283 @@
+# chunk_dedup.py
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+
+_BLOCK = 4096  # query rows per matmul
+
+
+def _top_centroids(x: np.ndarray, centroids: np.ndarray, n: int) -> np.ndarray:
+    """Ids of the ``n`` most similar centroids for every row of *x*."""
+    out = np.empty((len(x), n), dtype=np.int64)
+    for a in range(0, len(x), _BLOCK):
+        sims = x[a:a + _BLOCK] @ centroids.T
+        if n == 1:
+            out[a:a + _BLOCK, 0] = sims.argmax(axis=1)
+        else:
+            out[a:a + _BLOCK] = np.argpartition(-sims, n - 1, axis=1)[:, :n]
+    return out
+
+
+def spherical_kmeans(x: np.ndarray, k: int, n_iter: int = 10,
+                     seed: int = 0) -> np.ndarray:
+    """``k`` unit centroids for the unit rows of *x* (cosine k-means)."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = _top_centroids(x, centroids, 1)[:, 0]
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        # an emptied cluster restarts on a random point
+        sums[empty] = x[rng.choice(len(x), int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file ANN index over unit vectors (cosine = inner product).
+
+    ``build`` clusters the vectors with spherical k-means into ``nlist``
+    lists (default √n); a query scans only the ``nprobe`` lists whose
+    centroids are closest, so all-pairs work drops from n² to about
+    n · nprobe · n / nlist.  Vectors inside the probed lists are compared
+    exactly (IVF-Flat).
+    """
+
+    def __init__(self, nlist: int | None = None, nprobe: int = 8,
+                 n_iter: int = 10, train_size: int = 64, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.train_size = train_size  # training points per list
+        self.seed = seed
+
+    def build(self, vectors: np.ndarray) -> "IVFIndex":
+        x = np.asarray(vectors, dtype=np.float32)
+        self.vectors = x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+        n = len(x)
+        nlist = min(n, self.nlist or max(1, int(np.sqrt(n))))
+        rng = np.random.default_rng(self.seed)
+        sample = rng.choice(n, min(n, nlist * self.train_size), replace=False)
+        self.centroids = spherical_kmeans(self.vectors[sample], nlist, self.n_iter, self.seed)
+        assign = _top_centroids(self.vectors, self.centroids, 1)[:, 0]
+        self.ids = np.argsort(assign, kind="stable")
+        self.offsets = np.searchsorted(assign[self.ids], np.arange(nlist + 1))
+        return self
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def _list(self, c: int) -> np.ndarray:
+        return self.ids[self.offsets[c]:self.offsets[c + 1]]
+
+    def search(self, queries: np.ndarray, k: int = 10) -> tuple[np.ndarray, np.ndarray]:
+        """``(sims, ids)`` of the ``k`` approximate nearest rows per query (-1 = none)."""
+        q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        q = q / np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        probes = _top_centroids(q, self.centroids, min(self.nprobe, len(self.centroids)))
+        sims = np.full((len(q), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(q), k), -1, dtype=np.int64)
+        for row, probe in enumerate(probes):
+            cand = np.concatenate([self._list(c) for c in probe])
+            s = self.vectors[cand] @ q[row]
+            top = np.argsort(-s)[:k]
+            sims[row, :len(top)] = s[top]
+            ids[row, :len(top)] = cand[top]
+        return sims, ids
+
+    def range_pairs(self, threshold: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Every pair ``i < j`` with cosine ≥ *threshold* where either row
+        probes the other's list (probing is not symmetric).  Work is grouped
+        by list: all rows probing list ``c`` are compared with its members
+        in one matmul.
+        """
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = _top_centroids(self.vectors, self.centroids, nprobe).reshape(-1)
+        order = np.argsort(probes, kind="stable")
+        query_offsets = np.searchsorted(probes[order], np.arange(len(self.centroids) + 1))
+        rows = order // nprobe
+
+        found_i, found_j, found_s = [], [], []
+        for c in range(len(self.centroids)):
+            members = self._list(c)
+            queries = rows[query_offsets[c]:query_offsets[c + 1]]
+            if not len(members) or not len(queries):
+                continue
+            block_vecs = self.vectors[members]
+            for a in range(0, len(queries), _BLOCK):
+                q = queries[a:a + _BLOCK]
+                sims = self.vectors[q] @ block_vecs.T
+                qi, mi = np.nonzero(sims >= threshold)
+                i, j = q[qi], members[mi]
+                keep = i != j
+                found_i.append(np.minimum(i, j)[keep])
+                found_j.append(np.maximum(i, j)[keep])
+                found_s.append(sims[qi[keep], mi[keep]])
+        if not found_i:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=np.float32)
+        i, j, s = np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_s)
+        # a pair seen through several lists is reported once
+        _, first = np.unique(i * len(self) + j, return_index=True)
+        return i[first], j[first], s[first]
+
+
+def _normalise(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def near_duplicates(texts: list[str],
+                    embs: np.ndarray | None,
+                    threshold: float = 0.95,
+                    **index_kwargs) -> dict[int, tuple[int, float]]:
+    """
+    ``{dropped: (kept, similarity)}`` – each text that repeats an earlier,
+    kept one.
+
+    Texts equal up to whitespace and case are caught by hash before any
+    embedding is compared; the rest go through an :class:`IVFIndex` range
+    search at cosine ≥ *threshold*.  The earliest text of a duplicate group
+    is kept, so earlier input files take precedence.
+    """
+    dropped: dict[int, tuple[int, float]] = {}
+    first_seen: dict[str, int] = {}
+    for i, text in enumerate(texts):
+        key = _normalise(text)
+        if key in first_seen:
+            dropped[i] = (first_seen[key], 1.0)
+        else:
+            first_seen[key] = i
+    if embs is None or len(texts) < 2:
+        return dropped
+
+    index = IVFIndex(**index_kwargs).build(embs)
+    i, j, s = index.range_pairs(threshold)
+    matches: dict[int, list] = {}
+    for a, b, sim in zip(i.tolist(), j.tolist(), s.tolist()):
+        matches.setdefault(b, []).append((a, sim))
+    for b in sorted(matches):
+        if b in dropped:
+            continue
+        kept = [(a, sim) for a, sim in matches[b] if a not in dropped]
+        if kept:
+            dropped[b] = max(kept, key=lambda m: m[1])
+    return dropped
+
+
+def dedup_report(files: list[tuple[str, list]],
+                 dropped: dict[int, tuple[int, float]],
+                 threshold: float) -> dict:
+    """
+    JSON-ready report: removal counts per file and one entry per dropped
+    chunk.  Files are stored as absolute paths, so the report can be used
+    from any directory.
+    """
+    files = [(str(Path(path).resolve()), chunks) for path, chunks in files]
+    where = [(path, k) for path, chunks in files for k in range(len(chunks))]
+    texts = [str(c) for _, chunks in files for c in chunks]
+    removed = []
+    for idx in sorted(dropped):
+        kept, sim = dropped[idx]
+        removed.append({
+            "file": where[idx][0], "chunk": where[idx][1],
+            "duplicate_of": {"file": where[kept][0], "chunk": where[kept][1]},
+            "similarity": round(float(sim), 4),
+            "preview": texts[idx][:120],
+        })
+    counts = {path: 0 for path, _ in files}
+    for r in removed:
+        counts[r["file"]] += 1
+    return {
+        "threshold": threshold,
+        "chunks": len(texts),
+        "removed": len(removed),
+        "per_file": {path: {"chunks": len(chunks), "removed": counts[path]}
+                     for path, chunks in files},
+        "duplicates": removed,
+    }
+
+
+def load_dedup_report(path: str | Path) -> dict[str, set[int]]:
+    """
+    ``{resolved chunk file: {dropped chunk indices}}`` from a report.  A
+    relative file name (older reports) is taken relative to the report's
+    directory when such a file exists there, else to the working directory.
+    """
+    path = Path(path)
+    data = json.loads(path.read_text(encoding="utf-8"))
+    out: dict[str, set[int]] = {}
+    for r in data["duplicates"]:
+        file = Path(r["file"])
+        if not file.is_absolute() and (path.parent / file).is_file():
+            file = path.parent / file
+        out.setdefault(str(file.resolve()), set()).add(r["chunk"])
+    return out
+
+
+if __name__ == "__main__":
+    import argparse, time
+    from embedding_backends import BACKENDS, cache_name, load_embedding_model
+    from embedding_cache import EmbeddingCache, DEFAULT_MAX_MB
+    from global_segmenter import paragraph_embeddings
+    from prepare_training_data import load_chunks_from_file
+    from semantic_chunker import DOC_PREFIX
+
+    ap = argparse.ArgumentParser(
+        description="Find near-duplicate chunks across chunk files before prepare_training_data.py.")
+    ap.add_argument("--input_files", nargs="+", required=True)
+    ap.add_argument("--report", default="dedup_report.json",
+                    help="where to write the report (pass it to prepare_training_data.py --dedup_report)")
+    ap.add_argument("--threshold", type=float, default=0.95,
+                    help="cosine at or above which a chunk repeats an earlier one (default 0.95)")
+    ap.add_argument("--exact_only", action="store_true",
+                    help="only drop chunks identical up to whitespace and case (no model)")
+    ap.add_argument("--nlist", type=int, default=None, help="IVF lists (default √chunks)")
+    ap.add_argument("--nprobe", type=int, default=8, help="lists scanned per chunk (default 8)")
+    ap.add_argument("--model_name", default="lightonai/modernbert-embed-large")
+    ap.add_argument("--backend", choices=BACKENDS, default="sentence-transformers")
+    ap.add_argument("--batch_size", type=int, default=64)
+    ap.add_argument("--cache_dir", default=None)
+    ap.add_argument("--cache_max_mb", type=int, default=DEFAULT_MAX_MB)
+    args = ap.parse_args()
+
+    files = []
+    for path in args.input_files:
+        chunks = load_chunks_from_file(Path(path))
+        print(f"  {path}: {len(chunks)} chunks")
+        files.append((path, chunks))
+    texts = [str(c) for _, chunks in files for c in chunks]
+
+    embs = None
+    if not args.exact_only:
+        model = load_embedding_model(args.model_name, args.backend)
+        cache = None
+        if args.cache_dir:
+            cache = EmbeddingCache(args.cache_dir, cache_name(args.model_name, args.backend),
+                                   args.cache_max_mb)
+        t0 = time.perf_counter()
+        embs = paragraph_embeddings(model, texts, DOC_PREFIX, args.batch_size, cache)
+        print(f"Embedded {len(texts)} chunks in {time.perf_counter() - t0:.1f}s.")
+        if cache is not None:
+            cache.save()
+            print(cache.report())
+
+    t0 = time.perf_counter()
+    dropped = near_duplicates(texts, embs, args.threshold,
+                              nlist=args.nlist, nprobe=args.nprobe)
+    print(f"Searched {len(texts)} chunks in {time.perf_counter() - t0:.1f}s.")
+
+    report = dedup_report(files, dropped, args.threshold)
+    Path(args.report).write_text(json.dumps(report, indent=2, ensure_ascii=False),
+                                 encoding="utf-8")
+    for path, stats in report["per_file"].items():
+        print(f"  {path}: {stats['removed']} of {stats['chunks']} chunks are near-duplicates")
+    for r in report["duplicates"][:10]:
+        print(f"    {r['file']}#{r['chunk']} ≈ {r['duplicate_of']['file']}#"
+              f"{r['duplicate_of']['chunk']} ({r['similarity']:.3f}): {r['preview'][:60]!r}")
+    print(f"Removed {report['removed']} of {report['chunks']} chunks; report in {args.report}")
@@ -0,0 +1,207 @@
+# chunk_index.py
+import re
+from array import array
+from typing import Iterable, Iterator
+
+# sentence ends at . ! or ? followed by whitespace; paragraphs at 2+ newlines
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+')
+PARAGRAPH_BREAK = re.compile(r'\n{2,}')
+PARAGRAPH_SEPARATOR = "\n\n"
+
+
+def sentence_spans(paragraph: str) -> list[tuple[int, int]]:
+    """(start, end) of each ``SENTENCE_BREAK``-delimited piece of *paragraph*."""
+    spans, start = [], 0
+    for m in SENTENCE_BREAK.finditer(paragraph):
+        spans.append((start, m.start()))
+        start = m.end()
+    spans.append((start, len(paragraph)))
+    return spans
+
+
+class BookBuffer:
+    """
+    One shared text buffer for a whole book.
+
+    The paragraphs are joined once with ``PARAGRAPH_SEPARATOR`` and only
+    their offsets are kept, so any run of consecutive paragraphs is a single
+    slice of ``text`` – exactly ``"\\n\\n".join(paragraphs[a:b])``.  Word
+    counts are stored as prefix sums and sentence offsets are computed per
+    paragraph the first time they are needed.
+    """
+
+    __slots__ = ("text", "starts", "ends", "word_prefix", "_sentences")
+
+    def __init__(self, paragraphs: Iterable[str]):
+        paragraphs = list(paragraphs)
+        self.text = PARAGRAPH_SEPARATOR.join(paragraphs)
+        self.starts = array("q")
+        self.ends = array("q")
+        self.word_prefix = array("q", [0])
+        pos = 0
+        for p in paragraphs:
+            self.starts.append(pos)
+            pos += len(p)
+            self.ends.append(pos)
+            pos += len(PARAGRAPH_SEPARATOR)
+            self.word_prefix.append(self.word_prefix[-1] + len(p.split()))
+        self._sentences: list[list[tuple[int, int]] | None] = [None] * len(paragraphs)
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[str]) -> tuple["BookBuffer", list["SpanChunk"]]:
+        """
+        Buffer the paragraphs of consecutive, non-overlapping chunk strings
+        and return it with one ``SpanChunk`` per chunk.
+        """
+        paragraphs, spans = [], []
+        for c in chunks:
+            paras = PARAGRAPH_BREAK.split(c)
+            spans.append((len(paragraphs), len(paragraphs) + len(paras)))
+            paragraphs.extend(paras)
+        buffer = cls(paragraphs)
+        return buffer, [SpanChunk(buffer, s, e) for s, e in spans]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def paragraph(self, i: int) -> str:
+        return self.text[self.starts[i]:self.ends[i]]
+
+    def span_text(self, start: int, end: int) -> str:
+        if start >= end:
+            return ""
+        return self.text[self.starts[start]:self.ends[end - 1]]
+
+    def sentences(self, i: int) -> list[tuple[int, int]]:
+        """Sentence offsets of paragraph *i*, relative to ``text``."""
+        spans = self._sentences[i]
+        if spans is None:
+            base = self.starts[i]
+            spans = [(base + s, base + e) for s, e in sentence_spans(self.paragraph(i))]
+            self._sentences[i] = spans
+        return spans
+
+    def ends_sentence(self, i: int) -> bool:
+        # the separator after this paragraph is a sentence break only if it
+        # follows terminal punctuation
+        end = self.ends[i]
+        return end > self.starts[i] and self.text[end - 1] in ".!?"
+
+
+class SpanChunk:
+    """
+    A chunk as paragraphs ``[start, end)`` of a shared :class:`BookBuffer`,
+    plus an optional ``suffix`` of appended text.
+
+    Moving a paragraph across a join is two integer updates, and text is
+    only materialised by :meth:`text` (``str(chunk)``), i.e. when the chunk
+    is written out.  Anything that formats a chunk – ``json`` writers,
+    ``PROMPT_TEMPLATE.format`` – accepts a ``SpanChunk`` via ``str``.
+
+    ``tail``/``head`` return exactly what ``" ".join`` of the last/first *n*
+    items of ``SENTENCE_BREAK.split(chunk_text)`` would – a sentence that
+    runs over a paragraph break without terminal punctuation stays one
+    sentence – while only touching the paragraphs the window falls in.
+    """
+
+    __slots__ = ("buffer", "start", "end", "suffix")
+
+    def __init__(self, buffer: BookBuffer, start: int, end: int, suffix: str = ""):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.suffix = suffix
+
+    def __repr__(self) -> str:
+        return f"SpanChunk({self.start}, {self.end}{', +suffix' if self.suffix else ''})"
+
+    def __len__(self) -> int:
+        """Number of buffer paragraphs spanned."""
+        return self.end - self.start
+
+    def text(self) -> str:
+        return self.buffer.span_text(self.start, self.end) + self.suffix
+
+    __str__ = text
+
+    def paragraphs(self) -> Iterator[str]:
+        for i in range(self.start, self.end):
+            yield self.buffer.paragraph(i)
+
+    @property
+    def n_words(self) -> int:
+        if self.suffix:
+            return len(self.text().split())
+        return self.buffer.word_prefix[self.end] - self.buffer.word_prefix[self.start]
+
+    # --- windows ----------------------------------------------------------
+    def tail(self, n: int, skip: int = 0) -> str:
+        """Last *n* sentences, ignoring the first *skip* paragraphs."""
+        if self.suffix:
+            text = self.buffer.span_text(self.start + skip, self.end) + self.suffix
+            return " ".join(SENTENCE_BREAK.split(text)[-n:])
+        buf, text = self.buffer, self.buffer.text
+        first = self.start + skip
+        pieces: list[str] = []
+        pending = None  # sentence continuing into the paragraph after
+        for p in range(self.end - 1, first - 1, -1):
+            spans = buf.sentences(p)
+            for j in range(len(spans) - 1, -1, -1):
+                s, e = spans[j]
+                piece = text[s:e]
+                if pending is not None:
+                    piece = piece + PARAGRAPH_SEPARATOR + pending
+                    pending = None
+                if j == 0 and p > first and not buf.ends_sentence(p - 1):
+                    pending = piece
+                    continue
+                pieces.append(piece)
+                if len(pieces) == n:
+                    return " ".join(reversed(pieces))
+        if pending is not None:
+            pieces.append(pending)
+        return " ".join(reversed(pieces[:n]))
+
+    def head(self, n: int) -> str:
+        """First *n* sentences."""
+        if self.suffix:
+            return " ".join(SENTENCE_BREAK.split(self.text())[:n])
+        buf, text = self.buffer, self.buffer.text
+        pieces: list[str] = []
+        pending = None  # sentence continuing from the paragraph before
+        for p in range(self.start, self.end):
+            spans = buf.sentences(p)
+            for j, (s, e) in enumerate(spans):
+                piece = text[s:e]
+                if pending is not None:
+                    piece = pending + PARAGRAPH_SEPARATOR + piece
+                    pending = None
+                if j == len(spans) - 1 and p < self.end - 1 and not buf.ends_sentence(p):
+                    pending = piece
+                    continue
+                pieces.append(piece)
+                if len(pieces) == n:
+                    return " ".join(pieces)
+        if pending is not None:
+            pieces.append(pending)
+        return " ".join(pieces[:n])
+
+    # --- edits --------------------------------------------------------------
+    def move_first_paragraph_to(self, other: "SpanChunk") -> bool:
+        """
+        Shift this chunk's first paragraph onto the end of *other*, the chunk
+        before it.  Returns ``False`` if this chunk has only one paragraph left.
+        """
+        if len(self) < 2:
+            return False
+        if other.end == self.start and not other.suffix:
+            other.end += 1
+        else:
+            # not contiguous (overlapping chunks, appended text): copy it
+            other.suffix += PARAGRAPH_SEPARATOR + self.buffer.paragraph(self.start)
+        self.start += 1
+        return True
+
+    def append_text(self, text: str) -> None:
+        """Append *text* to the chunk as ``chunk_text + text`` would."""
+        self.suffix += text
@@ -0,0 +1,120 @@
+# chunk_manifest.py
+import hashlib
+import json
+import os
+from difflib import SequenceMatcher
+from pathlib import Path
+
+from chunk_index import BookBuffer, SpanChunk
+
+MANIFEST_VERSION = 1
+
+
+def paragraph_hash(paragraph: str) -> str:
+    return hashlib.sha1(paragraph.encode("utf-8")).hexdigest()[:16]
+
+
+def paragraph_hashes(buffer: BookBuffer) -> list[str]:
+    return [paragraph_hash(buffer.paragraph(i)) for i in range(len(buffer))]
+
+
+def manifest_path(output_path: str | Path) -> Path:
+    """The manifest lives next to the chunks JSON: ``<output>.manifest.json``."""
+    return Path(f"{output_path}.manifest.json")
+
+
+def write_manifest(path: str | Path,
+                   hashes: list[str],
+                   chunks: list[SpanChunk],
+                   decisions: list[dict],
+                   params: dict) -> None:
+    """
+    Record what a run decided, so the next run on an edited book can redo
+    only the boundaries around the edit::
+
+        {"version": 1, "params": {...},
+         "paragraph_hashes": [...],             # one per paragraph
+         "chunks": [[start, end, suffix], ...],  # paragraph spans + appended text
+         "decisions": [{"sim": ..., "action": ...}, ...]}  # one per boundary
+    """
+    path = Path(path)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({
+        "version": MANIFEST_VERSION,
+        "params": params,
+        "paragraph_hashes": hashes,
+        "chunks": [[c.start, c.end, c.suffix] for c in chunks],
+        "decisions": decisions,
+    }), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def load_manifest(path: str | Path, params: dict) -> dict | None:
+    """The manifest at *path*, or ``None`` if missing or made with other params."""
+    path = Path(path)
+    if not path.is_file():
+        return None
+    try:
+        manifest = json.loads(path.read_text(encoding="utf-8"))
+    except json.JSONDecodeError:
+        print(f"Warning: could not decode manifest {path}, ignoring it.")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("params") != params:
+        print(f"Manifest {path} was written with other settings, ignoring it.")
+        return None
+    return manifest
+
+
+def plan_incremental(old_hashes: list[str],
+                     new_hashes: list[str],
+                     old_spans: list[tuple[int, int]],
+                     neighbourhood: int = 1) -> list[tuple]:
+    """
+    Diff paragraph hashes and decide which old chunks survive.
+
+    A chunk is kept if all of its paragraphs are unchanged and nothing was
+    inserted inside or right before it, and no chunk within
+    ``neighbourhood`` chunks of it changed.  Returns, in book order,
+
+    * ``("keep", k, start, end)`` – old chunk *k*, at new paragraphs ``[start, end)``
+    * ``("redo", start, end)``    – new paragraphs to chunk again; the joins
+      with the kept chunks either side are decided again too
+    """
+    new_of = [-1] * len(old_hashes)
+    matcher = SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    for tag, i1, i2, j1, _ in matcher.get_opcodes():
+        if tag == "equal":
+            for k in range(i2 - i1):
+                new_of[i1 + k] = j1 + k
+
+    dirty = []
+    prev_end = 0  # where an untouched chunk must start; None after a dirty one
+    for s, e in old_spans:
+        start = new_of[s] if s < e else -1
+        clean = (start >= 0 and prev_end in (None, start)
+                 and all(new_of[p] == start + (p - s) for p in range(s, e)))
+        dirty.append(not clean)
+        prev_end = start + (e - s) if clean else None
+    if old_spans and prev_end not in (None, len(new_hashes)):
+        dirty[-1] = True  # paragraphs appended after the last chunk
+
+    n = len(old_spans)
+    redo = [any(dirty[max(0, k - neighbourhood):k + neighbourhood + 1])
+            for k in range(n)]
+
+    plan, cursor, k = [], 0, 0
+    while k < n:
+        if not redo[k]:
+            s, e = old_spans[k]
+            plan.append(("keep", k, new_of[s], new_of[s] + (e - s)))
+            cursor = new_of[s] + (e - s)
+            k += 1
+            continue
+        while k < n and redo[k]:
+            k += 1
+        end = new_of[old_spans[k][0]] if k < n else len(new_hashes)
+        plan.append(("redo", cursor, end))
+        cursor = end
+    if not old_spans and new_hashes:
+        plan.append(("redo", 0, len(new_hashes)))
+    return plan
@@ -0,0 +1,264 @@
+# chunker_benchmark.py
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from baseline_chunker import load_paragraphs, chunk_paragraphs
+from embedding_server import cosine_similarity
+from semantic_chunker import refine_boundaries, DEFAULT_CHAR_NAMES
+from src.data_processing.bm25_func import bm25_gap_violation
+
+DEFAULT_BASELINE = Path(__file__).with_name("chunker_benchmark_baseline.json")
+STAGES = ("load_paragraphs", "chunk_paragraphs", "bm25_gap_violation", "refine_boundaries")
+_CORPUS_ARGS = {"mean_paragraph_words", "paragraph_sigma", "sentence_words",
+                "entity_density", "seed"}
+
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "te", "vo", "da", "pi",
+              "or", "en", "al", "is", "um", "th", "ch", "st", "wa", "ye"]
+
+
+def _vocabulary(size: int, rng: np.random.Generator) -> np.ndarray:
+    lengths = rng.integers(1, 4, size)
+    words = {"".join(rng.choice(_SYLLABLES, n)) for n in lengths}
+    return np.array(sorted(words))
+
+
+def synthetic_novel(path: str | Path,
+                    size_mb: float,
+                    mean_paragraph_words: int = 80,
+                    paragraph_sigma: float = 0.6,
+                    sentence_words: int = 14,
+                    entity_density: float = 5.0,
+                    names: list[str] = DEFAULT_CHAR_NAMES,
+                    vocab_size: int = 5000,
+                    seed: int = 0) -> Path:
+    """
+    Write a novel-shaped text of about ``size_mb`` MB to *path*.
+
+    Paragraph lengths are log-normal around ``mean_paragraph_words``
+    (``paragraph_sigma`` sets the spread), words follow a Zipf-like
+    distribution over a synthetic vocabulary, sentences end every
+    ~``sentence_words`` words and ``entity_density`` of every 1000 words
+    are one of *names*.  Written in blocks, so 1 GB needs little memory.
+    """
+    rng = np.random.default_rng(seed)
+    vocab = _vocabulary(vocab_size, rng)
+    zipf = 1.0 / np.arange(1, len(vocab) + 1)
+    zipf /= zipf.sum()
+    names = np.array(names)
+    target = int(size_mb * 1024 * 1024)
+    mu = np.log(mean_paragraph_words) - paragraph_sigma ** 2 / 2
+
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < target:
+            lengths = np.maximum(1, rng.lognormal(mu, paragraph_sigma, 2048).astype(np.int64))
+            words = vocab[rng.choice(len(vocab), int(lengths.sum()), p=zipf)].astype(object)
+            entity = rng.random(len(words)) < entity_density / 1000.0
+            words[entity] = names[rng.integers(0, len(names), int(entity.sum()))]
+            ends = rng.random(len(words)) < 1.0 / sentence_words
+            words[ends] = words[ends] + "."
+            bounds = np.concatenate(([0], np.cumsum(lengths)))
+            block = []
+            for a, b in zip(bounds[:-1], bounds[1:]):
+                para = " ".join(words[a:b])
+                block.append(para[0].upper() + para[1:] + ("" if para.endswith(".") else "."))
+            text = "\n\n".join(block) + "\n\n"
+            f.write(text)
+            written += len(text.encode("utf-8"))
+    return Path(path)
+
+
+class StubEncoder:
+    """
+    Deterministic CPU stand-in for the sentence transformer: a hashed
+    bag-of-words vector per text.  Similar texts get similar vectors, so
+    ``refine_boundaries`` takes realistic branches without a model download.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        ids = [zlib.crc32(w.encode("utf-8")) % self.dim for w in text.lower().split()]
+        v = np.bincount(ids, minlength=self.dim).astype(np.float32)
+        return v / max(float(np.linalg.norm(v)), 1e-12)
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs):
+        if isinstance(sentences, str):
+            return self._vector(sentences)
+        return np.stack([self._vector(s) for s in sentences])
+
+    similarity = staticmethod(cosine_similarity)
+
+
+def _bm25_boundaries(chunks: list[str], names: list[str], limit: int | None) -> int:
+    """Run ``bm25_gap_violation`` on up to *limit* evenly spaced joins; returns joins checked."""
+    joins = np.arange(1, len(chunks))
+    if limit is not None and len(joins) > limit:
+        joins = joins[np.linspace(0, len(joins) - 1, limit).astype(int)]
+    for k in joins:
+        for name in names:
+            bm25_gap_violation((chunks[k - 1], chunks[k]), name)
+    return len(joins)
+
+
+def run_stages(corpus: Path, target: int = 350, batch_size: int = 256,
+               bm25_boundaries: int | None = 1000, trace_memory: bool = False) -> dict:
+    """
+    Time (or, with ``trace_memory``, measure the tracemalloc peak of) each
+    stage on *corpus*.  Returns ``{stage: {"seconds" | "peak_mb", "items"}}``.
+    """
+    out = {}
+
+    def stage(name, fn):
+        if trace_memory:
+            tracemalloc.start()
+            result, items = fn()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            out[name] = {"peak_mb": peak / 2 ** 20, "items": items}
+        else:
+            t0 = time.perf_counter()
+            result, items = fn()
+            out[name] = {"seconds": time.perf_counter() - t0, "items": items}
+        return result
+
+    paragraphs = stage("load_paragraphs",
+                       lambda: (p := load_paragraphs(corpus), len(p)))
+    chunks = stage("chunk_paragraphs",
+                   lambda: (c := chunk_paragraphs(paragraphs, int(target * 0.9)), len(c)))
+    stage("bm25_gap_violation",
+          lambda: (None, _bm25_boundaries(chunks, DEFAULT_CHAR_NAMES, bm25_boundaries)))
+    stage("refine_boundaries",
+          lambda: (None, len(refine_boundaries(chunks, model=StubEncoder(),
+                                               batch_size=batch_size)[0])))
+    return out
+
+
+def max_rss_mb() -> float:
+    """Peak resident set size of this process; ``ru_maxrss`` is bytes on macOS, KiB on Linux."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 1024
+
+
+def benchmark(sizes_mb: list[float], work_dir: Path, trace_memory: bool = True,
+              **kwargs) -> dict:
+    """Generate (or reuse) one corpus per size and collect every stage's numbers."""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    results = []
+    for size in sizes_mb:
+        corpus = work_dir / f"novel_{size:g}mb_seed{kwargs.get('seed', 0)}.txt"
+        if not corpus.is_file():
+            t0 = time.perf_counter()
+            synthetic_novel(corpus, size, **{k: v for k, v in kwargs.items()
+                                             if k in _CORPUS_ARGS})
+            print(f"Generated {corpus} in {time.perf_counter() - t0:.1f}s")
+        mb = corpus.stat().st_size / 2 ** 20
+        stage_args = {k: v for k, v in kwargs.items() if k not in _CORPUS_ARGS}
+        timings = run_stages(corpus, **stage_args)
+        memory = run_stages(corpus, trace_memory=True, **stage_args) if trace_memory else {}
+        for name in STAGES:
+            t = timings[name]
+            row = {"size_mb": size, "stage": name, "seconds": round(t["seconds"], 4),
+                   "mb_per_s": round(mb / t["seconds"], 3) if name != "bm25_gap_violation" else None,
+                   "items": t["items"], "items_per_s": round(t["items"] / t["seconds"], 1)}
+            if name in memory:
+                row["peak_mb"] = round(memory[name]["peak_mb"], 2)
+            results.append(row)
+            print(f"  {size:>7g} MB  {name:<20} {t['seconds']:8.2f}s  "
+                  f"{row['items_per_s']:>12,.0f} items/s"
+                  + (f"  peak {row['peak_mb']:,.1f} MB" if "peak_mb" in row else ""))
+    return {
+        "meta": {"python": platform.python_version(), "numpy": np.__version__,
+                 "machine": platform.machine(), "cpus": os.cpu_count(),
+                 "max_rss_mb": round(max_rss_mb(), 1)},
+        "results": results,
+    }
+
+
+
+def regressions(report: dict, baseline: dict, max_slowdown: float = 0.25,
+                max_memory_growth: float = 0.15) -> list[str]:
+    """
+    Stages slower (items/s) or hungrier (tracemalloc peak) than the
+    baseline by more than the given fractions.  Only (size, stage) pairs
+    present in both are compared.
+    """
+    base = {(r["size_mb"], r["stage"]): r for r in baseline["results"]}
+    problems = []
+    for r in report["results"]:
+        b = base.get((r["size_mb"], r["stage"]))
+        if b is None:
+            continue
+        if r["items_per_s"] < b["items_per_s"] * (1 - max_slowdown):
+            problems.append(f"{r['stage']} @ {r['size_mb']:g} MB: {r['items_per_s']:,.0f} items/s "
+                            f"vs baseline {b['items_per_s']:,.0f}")
+        if "peak_mb" in r and "peak_mb" in b and r["peak_mb"] > b["peak_mb"] * (1 + max_memory_growth):
+            problems.append(f"{r['stage']} @ {r['size_mb']:g} MB: peak {r['peak_mb']:,.1f} MB "
+                            f"vs baseline {b['peak_mb']:,.1f} MB")
+    return problems
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(
+        description="Benchmark the chunking pipeline on synthetic novels (CPU only, no model).")
+    ap.add_argument("--sizes", type=float, nargs="+", default=[10],
+                    help="corpus sizes in MB (default 10; e.g. 10 100 1000)")
+    ap.add_argument("--work_dir", default=os.path.join(tempfile.gettempdir(), "chunker_benchmark"),
+                    help="where generated corpora are kept between runs")
+    ap.add_argument("--target", type=int, default=350)
+    ap.add_argument("--batch_size", type=int, default=256)
+    ap.add_argument("--bm25_boundaries", type=int, default=1000,
+                    help="joins checked with bm25_gap_violation per corpus (0 = all)")
+    ap.add_argument("--mean_paragraph_words", type=int, default=80)
+    ap.add_argument("--paragraph_sigma", type=float, default=0.6)
+    ap.add_argument("--sentence_words", type=int, default=14)
+    ap.add_argument("--entity_density", type=float, default=5.0,
+                    help="entity mentions per 1000 words (default 5)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--no_memory", action="store_true",
+                    help="skip the tracemalloc pass (halves the runtime)")
+    ap.add_argument("--output", default=None, help="write the JSON report here")
+    ap.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    ap.add_argument("--save_baseline", action="store_true",
+                    help="store this run as the baseline instead of comparing")
+    ap.add_argument("--max_slowdown", type=float, default=0.25)
+    ap.add_argument("--max_memory_growth", type=float, default=0.15)
+    args = ap.parse_args()
+
+    report = benchmark(args.sizes, Path(args.work_dir), trace_memory=not args.no_memory,
+                       target=args.target, batch_size=args.batch_size,
+                       bm25_boundaries=args.bm25_boundaries or None,
+                       mean_paragraph_words=args.mean_paragraph_words,
+                       paragraph_sigma=args.paragraph_sigma,
+                       sentence_words=args.sentence_words,
+                       entity_density=args.entity_density, seed=args.seed)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if args.save_baseline:
+        Path(args.baseline).write_text(text + "\n", encoding="utf-8")
+        print(f"Saved baseline to {args.baseline}")
+    elif Path(args.baseline).is_file():
+        problems = regressions(report, json.loads(Path(args.baseline).read_text(encoding="utf-8")),
+                               args.max_slowdown, args.max_memory_growth)
+        for p in problems:
+            print(f"REGRESSION: {p}")
+        if problems:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}.")
@@ -307,7 +307,7 @@ def save_dataset(
     dataset: Union[Dataset, DatasetDict, IterableDataset, IterableDatasetDict],
     output_path: str,
     save_format: str = "json"
-) -> None:
+) -> List[Path]:
     """
     Saves the converted dataset to the specified format.
     
@@ -315,6 +315,9 @@ def save_dataset(
         dataset: The converted dataset
         output_path: Path where to save the dataset
         save_format: Format to save in ('json', 'jsonl', 'parquet', 'hf_hub')
+        
+    Returns:
+        The files written locally (empty when pushing to the Hub)
     """
     output_path = Path(output_path)
     
@@ -340,6 +343,7 @@ def save_dataset(
                 dataset = Dataset.from_list(data)
         
         dataset.push_to_hub(str(output_path))
+        return []
     else:
         # Save locally
         output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -348,25 +352,27 @@ def save_dataset(
         if isinstance(dataset, (IterableDataset, IterableDatasetDict)):
             logger.info("Converting streaming dataset for local save...")
             if isinstance(dataset, IterableDatasetDict):
+                written = []
                 for split_name, streaming_split in dataset.items():
                     split_output = output_path.parent / f"{output_path.name}_{split_name}"
                     data = list(streaming_split)
                     split_dataset = Dataset.from_list(data)
-                    _save_single_dataset(split_dataset, split_output, save_format)
-                return
+                    written.append(_save_single_dataset(split_dataset, split_output, save_format))
+                return written
             else:
                 data = list(dataset)
                 dataset = Dataset.from_list(data)
         
         if isinstance(dataset, DatasetDict):
-            for split_name, split_dataset in dataset.items():
-                split_output = output_path.parent / f"{output_path.name}_{split_name}"
-                _save_single_dataset(split_dataset, split_output, save_format)
+            return [_save_single_dataset(split_dataset,
+                                         output_path.parent / f"{output_path.name}_{split_name}",
+                                         save_format)
+                    for split_name, split_dataset in dataset.items()]
         else:
-            _save_single_dataset(dataset, output_path, save_format)
+            return [_save_single_dataset(dataset, output_path, save_format)]
 
-def _save_single_dataset(dataset: Dataset, output_path: Path, save_format: str):
-    """Helper function to save a single dataset."""
+def _save_single_dataset(dataset: Dataset, output_path: Path, save_format: str) -> Path:
+    """Helper function to save a single dataset; returns the file written."""
     if save_format == "json":
         output_file = output_path.with_suffix('.json')
         logger.info(f"Saving dataset to: {output_file}")
@@ -384,6 +390,8 @@ def _save_single_dataset(dataset: Dataset, output_path: Path, save_format: str):
         
     else:
         raise ValueError(f"Unsupported save format: {save_format}")
+    
+    return output_file
 
 def validate_converted_sample(sample: Dict[str, Any]) -> bool:
     """
@@ -454,7 +462,7 @@ def main():
     parser.add_argument(
         "--validate",
         action="store_true",
-        help="Validate a sample of converted data"
+        help="Validate a sample of converted data (and, for jsonl, every written line)"
     )
     
     args = parser.parse_args()
@@ -493,7 +501,20 @@ def main():
                 return 1
         
         # Save the dataset
-        save_dataset(converted_dataset, args.output_path, args.format)
+        written = save_dataset(converted_dataset, args.output_path, args.format)
+        
+        # Validate every written line, not just the first sample
+        if args.validate and args.format == "jsonl":
+            from jsonl_validate import validate_jsonl
+            report = validate_jsonl(written, schema="messages")
+            for file_report in report["files"]:
+                logger.info(f"{file_report['path']}: {file_report['valid']}/{file_report['lines']} "
+                            f"lines valid")
+            for bad in report["bad_lines"][:20]:
+                logger.error(f"{bad['path']}:{bad['line']}: {bad['error']}")
+            if any(f["bad"] for f in report["files"]):
+                logger.error("Validation of written data failed ✗")
+                return 1
         
         logger.info("Conversion completed successfully!")
         return 0
@@ -0,0 +1,244 @@
+# dataset_mixer.py
+import glob
+import json
+import random
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from jsonl_validate import record_error
+from sharded_writer import ShardedJsonlWriter
+
+DEFAULT_SHARD_SIZE = 100_000
+
+
+@dataclass
+class MixSource:
+    path: str                       # file, directory or glob of .jsonl / .parquet files
+    weight: float
+    name: str | None = None
+    max_epochs: int | None = None   # passes over the source; None = the mix default
+
+    def files(self) -> list[Path]:
+        p = Path(self.path)
+        if p.is_dir():
+            found = sorted(p.glob("*.jsonl")) + sorted(p.glob("*.parquet"))
+        else:
+            found = [Path(f) for f in sorted(glob.glob(self.path))]
+        if not found:
+            raise FileNotFoundError(f"No .jsonl or .parquet files for source {self.path!r}")
+        return found
+
+
+def iter_records(path: Path, stats: dict, schema: str | None = None, batch_size: int = 1024):
+    """
+    Stream the dict records of one JSONL or Parquet file.  Empty, invalid,
+    non-object or (with *schema*) non-conforming records are skipped and
+    counted in ``stats["skipped"]``.
+    """
+    if path.suffix == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Reading Parquet sources requires pyarrow (pip install pyarrow)") from e
+        rows = (row for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+                for row in batch.to_pylist())
+    else:
+        def jsonl_rows():
+            with path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        yield None
+        rows = jsonl_rows()
+    for row in rows:
+        if row is None or (record_error(row, schema) if schema else not isinstance(row, dict)):
+            stats["skipped"] += 1
+            continue
+        yield row
+
+
+class _SourceStream:
+    """One source's records, epoch after epoch, through a seeded shuffle buffer."""
+
+    def __init__(self, source: MixSource, index: int, seed: int, max_epochs: int | None,
+                 shuffle_buffer: int, schema: str | None):
+        self.source, self.index, self.seed = source, index, seed
+        self.max_epochs, self.shuffle_buffer, self.schema = max_epochs, shuffle_buffer, schema
+        self.files = source.files()
+        self.stats = {"epochs": 0, "read": 0, "skipped": 0, "emitted": 0, "exhausted": False}
+        self._it = self._records()
+
+    def _epoch(self, epoch: int):
+        rng = random.Random(f"{self.seed}:{self.index}:{epoch}")
+        buffer = []
+        for path in self.files:
+            for record in iter_records(path, self.stats, self.schema):
+                self.stats["read"] += 1
+                if self.shuffle_buffer <= 0:  # source order
+                    yield record
+                    continue
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(record)
+                    continue
+                k = rng.randrange(len(buffer))
+                buffer[k], record = record, buffer[k]
+                yield record
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _records(self):
+        epoch = 0
+        while self.max_epochs is None or epoch < self.max_epochs:
+            self.stats["epochs"] = epoch + 1
+            empty = True
+            for record in self._epoch(epoch):
+                empty = False
+                yield record
+            if empty:
+                break  # a source without valid records would loop forever
+            epoch += 1
+
+    def next(self) -> dict | None:
+        record = next(self._it, None)
+        if record is None:
+            self.stats["exhausted"] = True
+        else:
+            self.stats["emitted"] += 1
+        return record
+
+
+def mix_datasets(sources: list[MixSource], output_dir: str | Path, seed: int = 42,
+                 replacement: bool = False, max_epochs: int | None = None,
+                 num_samples: int | None = None, stop_on_exhausted: bool = False,
+                 shuffle_buffer: int = 10_000, shard_size: int = DEFAULT_SHARD_SIZE,
+                 schema: str | None = None, resume: bool = False) -> dict:
+    """
+    Interleave *sources* by weight into ``output_dir/mix-NNNNN.jsonl`` shards
+    (``ShardedJsonlWriter``) plus ``manifest.json``, holding at most
+    ``shuffle_buffer`` records per source in memory.
+
+    Each output record comes from a source drawn with probability
+    proportional to its weight among the sources not yet exhausted, from a
+    ``seed``-ed generator, so a rerun is identical.  Without ``replacement``
+    every source is read once; with it a source restarts (reshuffled) when
+    it runs out, up to ``max_epochs`` passes (or the source's own
+    ``max_epochs``).  The mix ends after ``num_samples`` records, when every
+    source is exhausted or – with ``stop_on_exhausted``, keeping the ratios
+    exact – at the first exhausted source.  Returns the manifest, which has
+    the exact per-source counts of the whole mix and of every shard, with
+    the shards' sizes and checksums.  With ``resume`` the intact shards of
+    an interrupted run are kept and the mix continues after them; a run
+    with other sources, weights or mixing arguments is refused.
+    """
+    if replacement and num_samples is None and max_epochs is None \
+            and any(s.max_epochs is None for s in sources):
+        raise ValueError("Sampling with replacement needs num_samples or max_epochs to end")
+    if shuffle_buffer < 0:
+        raise ValueError("shuffle_buffer must be >= 0 (0 = source order)")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for i, s in enumerate(sources):
+        s.name = s.name or f"{Path(s.path).stem}_{i}"
+    if len({s.name for s in sources}) != len(sources):
+        raise ValueError("Source names must be unique")
+    streams = [_SourceStream(s, i, seed, (s.max_epochs or max_epochs) if replacement else 1,
+                             shuffle_buffer, schema)
+               for i, s in enumerate(sources)]
+    weights = np.array([s.weight for s in sources], dtype=np.float64)
+    if (weights < 0).any() or weights.sum() <= 0:
+        raise ValueError("Source weights must be non-negative with a positive sum")
+    active = weights > 0
+    rng = np.random.default_rng(seed)
+
+    run = {
+        "seed": seed, "replacement": replacement, "max_epochs": max_epochs,
+        "num_samples": num_samples, "stop_on_exhausted": stop_on_exhausted,
+        "shuffle_buffer": shuffle_buffer, "schema": schema,
+        "source_specs": [{"name": s.name, "path": s.path, "weight": s.weight,
+                          "max_epochs": s.max_epochs} for s in sources],
+    }
+    total = 0
+    with ShardedJsonlWriter(output_dir, "mix", max_records=shard_size, manifest="manifest.json",
+                            resume=resume, metadata=run) as writer:
+        while num_samples is None or total < num_samples:
+            if not active.any():
+                break
+            cum = np.cumsum(np.where(active, weights, 0.0))
+            k = min(int(np.searchsorted(cum, rng.random() * cum[-1], side="right")), len(cum) - 1)
+            record = streams[k].next()
+            if record is None:
+                active[k] = False
+                print(f"Source {sources[k].name} exhausted after "
+                      f"{streams[k].stats['emitted']} records.")
+                if stop_on_exhausted:
+                    break
+                continue
+            writer.write_record(record, sources[k].name)
+            total += 1
+
+        return writer.close(metadata={
+            "sources": [{"name": s.name, "path": s.path, "weight": s.weight,
+                         "target_fraction": round(s.weight / weights.sum(), 6),
+                         "fraction": round(st.stats["emitted"] / max(total, 1), 6),
+                         "files": [str(f) for f in st.files], **st.stats}
+                        for s, st in zip(sources, streams)],
+        })
+
+
+def parse_source(spec: str) -> MixSource:
+    """``[name=]path:weight`` → ``MixSource``."""
+    name, _, rest = spec.rpartition("=") if "=" in spec.split(":")[0] else ("", "", spec)
+    path, _, weight = rest.rpartition(":")
+    if not path:
+        raise ValueError(f"Expected [name=]path:weight, got {spec!r}")
+    return MixSource(path=path, weight=float(weight), name=name or None)
+
+
+if __name__ == "__main__":
+    import argparse
+    from jsonl_validate import SCHEMAS
+
+    ap = argparse.ArgumentParser(
+        description="Stream a weighted, seeded mixture of JSONL/Parquet datasets into sharded JSONL.")
+    ap.add_argument("--source", action="append", default=[], metavar="[NAME=]PATH:WEIGHT",
+                    help="a source (file, directory or glob) and its weight; repeat per source")
+    ap.add_argument("--config", default=None,
+                    help='JSON file: {"sources": [{"path", "weight", "name", "max_epochs"}, ...]}')
+    ap.add_argument("--output_dir", required=True)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--replacement", action="store_true",
+                    help="restart exhausted sources (bounded by --max_epochs / --num_samples)")
+    ap.add_argument("--max_epochs", type=int, default=None)
+    ap.add_argument("--num_samples", type=int, default=None, help="records to write (default: until exhausted)")
+    ap.add_argument("--stop_on_exhausted", action="store_true",
+                    help="stop at the first exhausted source instead of renormalising the weights")
+    ap.add_argument("--shuffle_buffer", type=int, default=10_000,
+                    help="records buffered per source for shuffling (0 = source order)")
+    ap.add_argument("--shard_size", type=int, default=DEFAULT_SHARD_SIZE, help="records per output shard")
+    ap.add_argument("--schema", choices=SCHEMAS, default=None,
+                    help="skip records that do not match this schema (see jsonl_validate.py)")
+    ap.add_argument("--resume", action="store_true",
+                    help="keep the intact shards of an interrupted run with the same arguments")
+    args = ap.parse_args()
+
+    sources = [parse_source(s) for s in args.source]
+    if args.config:
+        config = json.loads(Path(args.config).read_text(encoding="utf-8"))
+        sources += [MixSource(**s) for s in config["sources"]]
+    if not sources:
+        ap.error("give at least one --source or a --config")
+
+    manifest = mix_datasets(sources, args.output_dir, args.seed, args.replacement,
+                            args.max_epochs, args.num_samples, args.stop_on_exhausted,
+                            args.shuffle_buffer, args.shard_size, args.schema, args.resume)
+    for s in manifest["sources"]:
+        print(f"  {s['name']}: {s['emitted']} records ({s['fraction']:.1%}, target "
+              f"{s['target_fraction']:.1%}), {s['epochs']} epoch(s), {s['skipped']} skipped")
+    print(f"Wrote {manifest['total']['records']} records in {manifest['total']['shards']} shards "
+          f"to {args.output_dir}")
@@ -0,0 +1,38 @@
+# embedding_backends.py
+from typing import Protocol
+
+BACKENDS = ("sentence-transformers", "mlx")
+
+
+class EmbeddingModel(Protocol):
+    """What the chunkers need from an embedding model."""
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs): ...
+
+    def similarity(self, a, b): ...
+
+
+def load_embedding_model(model_name: str,
+                         backend: str = "sentence-transformers",
+                         device: str | None = None) -> EmbeddingModel:
+    """
+    Load *model_name* with the chosen backend.  Each backend is imported
+    only here, so ``--backend mlx`` never pulls in torch.
+
+    * ``sentence-transformers`` – ``SentenceTransformer(..., trust_remote_code=True)``
+    * ``mlx`` – :class:`mlx_embedder.MLXEmbedder` (ModernBERT-style
+      encoders); ``device`` is ``"gpu"`` (default) or ``"cpu"``
+    """
+    if backend == "sentence-transformers":
+        from sentence_transformers import SentenceTransformer
+        kwargs = {"device": device} if device else {}
+        return SentenceTransformer(model_name, trust_remote_code=True, **kwargs)
+    if backend == "mlx":
+        from mlx_embedder import MLXEmbedder
+        return MLXEmbedder(model_name, device=device or "gpu")
+    raise ValueError(f"unknown embedding backend {backend!r}; choose from {BACKENDS}")
+
+
+def cache_name(model_name: str, backend: str = "sentence-transformers") -> str:
+    """Embedding-cache key: backends differ in the last digits, so never share."""
+    return model_name if backend == "sentence-transformers" else f"{model_name}@{backend}"
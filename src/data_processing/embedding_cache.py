@@ -0,0 +1,144 @@
+# embedding_cache.py
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_MAX_MB = 512
+
+
+def text_key(prefix: str, text: str) -> str:
+    """Content address of one embedded window: hash of (prefix, text)."""
+    h = hashlib.sha1()
+    h.update(prefix.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    On-disk, content-addressed store of sentence embeddings.
+
+    One sub-directory per model holds
+
+    * ``vectors.f16`` – a memory-mapped ``float16`` matrix, one row per entry
+    * ``index.json``  – ``key → row`` in least-recently-used order
+
+    Entries are keyed by (model name, prefix, sha1 of text), so re-running
+    the chunker with a different ``--target`` reuses every window it has
+    already seen.  Once the matrix would exceed ``max_mb`` a batch of least
+    recently used rows is evicted and ``index.json`` rewritten before any of
+    them is overwritten, so the index on disk never maps a key to another
+    key's vector, even after a crash.  Vectors come back as ``float32``;
+    the fp16 round trip is far below the chunker's similarity thresholds.
+    """
+
+    def __init__(self, cache_dir: str | Path, model_name: str,
+                 max_mb: float = DEFAULT_MAX_MB):
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name)
+        self.root = Path(cache_dir) / safe_name
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.model_name = model_name
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.vec_path = self.root / "vectors.f16"
+        self.index_path = self.root / "index.json"
+
+        self.hits = 0
+        self.misses = 0
+        self.dim: int | None = None
+        self.index: OrderedDict[str, int] = OrderedDict()
+        self._vectors: np.memmap | None = None
+        self._allocated = 0          # rows handed out so far (high-water mark)
+        self._free: list[int] = []   # allocated rows no saved index refers to
+
+        if self.index_path.is_file() and self.vec_path.is_file():
+            meta = json.loads(self.index_path.read_text(encoding="utf-8"))
+            if meta.get("model_name") == model_name and meta.get("dim"):
+                self.dim = meta["dim"]
+                self.index = OrderedDict(meta["entries"])
+                if self.index:
+                    self._open(self._rows_on_disk())
+                    used = set(self.index.values())
+                    self._allocated = max(used) + 1
+                    self._free = sorted(set(range(self._allocated)) - used, reverse=True)
+
+    # --- storage ----------------------------------------------------------
+    @property
+    def capacity(self) -> int:
+        return max(1, self.max_bytes // (2 * self.dim))
+
+    def _rows_on_disk(self) -> int:
+        return self.vec_path.stat().st_size // (2 * self.dim)
+
+    def _open(self, rows: int) -> None:
+        if self._vectors is not None:
+            self._vectors.flush()
+        with open(self.vec_path, "ab") as f:
+            f.truncate(rows * self.dim * 2)
+        self._vectors = np.memmap(self.vec_path, dtype=np.float16,
+                                  mode="r+", shape=(rows, self.dim))
+
+    def _next_row(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._allocated < self.capacity:
+            rows = 0 if self._vectors is None else self._vectors.shape[0]
+            if self._allocated >= rows:
+                # grow geometrically, never past the size bound
+                self._open(min(self.capacity, max(1024, rows * 2)))
+            self._allocated += 1
+            return self._allocated - 1
+        # full → evict a batch of least recently used rows and save the index
+        # before reusing them: memmap pages may reach disk at any time
+        for _ in range(max(1, min(len(self.index), self.capacity // 64))):
+            self._free.append(self.index.popitem(last=False)[1])
+        self.save()
+        return self._free.pop()
+
+    # --- public API ---------------------------------------------------------
+    def get(self, prefix: str, text: str) -> np.ndarray | None:
+        key = text_key(prefix, text)
+        row = self.index.get(key)
+        if row is None:
+            self.misses += 1
+            return None
+        self.index.move_to_end(key)
+        self.hits += 1
+        return np.asarray(self._vectors[row], dtype=np.float32)
+
+    def put(self, prefix: str, text: str, emb) -> None:
+        emb = np.asarray(emb, dtype=np.float32).reshape(-1)
+        if self.dim is None:
+            self.dim = emb.shape[0]
+        key = text_key(prefix, text)
+        row = self.index.get(key)
+        if row is None:
+            row = self._next_row()
+        self._vectors[row] = emb
+        self.index[key] = row
+        self.index.move_to_end(key)
+
+    def save(self) -> None:
+        """Flush vectors and atomically rewrite the index."""
+        if self._vectors is None:
+            return
+        self._vectors.flush()
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({
+            "model_name": self.model_name,
+            "dim": self.dim,
+            "entries": list(self.index.items()),
+        }), encoding="utf-8")
+        os.replace(tmp, self.index_path)
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return (f"Embedding cache {self.root}: {self.hits} hits, "
+                f"{self.misses} misses ({rate:.1f}% hit rate), "
+                f"{len(self.index)} entries stored.")
@@ -0,0 +1,404 @@
+# embedding_server.py
+import ipaddress
+import os
+import queue
+import secrets
+import stat
+import tempfile
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import AuthenticationError, Client, Listener
+from pathlib import Path
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+SOCKET_NAME = "embedding_server.sock"
+AUTHKEY_NAME = "authkey"
+
+
+def cosine_similarity(a, b) -> np.ndarray:
+    """Cosine similarity matrix, as ``SentenceTransformer.similarity``."""
+    a = np.atleast_2d(np.asarray(a, dtype=np.float32))
+    b = np.atleast_2d(np.asarray(b, dtype=np.float32))
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return a @ b.T
+
+
+def runtime_dir() -> Path:
+    """
+    Per-user ``0700`` directory (under ``$XDG_RUNTIME_DIR`` or the temp
+    dir) holding the default socket and the authkey.  Requests are
+    pickles, so nobody else may connect.
+    """
+    path = Path(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()) \
+        / f"embedding_server-{os.getuid()}"
+    path.mkdir(mode=0o700, exist_ok=True)
+    st = path.lstat()
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{path} must be a directory owned by you with mode 0700")
+    return path
+
+
+def default_socket() -> str:
+    return str(runtime_dir() / SOCKET_NAME)
+
+
+def load_authkey(create: bool = False) -> bytes:
+    """
+    The random authkey in ``runtime_dir()/authkey`` (mode ``0600``); with
+    *create* (the server) it is generated first if missing.
+    """
+    path = runtime_dir() / AUTHKEY_NAME
+    if create and not path.exists():
+        tmp = path.with_name(f"{AUTHKEY_NAME}.{os.getpid()}.tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_bytes(32))
+        os.replace(tmp, path)
+    if path.stat().st_mode & 0o077:
+        raise PermissionError(f"{path} is readable by other users; chmod 600 it")
+    return path.read_bytes()
+
+
+def _check_loopback(host: str) -> None:
+    try:
+        loopback = host == "localhost" or ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        loopback = False
+    if not loopback:
+        raise ValueError(f"The embedding server only listens on loopback addresses, not {host!r}")
+
+
+def parse_address(address: str):
+    """
+    ``host:port`` → TCP address tuple (loopback hosts only); anything else
+    is a Unix socket path.
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        host = host.strip("[]") or "127.0.0.1"
+        _check_loopback(host)
+        return (host, int(port))
+    return address
+
+
+class MicroBatcher:
+    """
+    Merges concurrent encode requests into shared model batches.
+
+    Requests are queued by any number of threads; one worker thread takes
+    whatever arrives within ``max_wait`` seconds of the first request (or
+    until ``batch_size`` texts are waiting), encodes the distinct texts in
+    one ``model.encode`` call – behind an optional ``EmbeddingCache`` keyed
+    by the full text – and hands every request its rows.  If a batch
+    fails, every request in it gets the exception and the thread moves on
+    to the next batch.
+
+    ``metrics()`` reports queue depth, batch sizes and request latency.
+    """
+
+    def __init__(self, model, batch_size: int = 256, max_wait: float = 0.005,
+                 cache: EmbeddingCache | None = None, latency_window: int = 10000):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.cache = cache
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._latencies: deque[float] = deque(maxlen=latency_window)
+        self.requests = 0
+        self.texts = 0
+        self.encoded = 0
+        self.batches = 0
+        self.max_batch = 0
+        self.max_queue_depth = 0
+
+    def start(self) -> "MicroBatcher":
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def submit(self, texts: list[str], callback) -> None:
+        """
+        Queue *texts*; ``callback(embs, error)`` runs on the batching thread,
+        with ``error`` ``None`` on success and ``embs`` ``None`` on failure.
+        """
+        self._queue.put((time.monotonic(), list(texts), callback))
+
+    def encode(self, texts: list[str], timeout: float | None = None) -> np.ndarray:
+        """
+        Blocking encode through the shared batches; re-raises a failed
+        batch's error, and with a *timeout* raises ``TimeoutError`` after
+        that many seconds.
+        """
+        done = threading.Event()
+        out = []
+        self.submit(texts, lambda embs, error: (out.append((embs, error)), done.set()))
+        if not done.wait(timeout):
+            raise TimeoutError(f"No embeddings after {timeout} s "
+                               f"(batching thread alive: {self._thread.is_alive()})")
+        embs, error = out[0]
+        if error is not None:
+            raise error
+        return embs
+
+    def metrics(self) -> dict:
+        lat = np.asarray(self._latencies) * 1000.0
+        return {
+            "requests": self.requests,
+            "texts": self.texts,
+            "encoded": self.encoded,
+            "batches": self.batches,
+            "mean_batch": self.texts / self.batches if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "latency_ms": {
+                "p50": float(np.percentile(lat, 50)) if len(lat) else 0.0,
+                "p95": float(np.percentile(lat, 95)) if len(lat) else 0.0,
+                "max": float(lat.max()) if len(lat) else 0.0,
+            },
+        }
+
+    def _serve(self) -> None:
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize() + 1)
+            pending, waiting = [item], len(item[1])
+            deadline = time.monotonic() + self.max_wait
+            while waiting < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                pending.append(item)
+                waiting += len(item[1])
+            try:
+                self._encode(pending)
+            except Exception as exc:  # keep serving; the requests of this batch get the error
+                for _, _, callback in pending:
+                    self._answer(callback, None, exc)
+
+    @staticmethod
+    def _answer(callback, embs, error) -> None:
+        try:
+            callback(embs, error)
+        except Exception as exc:
+            print(f"Warning: embedding callback failed: {exc!r}", flush=True)
+
+    def _encode(self, pending: list) -> None:
+        vectors = {}
+        todo = []
+        for text in dict.fromkeys(t for _, texts, _ in pending for t in texts):
+            emb = self.cache.get("", text) if self.cache is not None else None
+            if emb is None:
+                todo.append(text)
+            else:
+                vectors[text] = emb
+        if todo:
+            embs = self.model.encode(todo, batch_size=self.batch_size)
+            for text, emb in zip(todo, embs):
+                vectors[text] = np.asarray(emb, dtype=np.float32)
+                if self.cache is not None:
+                    self.cache.put("", text, emb)
+        n_texts = sum(len(texts) for _, texts, _ in pending)
+        self.requests += len(pending)
+        self.texts += n_texts
+        self.encoded += len(todo)
+        self.batches += 1
+        self.max_batch = max(self.max_batch, n_texts)
+        now = time.monotonic()
+        for queued_at, texts, callback in pending:
+            self._answer(callback, np.stack([vectors[t] for t in texts]) if texts
+                         else np.zeros((0, 0), dtype=np.float32), None)
+            self._latencies.append(now - queued_at)
+
+
+def format_metrics(m: dict) -> str:
+    lat = m["latency_ms"]
+    return (f"{m['requests']} requests, {m['texts']} texts in {m['batches']} batches "
+            f"(mean {m['mean_batch']:.1f}, max {m['max_batch']}), {m['encoded']} encoded; "
+            f"queue depth {m['queue_depth']} (max {m['max_queue_depth']}); "
+            f"latency p50 {lat['p50']:.1f} ms, p95 {lat['p95']:.1f} ms, max {lat['max']:.1f} ms")
+
+
+def serve(model, model_name: str, address=None,
+          authkey: bytes | None = None, batch_size: int = 256,
+          max_wait: float = 0.005, cache: EmbeddingCache | None = None,
+          metrics_interval: float = 0.0, encode_timeout: float | None = None) -> None:
+    """
+    Keep *model* warm and answer ``EmbeddingClient`` connections on
+    *address* (a Unix socket path, by default ``default_socket()``, or a
+    loopback ``(host, port)``) until a client sends ``shutdown``.  Clients
+    must present *authkey* (default: ``load_authkey``).  Each connection is
+    served on its own thread, so concurrent chunker runs share the
+    ``MicroBatcher``; with ``encode_timeout`` a request whose batch takes
+    longer gets a ``TimeoutError`` reply.
+    """
+    address = address or default_socket()
+    if isinstance(address, tuple):
+        _check_loopback(address[0])
+    elif os.path.exists(address):
+        os.unlink(address)  # stale socket from an earlier run
+    authkey = authkey or load_authkey(create=True)
+    batcher = MicroBatcher(model, batch_size, max_wait, cache).start()
+    listener = Listener(address, authkey=authkey)
+    if isinstance(address, str):
+        os.chmod(address, 0o600)
+    stopping = threading.Event()
+
+    def handle(conn):
+        with conn:
+            while not stopping.is_set():
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                op = request.get("op")
+                if op == "encode":
+                    try:
+                        conn.send(batcher.encode(request["texts"], encode_timeout))
+                    except Exception as exc:  # sent as an error reply; the client raises it
+                        conn.send(RuntimeError(f"encode failed on the server: {exc!r}"))
+                elif op == "metrics":
+                    conn.send(batcher.metrics())
+                elif op == "info":
+                    conn.send({"model_name": model_name, "pid": os.getpid()})
+                elif op == "shutdown":
+                    conn.send(True)
+                    stopping.set()
+                    Client(address, authkey=authkey).close()  # wake accept()
+                    return
+                else:
+                    conn.send(ValueError(f"unknown op {op!r}"))
+
+    def report():
+        while not stopping.wait(metrics_interval):
+            print(format_metrics(batcher.metrics()), flush=True)
+
+    if metrics_interval > 0:
+        threading.Thread(target=report, daemon=True).start()
+    print(f"Serving {model_name} on {address}", flush=True)
+    try:
+        while not stopping.is_set():
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError, ConnectionError) as exc:
+                print(f"Warning: refused a connection: {exc!r}", flush=True)
+                continue
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+    finally:
+        listener.close()
+        batcher.close()
+        if cache is not None:
+            cache.save()
+        print(format_metrics(batcher.metrics()), flush=True)
+
+
+class EmbeddingClient:
+    """
+    Drop-in for the ``SentenceTransformer`` in ``refine_boundaries``: the
+    same ``encode`` / ``similarity`` surface, backed by a running
+    ``embedding_server.py`` so no model is loaded in this process.
+    """
+
+    def __init__(self, address=None, authkey: bytes | None = None):
+        address = address or default_socket()
+        if isinstance(address, str):
+            address = parse_address(address)
+        self._conn = Client(address, authkey=authkey or load_authkey())
+        self._lock = threading.Lock()
+
+    def _call(self, request: dict):
+        with self._lock:
+            self._conn.send(request)
+            reply = self._conn.recv()
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def encode(self, sentences, batch_size: int | None = None, **kwargs):
+        single = isinstance(sentences, str)
+        embs = self._call({"op": "encode",
+                           "texts": [sentences] if single else list(sentences)})
+        return embs[0] if single else embs
+
+    similarity = staticmethod(cosine_similarity)
+
+    def info(self) -> dict:
+        return self._call({"op": "info"})
+
+    def metrics(self) -> dict:
+        return self._call({"op": "metrics"})
+
+    def shutdown(self) -> None:
+        self._call({"op": "shutdown"})
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    from embedding_backends import BACKENDS, cache_name, load_embedding_model
+    from embedding_cache import DEFAULT_MAX_MB
+
+    ap = argparse.ArgumentParser(
+        description="Resident embedding server for semantic_chunker.py --embedding_server.")
+    ap.add_argument("--model_name", default="lightonai/modernbert-embed-large")
+    ap.add_argument("--backend", choices=BACKENDS, default="sentence-transformers")
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--address", default=None,
+                    help="Unix socket path or loopback host:port "
+                         "(default: embedding_server.sock in a per-user 0700 directory)")
+    ap.add_argument("--batch_size", type=int, default=256)
+    ap.add_argument("--max_wait_ms", type=float, default=5.0,
+                    help="how long a request waits for others to share its batch")
+    ap.add_argument("--cache_dir", default=None)
+    ap.add_argument("--cache_max_mb", type=int, default=DEFAULT_MAX_MB)
+    ap.add_argument("--metrics_interval", type=float, default=60.0,
+                    help="seconds between metrics lines (0 = only at exit)")
+    ap.add_argument("--encode_timeout", type=float, default=None,
+                    help="seconds before a request waiting for its batch fails (default: no limit)")
+    ap.add_argument("--status", action="store_true",
+                    help="print the metrics of the running server and exit")
+    ap.add_argument("--stop", action="store_true",
+                    help="shut the running server down and exit")
+    args = ap.parse_args()
+
+    if args.status or args.stop:
+        client = EmbeddingClient(args.address)
+        print(client.info())
+        print(format_metrics(client.metrics()))
+        if args.stop:
+            client.shutdown()
+        client.close()
+    else:
+        t0 = time.perf_counter()
+        model = load_embedding_model(args.model_name, args.backend, args.device)
+        model.encode("warm-up")  # the mlx backend loads its weights lazily
+        print(f"Loaded {args.model_name} in {time.perf_counter() - t0:.1f}s")
+        cache = None
+        if args.cache_dir:
+            cache = EmbeddingCache(args.cache_dir, cache_name(args.model_name, args.backend),
+                                   args.cache_max_mb)
+        serve(model, args.model_name, args.address and parse_address(args.address),
+              batch_size=args.batch_size, max_wait=args.max_wait_ms / 1000.0,
+              cache=cache, metrics_interval=args.metrics_interval,
+              encode_timeout=args.encode_timeout)
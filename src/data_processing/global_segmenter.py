@@ -0,0 +1,237 @@
+# global_segmenter.py
+import numpy as np
+
+from chunk_index import BookBuffer, SpanChunk
+from embedding_cache import EmbeddingCache
+
+# a segment under min_size is allowed only at this cost, so the DP always
+# has a solution (e.g. a short paragraph wedged between two huge ones)
+_SHORT_PENALTY = 1e3
+
+
+def paragraph_embeddings(model,
+                         paragraphs: list[str],
+                         doc_prefix: str = "",
+                         batch_size: int = 256,
+                         cache: EmbeddingCache | None = None) -> np.ndarray:
+    """
+    Embed every distinct paragraph exactly once, in batches of
+    ``batch_size``.  Returns an ``(n, dim)`` array of L2-normalised rows.
+    """
+    rows: dict[str, np.ndarray] = {}
+    todo = []
+    for p in dict.fromkeys(paragraphs):
+        emb = cache.get(doc_prefix, p) if cache is not None else None
+        if emb is None:
+            todo.append(p)
+        else:
+            rows[p] = emb
+    if todo:
+        embs = model.encode([doc_prefix + p for p in todo], batch_size=batch_size)
+        for p, emb in zip(todo, embs):
+            rows[p] = emb
+            if cache is not None:
+                cache.put(doc_prefix, p, emb)
+    embs = np.asarray([rows[p] for p in paragraphs], dtype=np.float32)
+    norms = np.linalg.norm(embs, axis=1, keepdims=True)
+    return embs / np.maximum(norms, 1e-12)
+
+
+def gap_similarity(embs: np.ndarray, window: int = 2) -> np.ndarray:
+    """
+    Cosine similarity across each of the ``n - 1`` gaps between paragraphs:
+    mean of the ``window`` paragraphs before gap *g* (between paragraphs
+    ``g - 1`` and ``g``) against the mean of the ``window`` after it.
+    Entry ``g - 1`` belongs to gap *g*.
+    """
+    n = len(embs)
+    if n < 2:
+        return np.zeros(0, dtype=np.float32)
+    csum = np.vstack([np.zeros((1, embs.shape[1]), dtype=np.float64),
+                      np.cumsum(embs, axis=0, dtype=np.float64)])
+    g = np.arange(1, n)
+    left = csum[g] - csum[np.maximum(g - window, 0)]
+    right = csum[np.minimum(g + window, n)] - csum[g]
+    dots = np.einsum("ij,ij->i", left, right)
+    norms = np.linalg.norm(left, axis=1) * np.linalg.norm(right, axis=1)
+    return (dots / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def depth_scores(sim: np.ndarray) -> np.ndarray:
+    """
+    TextTiling depth of every gap: how far its similarity sits below the
+    peaks reached by climbing the curve to the left and to the right.
+    """
+    n = len(sim)
+    left_peak = np.empty(n, dtype=np.float64)
+    right_peak = np.empty(n, dtype=np.float64)
+    for g in range(n):
+        # climbing stops where the curve turns down again
+        if g and sim[g - 1] >= sim[g]:
+            left_peak[g] = max(left_peak[g - 1], sim[g - 1])
+        else:
+            left_peak[g] = sim[g]
+    for g in range(n - 1, -1, -1):
+        if g < n - 1 and sim[g + 1] >= sim[g]:
+            right_peak[g] = max(right_peak[g + 1], sim[g + 1])
+        else:
+            right_peak[g] = sim[g]
+    return (left_peak - sim) + (right_peak - sim)
+
+
+def segment_dp(size_prefix: np.ndarray,
+               cut_cost: np.ndarray,
+               target: int,
+               min_size: int,
+               max_size: int,
+               size_weight: float = 1.0) -> list[tuple[int, int]]:
+    """
+    Choose all boundaries jointly.
+
+    Minimises ``sum(cut_cost at each boundary) + size_weight * sum(((size -
+    target) / target) ** 2 over segments)`` subject to ``size <= max_size``
+    (a single paragraph may exceed it, as in ``chunk_paragraphs``) and
+    ``size >= min_size`` (a soft bound, see ``_SHORT_PENALTY``).
+
+    ``size_prefix`` holds prefix sums of paragraph sizes with a leading 0
+    (``count_prefix``); ``cut_cost[g - 1]`` is the cost of a boundary at
+    gap *g*.  The segments ending at each paragraph are the contiguous range
+    of starts the two size bounds allow, so the DP is O(n·k) for segments
+    of at most *k* paragraphs.  Returns paragraph spans ``[start, end)``.
+    """
+    prefix = np.asarray(size_prefix, dtype=np.int64)
+    n = len(prefix) - 1
+    if n == 0:
+        return []
+    end_cost = np.concatenate(([0.0], np.asarray(cut_cost, dtype=np.float64), [0.0]))
+    best = np.full(n + 1, np.inf)
+    best[0] = 0.0
+    back = np.zeros(n + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        lo = min(int(np.searchsorted(prefix, prefix[i] - max_size, side="left")), i - 1)
+        hi = int(np.searchsorted(prefix, prefix[i] - min_size, side="right")) - 1
+        starts = np.arange(lo, i)
+        sizes = prefix[i] - prefix[starts]
+        cost = best[lo:i] + size_weight * ((sizes - target) / target) ** 2
+        cost = cost + np.where(starts > hi, _SHORT_PENALTY, 0.0)
+        k = int(np.argmin(cost))
+        best[i] = cost[k] + end_cost[i]
+        back[i] = lo + k
+    spans = []
+    i = n
+    while i > 0:
+        spans.append((int(back[i]), i))
+        i = int(back[i])
+    return spans[::-1]
+
+
+def global_segment(buffer: BookBuffer,
+                   model,
+                   target: int,
+                   min_size: int | None = None,
+                   max_size: int | None = None,
+                   size_prefix: np.ndarray | None = None,
+                   window: int = 2,
+                   size_weight: float = 1.0,
+                   doc_prefix: str = "",
+                   batch_size: int = 256,
+                   cache: EmbeddingCache | None = None,
+                   embs: np.ndarray | None = None) -> list[SpanChunk]:
+    """
+    Segment a whole book in one shot: embed each paragraph once, score
+    every gap by TextTiling depth on the ``window``-smoothed similarity
+    curve, and pick the boundaries with ``segment_dp``.
+
+    Sizes are words (``buffer.word_prefix``) unless ``size_prefix`` gives
+    another measure, e.g. token counts.  ``min_size``/``max_size`` default
+    to half and one and a half times ``target``.  Pass ``embs`` to reuse
+    paragraph embeddings across several targets.
+    """
+    if embs is None:
+        paragraphs = [buffer.paragraph(i) for i in range(len(buffer))]
+        embs = paragraph_embeddings(model, paragraphs, doc_prefix, batch_size, cache)
+    if size_prefix is None:
+        size_prefix = np.asarray(buffer.word_prefix, dtype=np.int64)
+    min_size = target // 2 if min_size is None else min_size
+    max_size = target + target // 2 if max_size is None else max_size
+    cut_cost = -depth_scores(gap_similarity(embs, window))
+    spans = segment_dp(size_prefix, cut_cost, target, min_size, max_size, size_weight)
+    return [SpanChunk(buffer, s, e) for s, e in spans]
+
+
+if __name__ == "__main__":
+    import argparse, time
+    from baseline_chunker import iter_paragraphs, chunk_buffer
+    from semantic_chunker import refine_boundaries, DOC_PREFIX
+    from embedding_backends import BACKENDS, load_embedding_model
+
+    class _CountingModel:
+        """Counts encode calls and encoded texts of the wrapped model."""
+
+        def __init__(self, model):
+            self.model, self.calls, self.texts = model, 0, 0
+
+        def encode(self, sentences, **kwargs):
+            self.calls += 1
+            self.texts += 1 if isinstance(sentences, str) else len(sentences)
+            return self.model.encode(sentences, **kwargs)
+
+        def similarity(self, a, b):
+            return self.model.similarity(a, b)
+
+    def _quality(chunks, embs, min_size, max_size):
+        sim = gap_similarity(embs, window=1)
+        depth = depth_scores(gap_similarity(embs))
+        gaps = np.array([c.start - 1 for c in chunks[1:]], dtype=np.int64)
+        sizes = np.array([c.n_words for c in chunks])
+        # mean similarity of adjacent paragraphs *inside* chunks
+        inner = np.ones(len(sim), dtype=bool)
+        inner[gaps] = False
+        return (f"{len(chunks)} chunks, boundary sim {sim[gaps].mean():.3f} "
+                f"(inside {sim[inner].mean():.3f}), boundary depth {depth[gaps].mean():.3f}, "
+                f"words {sizes.mean():.0f}±{sizes.std():.0f} [{sizes.min()}, {sizes.max()}], "
+                f"{np.mean((sizes < min_size) | (sizes > max_size)):.1%} outside "
+                f"[{min_size}, {max_size}]")
+
+    ap = argparse.ArgumentParser(
+        description="Benchmark global DP segmentation against refine_boundaries.")
+    ap.add_argument("book_path")
+    ap.add_argument("--target", type=int, default=350)
+    ap.add_argument("--model_name", default="lightonai/modernbert-embed-large")
+    ap.add_argument("--backend", choices=BACKENDS, default="sentence-transformers")
+    ap.add_argument("--batch_size", type=int, default=256)
+    ap.add_argument("--window", type=int, default=2,
+                    help="paragraphs averaged either side of a gap (default 2)")
+    ap.add_argument("--size_weight", type=float, default=1.0)
+    args = ap.parse_args()
+
+    model = load_embedding_model(args.model_name, args.backend)
+    buffer = BookBuffer(iter_paragraphs(args.book_path))
+    min_size, max_size = args.target // 2, args.target + args.target // 2
+    print(f"{len(buffer)} paragraphs, {buffer.word_prefix[-1]} words")
+
+    counted = _CountingModel(model)
+    t0 = time.perf_counter()
+    refined, _ = refine_boundaries(chunk_buffer(buffer, int(args.target * 0.9)),
+                                   model=counted, batch_size=args.batch_size)
+    t_refine = time.perf_counter() - t0
+    refine_calls, refine_texts = counted.calls, counted.texts
+
+    counted = _CountingModel(model)
+    t0 = time.perf_counter()
+    paragraphs = [buffer.paragraph(i) for i in range(len(buffer))]
+    embs = paragraph_embeddings(counted, paragraphs, DOC_PREFIX, args.batch_size)
+    t_embed = time.perf_counter() - t0
+    segmented = global_segment(buffer, counted, args.target, min_size, max_size,
+                               window=args.window, size_weight=args.size_weight,
+                               embs=embs)
+    t_dp = time.perf_counter() - t0
+
+    print(f"refine_boundaries: {t_refine:.2f}s, {refine_calls} encode calls, "
+          f"{refine_texts} texts encoded")
+    print(f"global DP:         {t_dp:.2f}s ({t_embed:.2f}s embedding), "
+          f"{counted.calls} encode calls, {counted.texts} texts encoded")
+    print("Quality, scored with the per-paragraph embeddings (lower boundary sim "
+          "and higher depth are better):")
+    print(f"  refine_boundaries: {_quality(refined, embs, min_size, max_size)}")
+    print(f"  global DP:         {_quality(segmented, embs, min_size, max_size)}")
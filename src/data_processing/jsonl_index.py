@@ -0,0 +1,163 @@
+# jsonl_index.py
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 2  # 2: whitespace-only lines are skipped
+_MAGIC = b"JSONLIDX"
+_HEADER = struct.Struct("<8sIIQqQ")  # magic, version, reserved, file size, mtime_ns, lines
+_SPACE = np.zeros(256, dtype=bool)
+_SPACE[list(b" \t\n\r\x0b\x0c")] = True  # what bytes.strip() removes
+
+
+def index_path(path: str | Path) -> Path:
+    """``train.jsonl`` → ``train.jsonl.idx``."""
+    return Path(str(path) + INDEX_SUFFIX)
+
+
+def _blank(f, start: int, end: int) -> bool:
+    f.seek(start)
+    while start < end:
+        chunk = f.read(min(end - start, 1 << 16))
+        if chunk.strip():
+            return False
+        start += len(chunk)
+    return True
+
+
+def line_offsets(path: str | Path, block_size: int = 1 << 24) -> np.ndarray:
+    """
+    Byte offsets (``uint64``) of the non-blank lines of *path*, found in one
+    streaming pass of ``block_size`` reads.  Lines holding only whitespace
+    count as blank, as they do for every reader that strips lines.
+    """
+    starts, firsts, size, at_start = [], [], 0, True
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            data = np.frombuffer(block, dtype=np.uint8)
+            s = np.flatnonzero(data[:-1] == 10) + 1  # lines starting inside this block
+            if at_start:
+                s = np.concatenate(([0], s))
+            starts.append(s + size)
+            firsts.append(data[s])
+            at_start = block.endswith(b"\n")
+            size += len(block)
+        if not starts:
+            return np.zeros(0, dtype=np.uint64)
+        starts, firsts = np.concatenate(starts), np.concatenate(firsts)
+        ends = np.append(starts[1:], size)
+        keep = ~_SPACE[firsts]
+        # a line starting with whitespace other than its newline may still be blank
+        for i in np.flatnonzero(~keep & (firsts != 10)).tolist():
+            keep[i] = not _blank(f, int(starts[i]), int(ends[i]))
+    return starts[keep].astype(np.uint64)
+
+
+def build_index(path: str | Path) -> Path:
+    """
+    Write the ``.idx`` sidecar of *path*: a header with the file's size and
+    mtime (to detect a stale index) followed by the ``uint64`` line offsets.
+    """
+    path = Path(path)
+    stat = path.stat()
+    offsets = line_offsets(path)
+    target = index_path(path)
+    tmp = target.with_name(target.name + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(_HEADER.pack(_MAGIC, INDEX_VERSION, 0, stat.st_size, stat.st_mtime_ns, len(offsets)))
+        offsets.tofile(f)
+    os.replace(tmp, target)
+    return target
+
+
+def load_offsets(path: str | Path, build: bool = True) -> np.ndarray:
+    """
+    Line offsets of *path* from its sidecar, (re)building it when it is
+    missing or stale.  Where the sidecar cannot be written (read-only
+    data) the offsets are computed in memory.  With ``build=False`` a
+    missing or stale index raises ``FileNotFoundError``.
+    """
+    path = Path(path)
+    stat = path.stat()
+    idx = index_path(path)
+    if idx.is_file() and idx.stat().st_size >= _HEADER.size:
+        with idx.open("rb") as f:
+            magic, version, _, size, mtime_ns, count = _HEADER.unpack(f.read(_HEADER.size))
+        if (magic, version, size, mtime_ns) == (_MAGIC, INDEX_VERSION, stat.st_size, stat.st_mtime_ns) \
+                and idx.stat().st_size == _HEADER.size + 8 * count:
+            if not count:
+                return np.zeros(0, dtype=np.uint64)
+            return np.memmap(idx, dtype=np.uint64, mode="r", offset=_HEADER.size, shape=(count,))
+    if not build:
+        raise FileNotFoundError(f"No up-to-date index for {path}")
+    try:
+        build_index(path)
+    except OSError as e:
+        print(f"Warning: Could not write {idx} ({e}); indexing in memory.")
+        return line_offsets(path)
+    return load_offsets(path, build=False)
+
+
+class JsonlIndex:
+    """
+    O(1) random access to the non-empty lines of a JSONL file through its
+    ``.idx`` sidecar: ``index.line(i)`` is the raw bytes of line *i*,
+    ``index[i]`` the parsed record.
+    """
+
+    def __init__(self, path: str | Path, build: bool = True):
+        self.path = Path(path)
+        self.offsets = load_offsets(self.path, build)
+        self._file = self.path.open("rb")
+        self._mm = (mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                    if self.path.stat().st_size else b"")
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def line(self, i: int) -> bytes:
+        start = int(self.offsets[i])
+        end = self._mm.find(b"\n", start)
+        return self._mm[start:end if end >= 0 else len(self._mm)].rstrip(b"\r")
+
+    def __getitem__(self, i: int):
+        return json.loads(self.line(i))
+
+    def sample(self, num_samples: int, seed: int) -> np.ndarray:
+        """``num_samples`` distinct line numbers in a ``seed``-determined random order."""
+        rng = np.random.default_rng(seed)
+        return rng.choice(len(self), size=min(num_samples, len(self)), replace=False)
+
+    def shard(self, shard: int, num_shards: int) -> range:
+        """Line numbers of contiguous shard ``shard`` of ``num_shards`` (sizes differ by ≤ 1)."""
+        return range(shard * len(self) // num_shards, (shard + 1) * len(self) // num_shards)
+
+    def close(self) -> None:
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Build (or refresh) .idx line-offset sidecars for JSONL files.")
+    ap.add_argument("input_files", nargs="+")
+    ap.add_argument("--force", action="store_true", help="rebuild even if the index is up to date")
+    args = ap.parse_args()
+
+    for f in args.input_files:
+        if args.force:
+            build_index(f)
+        print(f"{index_path(f)}: {len(load_offsets(f))} lines")
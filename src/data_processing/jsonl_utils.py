@@ -1,9 +1,35 @@
 import json
+import mmap
 import random
+import re
+import tempfile
+from array import array
+from contextlib import ExitStack
 from pathlib import Path
 from typing import List, Any, Dict
 
-def shuffle_jsonl(input_path: str | Path, output_path: str | Path, seed: int) -> None:
+import numpy as np
+
+from jsonl_index import JsonlIndex
+from sharded_writer import ShardedJsonlWriter
+
+DEFAULT_SHUFFLE_MEMORY_MB = 1024
+_TEXT_LINE = re.compile(rb"[^\r\n]*(?:\r\n?|\n)|[^\r\n]+")
+
+def _open_output(output_path: Path, shard_records: int | None = None,
+                 shard_bytes: int | None = None, binary: bool = False):
+    """
+    *output_path* itself or, with a shard limit, a ``ShardedJsonlWriter`` of
+    ``<stem>-NNNNN.jsonl`` shards and ``<stem>.manifest.json`` next to it.
+    """
+    if shard_records or shard_bytes:
+        return ShardedJsonlWriter(output_path.parent, output_path.stem, shard_records, shard_bytes)
+    return open(output_path, "wb") if binary else open(output_path, "w", encoding="utf-8")
+
+def shuffle_jsonl(input_path: str | Path, output_path: str | Path, seed: int,
+                  low_memory: bool = False,
+                  max_memory_mb: float = DEFAULT_SHUFFLE_MEMORY_MB,
+                  shard_records: int | None = None, shard_bytes: int | None = None) -> None:
     """
     Reads a JSONL file, shuffles its lines randomly using a seed,
     and writes the shuffled lines to a new JSONL file.
@@ -12,11 +38,24 @@ def shuffle_jsonl(input_path: str | Path, output_path: str | Path, seed: int) ->
         input_path: Path to the input JSONL file.
         output_path: Path to save the shuffled output JSONL file.
         seed: Random seed for shuffling.
+        low_memory: Shuffle byte offsets instead of parsed objects (see
+            ``offset_shuffle_jsonl``); the output is byte-identical.
+        max_memory_mb: With ``low_memory``, data larger than this is
+            shuffled through on-disk buckets.
+        shard_records, shard_bytes: Write ``<stem>-NNNNN.jsonl`` shards of at
+            most this many lines / bytes plus a manifest (see
+            ``sharded_writer.py``) instead of one file.
     """
     input_path = Path(input_path)
     output_path = Path(output_path)
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
+    if low_memory:
+        offset_shuffle_jsonl([input_path], output_path, seed, objects_only=False,
+                             max_memory_mb=max_memory_mb, shard_records=shard_records,
+                             shard_bytes=shard_bytes)
+        return
+
     lines: List[Dict[str, Any]] = []
     with open(input_path, "r", encoding="utf-8") as infile:
         for line in infile:
@@ -31,7 +70,7 @@ def shuffle_jsonl(input_path: str | Path, output_path: str | Path, seed: int) ->
     random.shuffle(lines)
     print(f"Shuffled {len(lines)} lines using seed {seed}.")
 
-    with open(output_path, "w", encoding="utf-8") as outfile:
+    with _open_output(output_path, shard_records, shard_bytes) as outfile:
         for item in lines:
             outfile.write(json.dumps(item, ensure_ascii=False) + "\n")
 
@@ -39,7 +78,9 @@ def shuffle_jsonl(input_path: str | Path, output_path: str | Path, seed: int) ->
 
 
 def concatenate_and_shuffle_jsonl(
-    input_paths: List[str | Path], output_path: str | Path, seed: int
+    input_paths: List[str | Path], output_path: str | Path, seed: int,
+    low_memory: bool = False, max_memory_mb: float = DEFAULT_SHUFFLE_MEMORY_MB,
+    shard_records: int | None = None, shard_bytes: int | None = None
 ) -> None:
     """
     Loads multiple JSONL files, concatenates their contents, shuffles the combined
@@ -49,10 +90,23 @@ def concatenate_and_shuffle_jsonl(
         input_paths: A list of paths to the input JSONL files.
         output_path: Path to save the concatenated and shuffled output JSONL file.
         seed: Random seed for shuffling.
+        low_memory: Shuffle byte offsets instead of parsed objects (see
+            ``offset_shuffle_jsonl``); the output is byte-identical.
+        max_memory_mb: With ``low_memory``, data larger than this is
+            shuffled through on-disk buckets.
+        shard_records, shard_bytes: Write ``<stem>-NNNNN.jsonl`` shards of at
+            most this many lines / bytes plus a manifest (see
+            ``sharded_writer.py``) instead of one file.
     """
     output_path = Path(output_path)
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
+    if low_memory:
+        offset_shuffle_jsonl(input_paths, output_path, seed, objects_only=True,
+                             max_memory_mb=max_memory_mb, shard_records=shard_records,
+                             shard_bytes=shard_bytes)
+        return
+
     all_lines: List[Dict[str, Any]] = []
     total_lines_read = 0
     for input_path_str in input_paths:
@@ -96,7 +150,7 @@ def concatenate_and_shuffle_jsonl(
     if not all_lines:
         print("Warning: No lines were read from any input file. Output file will be empty.")
         # Create an empty file
-        with open(output_path, "w", encoding="utf-8") as outfile:
+        with _open_output(output_path, shard_records, shard_bytes) as outfile:
             pass
         print(f"Created empty output file at {output_path}.")
         return
@@ -106,7 +160,7 @@ def concatenate_and_shuffle_jsonl(
     print(f"Shuffled {len(all_lines)} combined lines using seed {seed}.")
 
     # Revert to default newline handling by removing newline=''
-    with open(output_path, "w", encoding="utf-8") as outfile:
+    with _open_output(output_path, shard_records, shard_bytes) as outfile:
         for i, item in enumerate(all_lines):
              # Add a check just in case non-dict items slipped through (shouldn't happen with current read logic)
             if not isinstance(item, dict):
@@ -123,6 +177,190 @@ def concatenate_and_shuffle_jsonl(
 
     print(f"Saved concatenated and shuffled data to {output_path}.")
 
+
+def _text_lines(infile):
+    """
+    Raw lines of binary *infile*, split where text-mode iteration splits
+    them: at ``\\n``, ``\\r\\n`` and a lone ``\\r``.
+    """
+    for raw in infile:
+        i = raw.find(b"\r")
+        if i < 0 or i == len(raw) - 1 or (i == len(raw) - 2 and raw.endswith(b"\r\n")):
+            yield raw
+        else:
+            yield from _TEXT_LINE.findall(raw)
+
+
+def _index_valid_lines(input_paths: List[Path], spill, objects_only: bool):
+    """
+    One pass over the inputs: ``(source, offset, size)`` of every line the
+    in-memory functions would keep, pointing at the bytes they would write
+    (minus the newline).  A line already in that form is referenced in
+    place; any other (e.g. written with ``ensure_ascii=True``) has its
+    canonical form appended to *spill*, which is source ``len(input_paths)``.
+    """
+    src, off, size = array("l"), array("q"), array("q")
+    spill_id = len(input_paths)
+    for s, input_path in enumerate(input_paths):
+        n_valid, offset = 0, 0
+        with open(input_path, "rb") as infile:
+            for line_num, raw in enumerate(_text_lines(infile), 1):
+                start, offset = offset, offset + len(raw)
+                stripped = raw.decode("utf-8").strip()
+                if objects_only and not stripped:
+                    continue
+                try:
+                    obj = json.loads(stripped)
+                except json.JSONDecodeError as e:
+                    print(f"Warning: Skipping invalid JSON on line {line_num} in {input_path}: {e}")
+                    continue
+                if objects_only and not isinstance(obj, dict):
+                    print(f"Warning: Skipping non-object JSON on line {line_num} in {input_path}: Type={type(obj)}")
+                    continue
+                canonical = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+                body = raw.rstrip(b"\r\n")
+                if body == canonical:
+                    src.append(s); off.append(start); size.append(len(body))
+                else:
+                    src.append(spill_id); off.append(spill.tell()); size.append(len(canonical))
+                    spill.write(canonical)
+                n_valid += 1
+        print(f"Indexed {n_valid} valid lines of {input_path}.")
+    return (np.frombuffer(src, dtype=np.int64 if src.itemsize == 8 else np.int32),
+            np.frombuffer(off, dtype=np.int64), np.frombuffer(size, dtype=np.int64))
+
+
+def offset_shuffle_jsonl(input_paths: List[str | Path], output_path: str | Path, seed: int,
+                         objects_only: bool = True,
+                         max_memory_mb: float = DEFAULT_SHUFFLE_MEMORY_MB,
+                         shard_records: int | None = None,
+                         shard_bytes: int | None = None) -> int:
+    """
+    Shuffle the lines of one or more JSONL files without holding them in memory.
+
+    Only ``(source, offset, size)`` per valid line is kept.  The index array
+    is permuted with ``random.seed(seed); random.shuffle`` – the same
+    permutation the in-memory functions apply to their list of objects – and
+    the raw bytes are copied from memory-mapped inputs.  Validity and output
+    bytes match ``concatenate_and_shuffle_jsonl`` (``objects_only=True``) or
+    ``shuffle_jsonl`` (``objects_only=False``) exactly; lines whose bytes
+    differ from the canonical ``json.dumps(..., ensure_ascii=False)`` form are
+    re-serialised once into a spill file during the scan.  Lines end where
+    text-mode reading ends them: at ``\\n``, ``\\r\\n`` or a lone ``\\r``.
+
+    When the kept bytes exceed ``max_memory_mb`` the copy runs as a two-pass
+    bucketed external shuffle instead of random reads: lines are first
+    appended, in input order, to the bucket of their output range, then each
+    bucket (at most ``max_memory_mb``) is ordered in memory and written out.
+    ``shard_records`` / ``shard_bytes`` shard the output as in the other
+    functions.  Returns the number of lines written.
+    """
+    paths = [Path(p) for p in input_paths]
+    missing = [p for p in paths if not p.is_file()]
+    for p in missing:
+        print(f"Warning: Input file not found, skipping: {p}")
+    paths = [p for p in paths if p.is_file()]
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=output_path.parent) as tmp, ExitStack() as stack:
+        spill_path = Path(tmp) / "spill.jsonl"
+        with open(spill_path, "wb") as spill:
+            src, off, size = _index_valid_lines(paths, spill, objects_only)
+        n = len(src)
+        print(f"Indexed {n} valid lines from {len(paths)} files "
+              f"({int((src == len(paths)).sum())} re-serialised).")
+
+        perm = np.arange(n, dtype=np.int64)
+        random.seed(seed)
+        random.shuffle(perm)  # same draws as shuffling a list of n objects
+        print(f"Shuffled {n} line offsets using seed {seed}.")
+
+        maps = []
+        for p in paths + [spill_path]:
+            f = stack.enter_context(open(p, "rb"))
+            maps.append(stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                        if f.seek(0, 2) else b"")  # mmap cannot map an empty file
+
+        max_bytes = int(max_memory_mb * 1024 * 1024)
+        total = int(size.sum()) + n
+        with _open_output(output_path, shard_records, shard_bytes, binary=True) as out:
+            if total <= max_bytes:
+                for k in perm.tolist():
+                    o = off[k]
+                    out.write(maps[src[k]][o:o + size[k]] + b"\n")
+            else:
+                _bucketed_copy(maps, src, off, size, perm, out, max_bytes, Path(tmp))
+    print(f"Saved {n} shuffled lines to {output_path}"
+          + (" (bucketed external shuffle)." if total > max_bytes else "."))
+    return n
+
+
+def _bucketed_copy(maps, src, off, size, perm, out, max_bytes: int, tmp: Path) -> None:
+    n = len(perm)
+    # output position p holds line perm[p]; cut positions into byte-bounded buckets
+    out_sizes = size[perm] + 1
+    starts = np.concatenate(([0], np.cumsum(out_sizes)[:-1]))
+    bucket_of_pos = starts // max_bytes
+    n_buckets = int(bucket_of_pos[-1]) + 1 if n else 0
+    pos = np.empty(n, dtype=np.int64)
+    pos[perm] = np.arange(n, dtype=np.int64)
+    bucket = bucket_of_pos[pos]  # bucket of every input line
+
+    # pass 1: sequential scan, append each line to its bucket
+    files = [open(tmp / f"bucket{b:05d}", "wb") for b in range(n_buckets)]
+    try:
+        for i in range(n):
+            o = off[i]
+            files[bucket[i]].write(maps[src[i]][o:o + size[i]] + b"\n")
+    finally:
+        for f in files:
+            f.close()
+
+    # pass 2: one bucket in memory at a time, placed by output position
+    for b in range(n_buckets):
+        members = np.flatnonzero(bucket == b)  # input order = order in the bucket file
+        data = (tmp / f"bucket{b:05d}").read_bytes()
+        begins = np.concatenate(([0], np.cumsum(size[members] + 1)[:-1]))
+        for j in np.argsort(pos[members], kind="stable").tolist():
+            out.write(data[begins[j]:begins[j] + size[members[j]] + 1])
+        (tmp / f"bucket{b:05d}").unlink()
+
+def sample_jsonl(input_path: str | Path, output_path: str | Path, num_samples: int,
+                 seed: int) -> int:
+    """
+    Copy ``num_samples`` random lines of *input_path* (in random order) to
+    *output_path*, reading only those lines through the ``.idx`` sidecar.
+    Returns the number of lines written.
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with JsonlIndex(input_path) as index, open(output_path, "wb") as out:
+        picks = index.sample(num_samples, seed)
+        for i in picks.tolist():
+            out.write(index.line(i) + b"\n")
+    print(f"Sampled {len(picks)} of {len(index)} lines from {input_path} into {output_path}.")
+    return len(picks)
+
+
+def shard_jsonl(input_path: str | Path, output_dir: str | Path, num_shards: int) -> List[Path]:
+    """
+    Split *input_path* into ``num_shards`` contiguous files of (near) equal
+    line counts, ``<stem>-NNNNN-of-NNNNN.jsonl``, using the ``.idx`` sidecar.
+    """
+    input_path, output_dir = Path(input_path), Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    with JsonlIndex(input_path) as index:
+        for s in range(num_shards):
+            path = output_dir / f"{input_path.stem}-{s:05d}-of-{num_shards:05d}.jsonl"
+            with open(path, "wb") as out:
+                for i in index.shard(s, num_shards):
+                    out.write(index.line(i) + b"\n")
+            paths.append(path)
+    print(f"Split {len(index)} lines of {input_path} into {num_shards} shards in {output_dir}.")
+    return paths
+
 if __name__ == '__main__':
     # Example Usage (replace with your actual file paths and desired seed)
 
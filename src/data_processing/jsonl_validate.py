@@ -0,0 +1,206 @@
+# jsonl_validate.py
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+SCHEMAS = ("auto", "text", "messages", "prompt-completion")
+MESSAGE_ROLES = ("user", "assistant", "system")
+DEFAULT_RANGE_MB = 64
+
+
+def _check_text(obj: dict) -> str | None:
+    if "text" not in obj:
+        return "missing 'text'"
+    if not isinstance(obj["text"], str) or not obj["text"]:
+        return "'text' is not a non-empty string"
+    return None
+
+
+def _check_messages(obj: dict) -> str | None:
+    if "messages" not in obj:
+        return "missing 'messages'"
+    messages = obj["messages"]
+    if not isinstance(messages, list) or not messages:
+        return "'messages' is not a non-empty list"
+    for message in messages:
+        if not isinstance(message, dict) or "role" not in message or "content" not in message:
+            return "message without 'role' / 'content'"
+        if message["role"] not in MESSAGE_ROLES:
+            return f"unknown role {str(message['role'])[:20]!r}"
+        if not isinstance(message["content"], str):
+            return "message 'content' is not a string"
+    return None
+
+
+def _check_prompt_completion(obj: dict) -> str | None:
+    for key in ("prompt", "completion"):
+        if key not in obj:
+            return f"missing '{key}'"
+        if not isinstance(obj[key], str):
+            return f"'{key}' is not a string"
+    return None
+
+
+_CHECKS = {"text": _check_text, "messages": _check_messages,
+           "prompt-completion": _check_prompt_completion}
+
+
+def record_error(obj, schema: str = "auto") -> str | None:
+    """
+    Why *obj* is not a training record of *schema*, or ``None`` if it is.
+    ``auto`` picks the schema per record as ``mlx_lm`` does: ``messages``,
+    then ``prompt``/``completion``, then ``text``.
+    """
+    if not isinstance(obj, dict):
+        return "not a JSON object"
+    if schema == "auto":
+        if "messages" in obj:
+            schema = "messages"
+        elif "prompt" in obj or "completion" in obj:
+            schema = "prompt-completion"
+        elif "text" in obj:
+            schema = "text"
+        else:
+            return "no 'text', 'messages' or 'prompt'/'completion'"
+    return _CHECKS[schema](obj)
+
+
+def byte_ranges(path: str | Path, range_bytes: int) -> list[tuple[int, int]]:
+    """
+    Split *path* into ``[start, end)`` ranges of about ``range_bytes`` that
+    begin and end on line starts, so each can be parsed independently.
+    """
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, "rb") as f:
+        for nominal in range(range_bytes, size, range_bytes):
+            if nominal <= starts[-1]:
+                continue
+            f.seek(nominal - 1)
+            f.readline()  # finish the line that contains byte nominal - 1
+            if f.tell() >= size:
+                break
+            starts.append(f.tell())
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def scan_range(path: str | Path, start: int, end: int, schema: str = "auto",
+               max_bad: int = 1000) -> dict:
+    """
+    Parse and validate the lines in ``[start, end)`` of *path*.
+
+    Returns the range's counts (``lines``, ``valid``, ``empty``, ``bad``),
+    the ``errors`` by reason and up to ``max_bad`` ``bad_lines`` as
+    ``[byte offset, line index within the range, reason]``.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = valid = empty = 0
+    errors, bad_lines = Counter(), []
+    pos = 0
+    while pos < len(data):
+        nl = data.find(b"\n", pos)
+        stop = len(data) if nl < 0 else nl
+        raw = data[pos:stop].strip()
+        if not raw:
+            empty += 1
+        else:
+            try:
+                error = record_error(json.loads(raw), schema)
+            except UnicodeDecodeError:
+                error = "invalid UTF-8"
+            except json.JSONDecodeError:
+                error = "invalid JSON"
+            if error is None:
+                valid += 1
+            else:
+                errors[error] += 1
+                if len(bad_lines) < max_bad:
+                    bad_lines.append([start + pos, lines, error])
+        lines += 1
+        pos = stop + 1
+    return {"path": str(path), "start": start, "end": end, "lines": lines, "valid": valid,
+            "empty": empty, "bad": lines - valid - empty, "errors": dict(errors),
+            "bad_lines": bad_lines}
+
+
+def validate_jsonl(paths: list, schema: str = "auto", workers: int | None = None,
+                   range_mb: float = DEFAULT_RANGE_MB, max_bad: int = 1000) -> dict:
+    """
+    Validate every line of the JSONL *paths* against *schema* in parallel.
+
+    Files are cut into newline-aligned byte ranges (``byte_ranges``) that a
+    process pool scans with ``scan_range``.  The report has the per-range
+    results under ``ranges``, per-file totals under ``files`` and the bad
+    lines (file, byte offset, 1-based line number, reason) under
+    ``bad_lines``, at most ``max_bad`` per range.
+    """
+    if schema not in SCHEMAS:
+        raise ValueError(f"Unknown schema {schema!r}; expected one of {SCHEMAS}")
+    workers = workers or os.cpu_count() or 1
+    range_bytes = max(1, int(range_mb * 1024 * 1024))
+    paths = list(dict.fromkeys(str(Path(p)) for p in paths))  # as scan_range reports them
+    tasks = [(p, start, end) for p in paths for start, end in byte_ranges(p, range_bytes)]
+    if workers <= 1 or len(tasks) <= 1:
+        ranges = [scan_range(p, start, end, schema, max_bad) for p, start, end in tasks]
+    else:
+        with ProcessPoolExecutor(min(workers, len(tasks))) as pool:
+            futures = [pool.submit(scan_range, p, start, end, schema, max_bad)
+                       for p, start, end in tasks]
+            ranges = [f.result() for f in futures]
+
+    files, bad_lines = {}, []
+    for p in paths:
+        files[p] = {"path": p, "bytes": os.path.getsize(p), "lines": 0, "valid": 0,
+                    "empty": 0, "bad": 0, "errors": Counter()}
+    for r in ranges:  # in file order, so line numbers can be made global
+        total = files[r["path"]]
+        for offset, index, error in r["bad_lines"]:
+            bad_lines.append({"path": r["path"], "offset": offset,
+                              "line": total["lines"] + index + 1, "error": error})
+        for key in ("lines", "valid", "empty", "bad"):
+            total[key] += r[key]
+        total["errors"].update(r["errors"])
+    for total in files.values():
+        total["errors"] = dict(total["errors"])
+    return {"schema": schema, "files": list(files.values()), "ranges": ranges,
+            "bad_lines": bad_lines}
+
+
+if __name__ == "__main__":
+    import argparse, sys, time
+
+    ap = argparse.ArgumentParser(
+        description="Parse and validate JSONL training files in parallel byte ranges.")
+    ap.add_argument("input_files", nargs="+")
+    ap.add_argument("--schema", choices=SCHEMAS, default="auto",
+                    help="record format to require (default: auto, per record)")
+    ap.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    ap.add_argument("--range_mb", type=float, default=DEFAULT_RANGE_MB,
+                    help="approximate size of each scanned byte range")
+    ap.add_argument("--max_bad", type=int, default=1000,
+                    help="bad lines recorded per range (counts are always complete)")
+    ap.add_argument("--report", default=None, help="write the full JSON report here")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    report = validate_jsonl(args.input_files, args.schema, args.workers,
+                            args.range_mb, args.max_bad)
+    elapsed = time.perf_counter() - t0
+    for f in report["files"]:
+        print(f"{f['path']}: {f['lines']} lines, {f['valid']} valid, {f['empty']} empty, "
+              f"{f['bad']} bad" + (f" {f['errors']}" if f["errors"] else ""))
+    for b in report["bad_lines"][:20]:
+        print(f"  {b['path']}:{b['line']} (byte {b['offset']}): {b['error']}")
+    if len(report["bad_lines"]) > 20:
+        print(f"  ... {len(report['bad_lines']) - 20} more")
+    total_mb = sum(f["bytes"] for f in report["files"]) / 2 ** 20
+    print(f"Scanned {total_mb:.1f} MB in {len(report['ranges'])} ranges "
+          f"in {elapsed:.2f}s ({total_mb / max(elapsed, 1e-9):.0f} MB/s).")
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Saved report to {args.report}")
+    sys.exit(1 if any(f["bad"] for f in report["files"]) else 0)
@@ -0,0 +1,269 @@
+# mlx_embedder.py
+import inspect
+import json
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import mlx.core as mx
+import mlx.nn as nn
+import numpy as np
+
+from embedding_server import cosine_similarity
+
+
+@dataclass
+class ModelArgs:
+    """ModernBERT ``config.json`` fields the encoder needs."""
+    vocab_size: int = 50368
+    hidden_size: int = 1024
+    intermediate_size: int = 2624
+    num_hidden_layers: int = 28
+    num_attention_heads: int = 16
+    norm_eps: float = 1e-5
+    norm_bias: bool = False
+    attention_bias: bool = False
+    mlp_bias: bool = False
+    global_attn_every_n_layers: int = 3
+    local_attention: int = 128
+    global_rope_theta: float = 160000.0
+    local_rope_theta: float = 10000.0
+    max_position_embeddings: int = 8192
+    pad_token_id: int = 50283
+
+    @classmethod
+    def from_dict(cls, params: dict) -> "ModelArgs":
+        fields = inspect.signature(cls).parameters
+        return cls(**{k: v for k, v in params.items() if k in fields})
+
+
+class Embeddings(nn.Module):
+    def __init__(self, args: ModelArgs):
+        super().__init__()
+        self.tok_embeddings = nn.Embedding(args.vocab_size, args.hidden_size)
+        self.norm = nn.LayerNorm(args.hidden_size, eps=args.norm_eps, bias=args.norm_bias)
+
+    def __call__(self, input_ids: mx.array) -> mx.array:
+        return self.norm(self.tok_embeddings(input_ids))
+
+
+class Attention(nn.Module):
+    def __init__(self, args: ModelArgs, layer_id: int):
+        super().__init__()
+        self.n_heads = args.num_attention_heads
+        self.head_dim = args.hidden_size // args.num_attention_heads
+        self.scale = self.head_dim ** -0.5
+        # every n-th layer attends globally, the rest within a sliding window
+        self.is_global = layer_id % args.global_attn_every_n_layers == 0
+        self.rope_theta = args.global_rope_theta if self.is_global else args.local_rope_theta
+        self.Wqkv = nn.Linear(args.hidden_size, 3 * args.hidden_size, bias=args.attention_bias)
+        self.Wo = nn.Linear(args.hidden_size, args.hidden_size, bias=args.attention_bias)
+
+    def __call__(self, x: mx.array, mask: mx.array) -> mx.array:
+        B, L, _ = x.shape
+        qkv = self.Wqkv(x).reshape(B, L, 3, self.n_heads, self.head_dim)
+        q, k, v = qkv.transpose(2, 0, 3, 1, 4)
+        q = mx.fast.rope(q, self.head_dim, traditional=False, base=self.rope_theta,
+                         scale=1.0, offset=0)
+        k = mx.fast.rope(k, self.head_dim, traditional=False, base=self.rope_theta,
+                         scale=1.0, offset=0)
+        out = mx.fast.scaled_dot_product_attention(q, k, v, scale=self.scale, mask=mask)
+        return self.Wo(out.transpose(0, 2, 1, 3).reshape(B, L, -1))
+
+
+class MLP(nn.Module):
+    def __init__(self, args: ModelArgs):
+        super().__init__()
+        self.Wi = nn.Linear(args.hidden_size, 2 * args.intermediate_size, bias=args.mlp_bias)
+        self.Wo = nn.Linear(args.intermediate_size, args.hidden_size, bias=args.mlp_bias)
+
+    def __call__(self, x: mx.array) -> mx.array:
+        inputs, gate = mx.split(self.Wi(x), 2, axis=-1)
+        return self.Wo(nn.gelu(inputs) * gate)
+
+
+class EncoderLayer(nn.Module):
+    def __init__(self, args: ModelArgs, layer_id: int):
+        super().__init__()
+        # the embedding norm already normalises the first layer's input
+        self.attn_norm = (nn.Identity() if layer_id == 0 else
+                          nn.LayerNorm(args.hidden_size, eps=args.norm_eps, bias=args.norm_bias))
+        self.attn = Attention(args, layer_id)
+        self.mlp_norm = nn.LayerNorm(args.hidden_size, eps=args.norm_eps, bias=args.norm_bias)
+        self.mlp = MLP(args)
+
+    def __call__(self, x: mx.array, mask: mx.array) -> mx.array:
+        x = x + self.attn(self.attn_norm(x), mask)
+        return x + self.mlp(self.mlp_norm(x))
+
+
+class ModernBert(nn.Module):
+    def __init__(self, args: ModelArgs):
+        super().__init__()
+        self.args = args
+        self.embeddings = Embeddings(args)
+        self.layers = [EncoderLayer(args, i) for i in range(args.num_hidden_layers)]
+        self.final_norm = nn.LayerNorm(args.hidden_size, eps=args.norm_eps, bias=args.norm_bias)
+
+    def __call__(self, input_ids: mx.array, attention_mask: mx.array) -> mx.array:
+        x = self.embeddings(input_ids)
+        neg = mx.finfo(x.dtype).min
+        keys = attention_mask[:, None, None, :].astype(mx.bool_)
+        pos = mx.arange(input_ids.shape[1])
+        window = mx.abs(pos[:, None] - pos[None, :]) <= self.args.local_attention // 2
+        # combine as booleans so a padded query row never sees only -inf
+        global_mask = mx.where(keys, 0.0, neg).astype(x.dtype)
+        local_mask = mx.where(keys & window, 0.0, neg).astype(x.dtype)
+        for layer in self.layers:
+            x = layer(x, global_mask if layer.attn.is_global else local_mask)
+        return self.final_norm(x)
+
+
+def resolve_model_dir(name_or_path: str) -> Path:
+    """A local model directory, or the Hub snapshot of *name_or_path*."""
+    path = Path(name_or_path)
+    if path.is_dir():
+        return path
+    from huggingface_hub import snapshot_download
+    return Path(snapshot_download(
+        name_or_path, allow_patterns=["*.json", "*.safetensors", "tokenizer*"]))
+
+
+class MLXEmbedder:
+    """
+    ModernBERT-style sentence encoder on MLX with the ``encode`` /
+    ``similarity`` surface of ``SentenceTransformer``.
+
+    Nothing is read until the first ``encode``: the config, tokenizer and
+    safetensors (which ``mx.load`` maps lazily) are loaded then.  Texts are
+    sorted by length and run in padded batches; pooling and normalisation
+    follow the sentence-transformers module config of the checkpoint (mean
+    pooling by default).  ``device="cpu"`` runs every op on the CPU stream.
+    """
+
+    def __init__(self, model_name_or_path: str, device: str = "gpu",
+                 dtype: str = "float32", max_seq_length: int | None = None):
+        self.model_name = model_name_or_path
+        self.device = mx.cpu if device == "cpu" else mx.gpu
+        self.dtype = getattr(mx, dtype)
+        self.max_seq_length = max_seq_length
+        self.load_seconds: float | None = None
+        self._model: ModernBert | None = None
+
+    def _load(self) -> None:
+        t0 = time.perf_counter()
+        from tokenizers import Tokenizer
+        model_dir = resolve_model_dir(self.model_name)
+        args = ModelArgs.from_dict(json.loads((model_dir / "config.json").read_text()))
+
+        st_config = model_dir / "sentence_bert_config.json"
+        if self.max_seq_length is None and st_config.is_file():
+            self.max_seq_length = json.loads(st_config.read_text()).get("max_seq_length")
+        self.max_seq_length = self.max_seq_length or args.max_position_embeddings
+        pooling = model_dir / "1_Pooling" / "config.json"
+        self.cls_pooling = (pooling.is_file() and
+                            json.loads(pooling.read_text()).get("pooling_mode_cls_token", False))
+        modules = model_dir / "modules.json"
+        self.normalize = (not modules.is_file() or
+                          any("Normalize" in m.get("type", "")
+                              for m in json.loads(modules.read_text())))
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.max_seq_length)
+        self.tokenizer.no_padding()
+        self.pad_id = args.pad_token_id
+
+        weights = {}
+        for f in sorted(model_dir.glob("*.safetensors")):
+            weights.update(mx.load(str(f)))
+        weights = {k.removeprefix("model."): v for k, v in weights.items()
+                   if not k.startswith(("head.", "decoder."))}
+        model = ModernBert(args)
+        model.load_weights(list(weights.items()))
+        model.set_dtype(self.dtype)
+        model.eval()
+        self._model = model
+        self.load_seconds = time.perf_counter() - t0
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        if self._model is None:
+            self._load()
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        ids = [e.ids for e in self.tokenizer.encode_batch(texts)]
+        order = sorted(range(len(ids)), key=lambda i: -len(ids[i]))
+        out = np.empty((len(ids), self._model.args.hidden_size), dtype=np.float32)
+
+        with mx.stream(self.device):
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                width = len(ids[batch[0]])
+                tokens = np.full((len(batch), width), self.pad_id, dtype=np.int32)
+                mask = np.zeros((len(batch), width), dtype=np.int32)
+                for row, i in enumerate(batch):
+                    tokens[row, :len(ids[i])] = ids[i]
+                    mask[row, :len(ids[i])] = 1
+                mask = mx.array(mask)
+                hidden = self._model(mx.array(tokens), mask)
+                if self.cls_pooling:
+                    pooled = hidden[:, 0]
+                else:
+                    m = mask[..., None].astype(hidden.dtype)
+                    pooled = (hidden * m).sum(axis=1) / m.sum(axis=1)
+                if self.normalize:
+                    pooled = pooled / mx.linalg.norm(pooled, axis=-1, keepdims=True)
+                out[batch] = np.array(pooled.astype(mx.float32))
+        return out[0] if single else out
+
+    similarity = staticmethod(cosine_similarity)
+
+
+# short passages in the register of the books being chunked, with the
+# prefixes the chunker uses
+FIXTURES = [
+    "search_document: The ship left the Mersey on a grey morning, her sails slack until the estuary.",
+    "search_document: Erasmus stood at the rail and watched Liverpool dwindle into smoke.",
+    "search_query: Paris had not slept; the fever was in the lower deck again.",
+    "search_query: Thurso counted the casks twice and found the same shortfall both times.",
+    "search_document: At Bonny the factors came aboard with their ledgers and their smiles.",
+    "search_document: Rain fell for three days, and no one spoke of what had happened.",
+    "search_query: The price of sugar in Barbados was the only news anyone wanted.",
+    "search_document: Sarah kept the letter in her glove and did not open it.",
+    "search_query: Kemp laughed, but his eyes went to the door.",
+    "search_document: Mathematics is the study of quantity, structure, space and change.",
+]
+
+
+if __name__ == "__main__":
+    import argparse, sys
+    from embedding_backends import load_embedding_model
+
+    ap = argparse.ArgumentParser(
+        description="Check the MLX encoder against sentence-transformers and time both.")
+    ap.add_argument("--model_name", default="lightonai/modernbert-embed-large")
+    ap.add_argument("--device", choices=["gpu", "cpu"], default="gpu")
+    ap.add_argument("--tolerance", type=float, default=5e-3,
+                    help="largest allowed |Δ cosine| between backends (default 5e-3)")
+    ap.add_argument("--throughput_texts", type=int, default=2048,
+                    help="windows encoded for the throughput measurement")
+    ap.add_argument("--batch_size", type=int, default=64)
+    args = ap.parse_args()
+
+    sims, texts = {}, (FIXTURES * (args.throughput_texts // len(FIXTURES) + 1))[:args.throughput_texts]
+    for backend in ("mlx", "sentence-transformers"):
+        t0 = time.perf_counter()
+        model = load_embedding_model(args.model_name, backend,
+                                     args.device if backend == "mlx" else None)
+        embs = model.encode(FIXTURES)  # first call loads lazily
+        startup = time.perf_counter() - t0
+        sims[backend] = cosine_similarity(embs, embs)
+        t0 = time.perf_counter()
+        model.encode(texts, batch_size=args.batch_size)
+        rate = len(texts) / (time.perf_counter() - t0)
+        print(f"{backend:>21}: startup {startup:.2f}s, {rate:.0f} windows/s "
+              f"(batch {args.batch_size})")
+
+    diff = np.abs(sims["mlx"] - sims["sentence-transformers"]).max()
+    print(f"max |Δ cosine| over {len(FIXTURES)} fixtures: {diff:.2e} "
+          f"(tolerance {args.tolerance:.0e})")
+    sys.exit(0 if diff <= args.tolerance else 1)
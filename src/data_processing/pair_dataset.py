@@ -0,0 +1,125 @@
+# pair_dataset.py
+import json
+from pathlib import Path
+
+import numpy as np
+
+from jsonl_index import JsonlIndex
+from prepare_training_data import (load_chunks_from_file, pair_in_train,
+                                   render_pair, skipped_pairs)
+
+CHUNKS_FILE = "chunks.jsonl"
+PAIRS_FILE = "pairs.json"
+FORMAT_VERSION = 1
+
+
+def write_pair_dataset(input_files: list, output_dir: Path, seed: int,
+                       train_ratio: float,
+                       dropped_chunks: dict | None = None) -> tuple[int, int]:
+    """
+    Compact alternative to ``train.jsonl`` / ``valid.jsonl``.
+
+    ``chunks.jsonl`` holds every chunk once (one JSON string per line, in
+    input order) and ``pairs.json`` the ``[prompt_id, completion_id]``
+    references of each split plus the chunk range of every input file.
+    Pairs are split with ``pair_in_train``, as in ``--streaming``.
+    Returns ``(train pairs, valid pairs)``.
+    """
+    dropped_chunks = dropped_chunks or {}
+    output_dir.mkdir(parents=True, exist_ok=True)
+    files, splits = [], {"train": [], "valid": []}
+    first = 0
+    with (output_dir / CHUNKS_FILE).open("w", encoding="utf-8") as f:
+        for path in map(Path, input_files):
+            chunks = load_chunks_from_file(path)
+            for chunk in chunks:
+                f.write(json.dumps(str(chunk)) + "\n")
+            skip = skipped_pairs(dropped_chunks, path)
+            for i in range(len(chunks) - 1):
+                if i not in skip:
+                    split = "train" if pair_in_train(path.name, i, seed, train_ratio) else "valid"
+                    splits[split].append([first + i, first + i + 1])
+            files.append({"path": str(path), "first": first, "count": len(chunks)})
+            first += len(chunks)
+    meta = {"version": FORMAT_VERSION, "seed": seed, "train_ratio": train_ratio,
+            "files": files, **splits}
+    (output_dir / PAIRS_FILE).write_text(json.dumps(meta), encoding="utf-8")
+    return len(splits["train"]), len(splits["valid"])
+
+
+class PairDataset:
+    """
+    Lazily rendered training texts of one split of a pair dataset.
+
+    ``dataset[k]`` is ``{"text": ...}`` – the same string
+    ``create_pairs_from_chunks`` would have stored – built from the chunk
+    table only when asked for, so it can stand in for the list of records
+    a trainer's text dataset wraps.  ``context > 1`` puts up to that many
+    consecutive chunks (never crossing into another input file) in the
+    prompt, at no extra storage.
+    """
+
+    def __init__(self, path: str | Path, split: str = "train", context: int = 1):
+        self.path = Path(path)
+        meta = json.loads((self.path / PAIRS_FILE).read_text(encoding="utf-8"))
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{self.path}: unsupported pair dataset version {meta.get('version')}")
+        self.pairs = np.asarray(meta[split], dtype=np.int64).reshape(-1, 2)
+        self.file_starts = np.asarray([f["first"] for f in meta["files"]], dtype=np.int64)
+        self.context = context
+        # line k of chunks.jsonl is chunk k; offsets come from its .idx sidecar
+        self.chunks = JsonlIndex(self.path / CHUNKS_FILE)
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def chunk(self, k: int) -> str:
+        return self.chunks[k]
+
+    def prompt_ids(self, k: int) -> range:
+        """Chunk ids rendered as the prompt of pair *k*."""
+        i = int(self.pairs[k, 0])
+        file_first = int(self.file_starts[np.searchsorted(self.file_starts, i, side="right") - 1])
+        return range(max(file_first, i - self.context + 1), i + 1)
+
+    def __getitem__(self, k: int) -> dict:
+        prompt = "\n\n".join(self.chunk(i) for i in self.prompt_ids(k))
+        return {"text": render_pair(prompt, self.chunk(int(self.pairs[k, 1])))}
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def close(self) -> None:
+        self.chunks.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(
+        description="Inspect a pair dataset or render it to train.jsonl / valid.jsonl.")
+    ap.add_argument("dataset_dir")
+    ap.add_argument("--context", type=int, default=1,
+                    help="chunks in each prompt (default 1, as prepare_training_data.py)")
+    ap.add_argument("--render_to", default=None,
+                    help="write fully rendered train.jsonl / valid.jsonl into this directory")
+    args = ap.parse_args()
+
+    chunk_bytes = (Path(args.dataset_dir) / CHUNKS_FILE).stat().st_size
+    for split in ("train", "valid"):
+        ds = PairDataset(args.dataset_dir, split, args.context)
+        if args.render_to:
+            out = Path(args.render_to)
+            out.mkdir(parents=True, exist_ok=True)
+            with (out / f"{split}.jsonl").open("w", encoding="utf-8") as f:
+                for record in ds:
+                    f.write(json.dumps(record) + "\n")
+            print(f"{split}: wrote {len(ds)} rendered pairs "
+                  f"({(out / f'{split}.jsonl').stat().st_size / 2 ** 20:.1f} MB) to {out}")
+        else:
+            print(f"{split}: {len(ds)} pairs; first: {ds[0]['text'][:200]!r}" if len(ds)
+                  else f"{split}: 0 pairs")
+        ds.close()
+    pairs_bytes = (Path(args.dataset_dir) / PAIRS_FILE).stat().st_size
+    print(f"Stored: {chunk_bytes / 2 ** 20:.1f} MB of chunks + {pairs_bytes / 2 ** 20:.2f} MB of pairs")
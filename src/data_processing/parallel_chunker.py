@@ -0,0 +1,288 @@
+# parallel_chunker.py
+import multiprocessing as mp
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from baseline_chunker import iter_paragraphs, greedy_cut_points, dump_chunks_json
+from chunk_index import BookBuffer, SpanChunk
+from chunk_manifest import manifest_path, paragraph_hashes, write_manifest
+from embedding_cache import EmbeddingCache
+from embedding_server import MicroBatcher, cosine_similarity, format_metrics
+from semantic_chunker import refine_boundaries, DEFAULT_CHAR_NAMES
+from src.data_processing.bm25_func import EntityIndex
+
+
+class BatchingEncoder:
+    """
+    Owns the one copy of the model and encodes for every worker process.
+
+    Workers send ``(client, request_id, texts)`` on a shared queue; a pump
+    thread in the parent feeds them to a :class:`MicroBatcher`, which
+    merges whatever arrives close together into one batch, and each
+    client is answered on its own queue – with the error text if its
+    batch failed.  With ``timeout`` a client gives up on a request after
+    that many seconds.
+    """
+
+    def __init__(self, model, ctx, n_clients: int, batch_size: int = 256,
+                 max_wait: float = 0.005, cache: EmbeddingCache | None = None,
+                 timeout: float | None = None):
+        self.batcher = MicroBatcher(model, batch_size, max_wait, cache)
+        self.timeout = timeout
+        self.requests = ctx.Queue()
+        self.responses = [ctx.Queue() for _ in range(n_clients)]
+        self.next_client = ctx.Value("i", 0)
+        self._thread = threading.Thread(target=self._pump, daemon=True)
+
+    def client_args(self) -> tuple:
+        return self.requests, self.responses, self.next_client, self.timeout
+
+    def start(self) -> None:
+        self.batcher.start()
+        self._thread.start()
+
+    def close(self) -> None:
+        self.requests.put(None)
+        self._thread.join()
+        self.batcher.close()
+
+    def report(self) -> str:
+        return f"Shared encoder: {format_metrics(self.batcher.metrics())}."
+
+    def _pump(self) -> None:
+        while (item := self.requests.get()) is not None:
+            client, request_id, texts = item
+            self.batcher.submit(texts, lambda embs, error, c=client, r=request_id:
+                                self.responses[c].put((r, embs, None if error is None
+                                                       else repr(error))))
+
+
+class RemoteEncoder:
+    """
+    Stand-in for the ``SentenceTransformer`` inside a worker process: the
+    ``encode`` / ``similarity`` surface ``refine_boundaries`` uses, with
+    every encode served by the parent's :class:`BatchingEncoder`.
+    """
+
+    def __init__(self, requests, responses, next_client, timeout: float | None = None):
+        with next_client.get_lock():
+            self.client = next_client.value
+            next_client.value += 1
+        self.requests = requests
+        self.response = responses[self.client]
+        self.timeout = timeout
+        self._request_id = 0
+
+    def encode(self, sentences, batch_size: int | None = None, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        self._request_id += 1
+        self.requests.put((self.client, self._request_id, texts))
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            try:
+                request_id, embs, error = self.response.get(
+                    timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise TimeoutError(f"No embeddings from the parent after {self.timeout} s") from None
+            if request_id == self._request_id:
+                break  # anything else is the late reply to a request that timed out
+        if error is not None:
+            raise RuntimeError(f"Shared encoder failed: {error}")
+        return embs[0] if single else embs
+
+    similarity = staticmethod(cosine_similarity)
+
+
+# ---- worker side -------------------------------------------------------------
+_ENCODER: RemoteEncoder | None = None
+
+
+def _init_worker(requests, responses, next_client, timeout) -> None:
+    global _ENCODER
+    _ENCODER = RemoteEncoder(requests, responses, next_client, timeout)
+
+
+@lru_cache(maxsize=2)
+def _load_book(book_path: str, char_names: tuple) -> tuple[BookBuffer, EntityIndex]:
+    buffer = BookBuffer(iter_paragraphs(book_path))
+    paragraphs = [buffer.paragraph(i) for i in range(len(buffer))]
+    return buffer, EntityIndex(paragraphs, list(char_names))
+
+
+def _refine_region(book_path: str, spans: list, char_names: tuple,
+                   refine_kwargs: dict) -> tuple[list, list, int]:
+    """Refine one run of baseline chunks; returns (spans + suffixes, decisions, modifications)."""
+    buffer, entity_index = _load_book(book_path, char_names)
+    decisions = []
+    refined, mod_count = refine_boundaries(
+        [SpanChunk(buffer, s, e) for s, e in spans], model=_ENCODER,
+        char_names=list(char_names), entity_index=entity_index,
+        decisions=decisions, **refine_kwargs)
+    return [(c.start, c.end, c.suffix) for c in refined], decisions, mod_count
+
+
+# ---- parent side ---------------------------------------------------------------
+def partition_regions(n_chunks: int, n_regions: int) -> list[tuple[int, int]]:
+    """Split ``n_chunks`` baseline chunks into contiguous runs of at least two."""
+    n_regions = max(1, min(n_regions, n_chunks // 2))
+    bounds = np.linspace(0, n_chunks, n_regions + 1).round().astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds, bounds[1:])]
+
+
+def reconcile_seams(regions: list[tuple[list, list]],
+                    model,
+                    entity_index: EntityIndex,
+                    **refine_kwargs) -> tuple[list[SpanChunk], list[dict], int]:
+    """
+    Join independently refined regions of one book.
+
+    Each region is ``(chunks, decisions)``.  The join between the last
+    chunk of one region and the first of the next was never looked at, so
+    it is refined now – as ``refine_incremental`` treats the seams of a
+    changed region.  Returns ``(chunks, decisions, modifications)``.
+    """
+    chunks, decisions = list(regions[0][0]), list(regions[0][1])
+    mod_total = 0
+    for region_chunks, region_decisions in regions[1:]:
+        seam_decisions = []
+        seam, mods = refine_boundaries(
+            [chunks.pop(), region_chunks[0]], model=model,
+            entity_index=entity_index, decisions=seam_decisions, **refine_kwargs)
+        mod_total += mods
+        chunks.extend(seam)
+        chunks.extend(region_chunks[1:])
+        decisions.extend(seam_decisions)
+        decisions.extend(region_decisions)
+    return chunks, decisions, mod_total
+
+
+def chunk_books(book_paths: list[str],
+                target: int,
+                model,
+                workers: int = 4,
+                regions_per_book: int | None = None,
+                batch_size: int = 256,
+                cache: EmbeddingCache | None = None,
+                char_names: list[str] = DEFAULT_CHAR_NAMES,
+                encode_timeout: float | None = None,
+                **refine_kwargs) -> dict[str, tuple[list[SpanChunk], list[dict]]]:
+    """
+    Refine many books at once on a pool of ``workers`` processes.
+
+    Every book's baseline chunks (~``target × 0.9`` words) are split into
+    ``regions_per_book`` contiguous regions (default: enough to keep all
+    workers busy) that are refined concurrently; far-apart boundaries do not
+    interact, and the seams between regions are reconciled afterwards with
+    ``reconcile_seams``.  Workers share one :class:`BatchingEncoder`, so
+    the model is loaded once, in this process; with ``encode_timeout`` a
+    worker waiting longer than that for its embeddings fails.
+
+    Returns ``{book_path: (chunks, decisions)}``.
+    """
+    ctx = mp.get_context("spawn")
+    encoder = BatchingEncoder(model, ctx, workers, batch_size, cache=cache,
+                              timeout=encode_timeout)
+    if regions_per_book is None:
+        regions_per_book = -(-workers // len(book_paths))
+    char_names = tuple(char_names)
+
+    books, results, futures = {}, {}, {}
+    encoder.start()
+    try:
+        with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=encoder.client_args()) as pool:
+            for path in book_paths:
+                buffer = BookBuffer(iter_paragraphs(path))
+                if not len(buffer):
+                    print(f"{path}: no paragraphs, skipping.")
+                    continue
+                spans = greedy_cut_points(np.asarray(buffer.word_prefix), int(target * 0.9))
+                books[path] = buffer
+                regions = partition_regions(len(spans), regions_per_book)
+                results[path] = [None] * len(regions)
+                for r, (a, b) in enumerate(regions):
+                    future = pool.submit(_refine_region, path, spans[a:b], char_names,
+                                         dict(refine_kwargs, batch_size=batch_size))
+                    futures[future] = (path, r)
+            for future in as_completed(futures):
+                path, r = futures[future]
+                results[path][r] = future.result()
+    finally:
+        encoder.close()
+    print(encoder.report())
+
+    out = {}
+    for path, buffer in books.items():
+        regions = [([SpanChunk(buffer, s, e, suffix) for s, e, suffix in chunks], decisions)
+                   for chunks, decisions, _ in results[path]]
+        entity_index = EntityIndex([buffer.paragraph(i) for i in range(len(buffer))],
+                                   list(char_names))
+        chunks, decisions, seam_mods = reconcile_seams(
+            regions, model, entity_index, char_names=list(char_names),
+            batch_size=batch_size, **refine_kwargs)
+        mods = sum(m for _, _, m in results[path]) + seam_mods
+        print(f"{path}: {len(regions)} regions, {len(chunks)} chunks, "
+              f"{mods} boundary modifications.")
+        out[path] = (chunks, decisions)
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+    from embedding_backends import BACKENDS, cache_name, load_embedding_model
+    from embedding_cache import DEFAULT_MAX_MB
+
+    ap = argparse.ArgumentParser(
+        description="Refine the chunks of many books in parallel with one shared encoder.")
+    ap.add_argument("book_paths", nargs="+")
+    ap.add_argument("--target", type=int, default=350,
+                    help="target words per chunk (default 350)")
+    ap.add_argument("--model_name", default="lightonai/modernbert-embed-large")
+    ap.add_argument("--backend", choices=BACKENDS, default="sentence-transformers")
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--workers", type=int, default=mp.cpu_count(),
+                    help="worker processes (default: all cores)")
+    ap.add_argument("--regions", type=int, default=None,
+                    help="regions refined concurrently per book (default: workers / books)")
+    ap.add_argument("--batch_size", type=int, default=256)
+    ap.add_argument("--cache_dir", default=None)
+    ap.add_argument("--cache_max_mb", type=int, default=DEFAULT_MAX_MB)
+    ap.add_argument("--encode_timeout", type=float, default=None,
+                    help="seconds a worker waits for its embeddings before failing (default: no limit)")
+    ap.add_argument("--output_template", default="{stem}_{target}.json",
+                    help="output path per book (default {stem}_{target}.json)")
+    args = ap.parse_args()
+
+    print(f"Loading {args.backend} model: {args.model_name}")
+    model = load_embedding_model(args.model_name, args.backend, args.device)
+    cache = None
+    if args.cache_dir:
+        cache = EmbeddingCache(args.cache_dir, cache_name(args.model_name, args.backend),
+                               args.cache_max_mb)
+
+    t0 = time.perf_counter()
+    results = chunk_books(args.book_paths, args.target, model, args.workers,
+                          args.regions, args.batch_size, cache,
+                          encode_timeout=args.encode_timeout)
+    print(f"Refined {len(results)} books in {time.perf_counter() - t0:.1f}s.")
+
+    for path, (chunks, decisions) in results.items():
+        output_path = args.output_template.format(stem=Path(path).stem, target=args.target)
+        with open(output_path, "w", encoding="utf-8") as f:
+            dump_chunks_json(chunks, f)
+        # same manifest as semantic_chunker.py, so --incremental can follow up
+        write_manifest(manifest_path(output_path), paragraph_hashes(chunks[0].buffer),
+                       chunks, decisions,
+                       {"model_name": args.model_name, "target": args.target})
+        print(f"Wrote {len(chunks)} refined chunks to {output_path}")
+
+    if cache is not None:
+        cache.save()
+        print(cache.report())
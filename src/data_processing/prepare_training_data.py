@@ -1,13 +1,24 @@
 import json
 import argparse
+import hashlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 import random
 
+from baseline_chunker import iter_paragraphs
+from chunk_index import BookBuffer, SpanChunk
+from chunk_dedup import load_dedup_report
+from sharded_writer import ShardedJsonlWriter
+
 # Define the prompt template directly
 PROMPT_TEMPLATE = '''This is an excerpt from a novel. Write the next excerpt of similar length. Use the same style as the excerpt. Make sure that while stylistically similar, the new section moves the story forward and/or develops the characters and/or adds new information or in some way continues on meaningfully from the previous section.
 
 EXCERPT:
 {}'''
+# separates the rendered prompt from the completion in every training text
+COMPLETION_MARKER = "\nNEXT EXCERPT:\n"
 
 def save_to_jsonl(data: list, file_path: Path):
     """Saves a list of strings to a JSONL file, with each string under the 'text' key."""
@@ -16,8 +27,39 @@ def save_to_jsonl(data: list, file_path: Path):
             # Ensure the output is a valid JSON line
             f.write(json.dumps({"text": item}) + '\n')
 
+def save_sharded_jsonl(data: list, output_dir: Path, prefix: str, max_records: int | None,
+                       max_bytes: int | None, tokenizer=None, resume: bool = False) -> dict:
+    """``save_to_jsonl`` into ``<prefix>-NNNNN.jsonl`` shards plus ``<prefix>.manifest.json``; returns the manifest."""
+    with ShardedJsonlWriter(output_dir, prefix, max_records, max_bytes, tokenizer,
+                            resume=resume) as writer:
+        for item in data:
+            writer.write(json.dumps({"text": item}) + '\n')
+    return json.loads(writer.manifest_path.read_text(encoding="utf-8"))
+
+@lru_cache(maxsize=2)
+def _book_buffer(book_path: Path) -> BookBuffer:
+    # span files of one book are adjacent, so a small cache shares its buffer
+    # without keeping every book alive in --streaming runs
+    return BookBuffer(iter_paragraphs(book_path))
+
+def _span_chunks(data: dict, file_path: Path) -> list:
+    """Resolves a span-form chunks file (see ``dump_chunk_spans_json``)."""
+    book_path = Path(data["book_path"])
+    if not book_path.is_file():
+        book_path = file_path.parent / book_path
+    buffer = _book_buffer(book_path.resolve())
+    if len(buffer) != data.get("n_paragraphs", len(buffer)):
+        raise ValueError(f"{book_path} has changed since the spans were written")
+    return [SpanChunk(buffer, start, end) for start, end in data["chunks"]]
+
 def load_chunks_from_file(file_path: Path) -> list:
-    """Loads chunks from a single JSON file."""
+    """
+    Loads chunks from a single JSON file.
+
+    Chunks are either strings or, if the file names a ``book_path``,
+    ``[start, end]`` paragraph spans returned as ``SpanChunk`` objects;
+    both render the same way in ``render_pair``.
+    """
     if not file_path.is_file():
         print(f"Warning: Input file not found at {file_path}, skipping.")
         return []
@@ -27,6 +69,8 @@ def load_chunks_from_file(file_path: Path) -> list:
         if "chunks" not in data or not isinstance(data["chunks"], list):
             print(f"Warning: Input file {file_path} does not contain a list under the 'chunks' key, skipping.")
             return []
+        if "book_path" in data:
+            return _span_chunks(data, file_path)
         return data["chunks"]
     except json.JSONDecodeError:
         print(f"Warning: Could not decode JSON from {file_path}, skipping.")
@@ -36,6 +80,11 @@ def load_chunks_from_file(file_path: Path) -> list:
         return []
 
 
+def render_pair(prompt_chunk: str | SpanChunk, completion_chunk: str | SpanChunk) -> str:
+    """Renders one training text from a chunk and the chunk that follows it."""
+    prompt_part = PROMPT_TEMPLATE.format(prompt_chunk)
+    return f"{prompt_part}{COMPLETION_MARKER}{completion_chunk}"
+
 def create_pairs_from_chunks(chunks: list) -> list:
     """Creates prompt/completion pairs from a list of chunks."""
     paired_texts = []
@@ -43,12 +92,94 @@ def create_pairs_from_chunks(chunks: list) -> list:
         return [] # Not enough chunks to form pairs
     # Iterate up to the second-to-last chunk to form pairs
     for i in range(len(chunks) - 1):
-        prompt_part = PROMPT_TEMPLATE.format(chunks[i])
-        completion_part = chunks[i+1]
-        combined_text = f"{prompt_part}\nNEXT EXCERPT:\n{completion_part}"
-        paired_texts.append(combined_text)
+        paired_texts.append(render_pair(chunks[i], chunks[i+1]))
     return paired_texts
 
+def skipped_pairs(dropped_chunks: dict, file_path: Path) -> set:
+    """Pairs of *file_path* that complete with a chunk listed in a dedup report."""
+    # pair k completes with chunk k+1
+    return {k - 1 for k in dropped_chunks.get(str(file_path.resolve()), ()) if k > 0}
+
+def pair_in_train(file_key: str, pair_index: int, seed: int, train_ratio: float) -> bool:
+    """Deterministic split of one pair from a hash of (file, pair index, seed)."""
+    h = hashlib.blake2b(f"{file_key}\0{pair_index}\0{seed}".encode("utf-8"), digest_size=8)
+    return int.from_bytes(h.digest(), "big") < train_ratio * 2 ** 64
+
+def stream_file_pairs(file_path: Path, train_fp, valid_fp, seed: int,
+                      train_ratio: float, skip: set = frozenset()) -> tuple[int, int]:
+    """
+    Render the pairs of one chunks file and write each to *train_fp* or
+    *valid_fp* as soon as it is built.  The split depends only on the file
+    name, the pair index and *seed*, so no other file has to be loaded.
+    """
+    chunks = load_chunks_from_file(file_path)
+    n_train = n_valid = 0
+    for i in range(len(chunks) - 1):
+        if i in skip:
+            continue
+        line = json.dumps({"text": render_pair(chunks[i], chunks[i + 1])}) + '\n'
+        if pair_in_train(file_path.name, i, seed, train_ratio):
+            train_fp.write(line)
+            n_train += 1
+        else:
+            valid_fp.write(line)
+            n_valid += 1
+    return n_train, n_valid
+
+def _stream_part(file_path: Path, part_dir: Path, index: int, seed: int,
+                 train_ratio: float, skip: set) -> tuple[int, int]:
+    with (part_dir / f"{index:06d}.train").open("w", encoding="utf-8") as t, \
+         (part_dir / f"{index:06d}.valid").open("w", encoding="utf-8") as v:
+        return stream_file_pairs(file_path, t, v, seed, train_ratio, skip)
+
+def stream_training_data(input_files: list, output_dir: Path, seed: int,
+                         train_ratio: float, dropped_chunks: dict | None = None,
+                         workers: int = 1, shard_records: int | None = None,
+                         shard_bytes: int | None = None, tokenizer=None,
+                         resume: bool = False) -> tuple[int, int]:
+    """
+    Streaming ``train.jsonl`` / ``valid.jsonl``: one chunks file in memory
+    at a time (per worker) and every pair assigned by ``pair_in_train``.
+
+    With ``workers > 1`` files are processed in parallel into part files
+    that are then appended in input order, so the output is the same for
+    any number of workers.  With ``shard_records`` / ``shard_bytes`` each
+    split goes to ``ShardedJsonlWriter`` shards instead of one file, and
+    ``resume`` keeps the complete shards of an interrupted run.  Returns ``(train pairs, valid pairs)``.
+    """
+    dropped_chunks = dropped_chunks or {}
+    paths = [Path(f) for f in input_files]
+
+    def output(split):
+        if shard_records or shard_bytes:
+            return ShardedJsonlWriter(output_dir, split, shard_records, shard_bytes, tokenizer,
+                                      resume=resume)
+        return (output_dir / f"{split}.jsonl").open("w", encoding="utf-8")
+
+    counts = []
+    with output("train") as train_fp, output("valid") as valid_fp:
+        if workers <= 1:
+            for path in paths:
+                counts.append(stream_file_pairs(path, train_fp, valid_fp, seed, train_ratio,
+                                                skipped_pairs(dropped_chunks, path)))
+                print(f"  {path}: {counts[-1][0]} train, {counts[-1][1]} valid pairs")
+        else:
+            with tempfile.TemporaryDirectory(dir=output_dir) as tmp, \
+                 ProcessPoolExecutor(workers) as pool:
+                part_dir = Path(tmp)
+                futures = [pool.submit(_stream_part, path, part_dir, i, seed, train_ratio,
+                                       skipped_pairs(dropped_chunks, path))
+                           for i, path in enumerate(paths)]
+                for i, (path, future) in enumerate(zip(paths, futures)):
+                    counts.append(future.result())
+                    print(f"  {path}: {counts[-1][0]} train, {counts[-1][1]} valid pairs")
+                    for split, fp in (("train", train_fp), ("valid", valid_fp)):
+                        part = part_dir / f"{i:06d}.{split}"
+                        with part.open("r", encoding="utf-8") as src:
+                            fp.writelines(src)  # whole lines, so a shard never splits one
+                        part.unlink()
+    return sum(c[0] for c in counts), sum(c[1] for c in counts)
+
 if __name__ == "__main__":
     DEFAULT_INPUT_FILES = ["semantic_chunks.json"] # Default is now a list
     DEFAULT_OUTPUT_DIR = "."
@@ -83,11 +214,154 @@ if __name__ == "__main__":
         default=DEFAULT_SEED,
         help=f"Random seed for shuffling data (default: {DEFAULT_SEED})."
     )
+    parser.add_argument(
+        "--dedup_report",
+        type=str,
+        default=None,
+        help="Report from chunk_dedup.py; pairs whose completion is a near-duplicate "
+             "chunk are left out."
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Write pairs as they are built, one file in memory at a time; each pair goes "
+             "to train or valid by a hash of (file name, pair index, seed) instead of a "
+             "global shuffle."
+    )
+    parser.add_argument(
+        "--format",
+        choices=["text", "pairs"],
+        default="text",
+        help="text: fully rendered train/valid.jsonl; pairs: a chunk table plus (prompt, "
+             "completion) references, rendered lazily by pair_dataset.PairDataset and split "
+             "as with --streaming (default: text)."
+    )
+    parser.add_argument(
+        "--pack",
+        action="store_true",
+        help="Also tokenise the pairs and first-fit-decreasing pack them into "
+             "train/valid.packed.jsonl blocks of at most --max_seq_length tokens, with "
+             "segment boundaries; needs --tokenizer_path."
+    )
+    parser.add_argument(
+        "--tokenizer_path",
+        type=str,
+        default=None,
+        help="Tokenizer of the model being trained (for --pack, and token totals in shard "
+             "manifests)."
+    )
+    parser.add_argument(
+        "--max_seq_length",
+        type=int,
+        default=3827,
+        help="Block size for --pack (default: 3827, MAX_SEQ_LENGTH in finetune_qwen3.sh)."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="With --streaming, process this many input files in parallel (default: 1)."
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="Also write .idx line-offset sidecars (jsonl_index.py) next to train/valid.jsonl "
+             "for random access, sampling and sharding without a rescan."
+    )
+    parser.add_argument(
+        "--shard_records",
+        type=int,
+        default=None,
+        help="Write train/valid as <split>-NNNNN.jsonl shards of at most this many pairs, "
+             "with a <split>.manifest.json of per-shard counts, tokens and sha256."
+    )
+    parser.add_argument(
+        "--shard_mb",
+        type=float,
+        default=None,
+        help="As --shard_records, rotating shards at this many MB."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="With --shard_records / --shard_mb, keep the intact shards listed in an existing "
+             "manifest and continue at the first missing one (same inputs and --seed)."
+    )
     args = parser.parse_args()
+    if args.pack and (args.tokenizer_path is None or args.format == "pairs"):
+        parser.error("--pack needs --tokenizer_path and the text format")
+    sharded = bool(args.shard_records or args.shard_mb)
+    if sharded and (args.pack or args.index or args.format == "pairs"):
+        parser.error("--shard_records / --shard_mb cannot be combined with --pack, --index "
+                     "or --format pairs")
+    if args.resume and not sharded:
+        parser.error("--resume needs --shard_records or --shard_mb")
+    shard_bytes = int(args.shard_mb * 1024 * 1024) if args.shard_mb else None
+
+    def shard_tokenizer():
+        if args.tokenizer_path is None:
+            return None
+        from token_budget import load_tokenizer
+        return load_tokenizer(args.tokenizer_path)
+
+    def pack_outputs():
+        from sequence_packing import pack_jsonl, format_report
+        from token_budget import load_tokenizer
+        print(f"\nPacking into blocks of {args.max_seq_length} tokens...")
+        tokenizer = load_tokenizer(args.tokenizer_path)
+        reports = {}
+        for split in ("train", "valid"):
+            reports[split] = pack_jsonl(output_dir / f"{split}.jsonl",
+                                        output_dir / f"{split}.packed.jsonl",
+                                        tokenizer, args.max_seq_length)
+            print(format_report(split, reports[split]))
+        (output_dir / "packing_report.json").write_text(json.dumps(reports, indent=2),
+                                                        encoding="utf-8")
+
+    def index_outputs():
+        from jsonl_index import build_index
+        for split in ("train", "valid"):
+            path = output_dir / f"{split}.jsonl"
+            print(f"Indexed {path} into {build_index(path)}")
 
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True) # Ensure output directory exists
 
+    dropped_chunks = {}
+    if args.dedup_report:
+        dropped_chunks = load_dedup_report(args.dedup_report)
+        print(f"Leaving out {sum(map(len, dropped_chunks.values()))} near-duplicate chunks "
+              f"listed in {args.dedup_report}")
+
+    if args.format == "pairs":
+        from pair_dataset import write_pair_dataset
+        n_train, n_valid = write_pair_dataset(args.input_files, output_dir, args.seed,
+                                              args.train_ratio, dropped_chunks)
+        print(f"\nWrote pair dataset to {output_dir}: {n_train} train, {n_valid} valid pairs")
+        print("\nDone.")
+        exit(0)
+
+    if args.streaming:
+        print(f"Streaming pairs from {len(args.input_files)} files with {args.workers} worker(s)...")
+        n_train, n_valid = stream_training_data(args.input_files, output_dir, args.seed,
+                                                args.train_ratio, dropped_chunks, args.workers,
+                                                args.shard_records, shard_bytes,
+                                                shard_tokenizer() if sharded else None,
+                                                args.resume)
+        print(f"\nTotal training samples: {n_train}")
+        print(f"Total validation samples: {n_valid}")
+        if sharded:
+            print(f"Saved shards listed in {output_dir / 'train.manifest.json'} and "
+                  f"{output_dir / 'valid.manifest.json'}")
+        else:
+            print(f"Saved to {output_dir / 'train.jsonl'} and {output_dir / 'valid.jsonl'}")
+        if args.pack:
+            pack_outputs()
+        if args.index:
+            index_outputs()
+        print("\nDone.")
+        exit(0)
+
     all_chunks_data = []
     max_chunks_len = 0
     file_with_max_chunks = None
@@ -147,6 +421,10 @@ if __name__ == "__main__":
             continue
 
         print(f"    Created {num_pairs_in_file} pairs.")
+        # pair indices stay put so the split of the other pairs is unchanged
+        skipped = skipped_pairs(dropped_chunks, file_path)
+        if skipped:
+            print(f"    Skipping {len(skipped)} pairs that complete with a near-duplicate.")
 
         file_train_data = []
         file_valid_data = []
@@ -165,7 +443,7 @@ if __name__ == "__main__":
         # Iterate through the globally determined shuffled indices
         for idx_in_shuffled_list, original_pair_index in enumerate(indices):
              # Check if this original_pair_index is valid for the current file's pair list
-             if original_pair_index < num_pairs_in_file:
+             if original_pair_index < num_pairs_in_file and original_pair_index not in skipped:
                  pair = paired_texts[original_pair_index]
                  # Determine if this index belongs to the train or validation set based on the split point of the *shuffled* list
                  if idx_in_shuffled_list < split_index: # Check position in the shuffled list
@@ -191,11 +469,24 @@ if __name__ == "__main__":
     train_output_path = output_dir / "train.jsonl"
     valid_output_path = output_dir / "valid.jsonl"
 
-    print(f"\nSaving combined training data to: {train_output_path}")
-    save_to_jsonl(combined_train_data, train_output_path)
-
-    print(f"Saving combined validation data to: {valid_output_path}")
-    save_to_jsonl(combined_valid_data, valid_output_path)
+    if sharded:
+        tokenizer = shard_tokenizer()
+        for split, data in (("train", combined_train_data), ("valid", combined_valid_data)):
+            manifest = save_sharded_jsonl(data, output_dir, split, args.shard_records,
+                                          shard_bytes, tokenizer, args.resume)
+            print(f"Saved {split} data to {manifest['total']['shards']} shards "
+                  f"({output_dir / f'{split}.manifest.json'})")
+    else:
+        print(f"\nSaving combined training data to: {train_output_path}")
+        save_to_jsonl(combined_train_data, train_output_path)
+
+        print(f"Saving combined validation data to: {valid_output_path}")
+        save_to_jsonl(combined_valid_data, valid_output_path)
+
+    if args.pack:
+        pack_outputs()
+    if args.index:
+        index_outputs()
 
     print("\nDone.")
 
@@ -1,40 +1,235 @@
 # semantic_chunker.py
-import json, re
 import numpy as np
 from pathlib import Path
-from typing import List
+from typing import Callable, List
 from tqdm import tqdm
 
-import numpy as np
-from baseline_chunker import load_paragraphs, chunk_paragraphs
-from src.data_processing.bm25_func import bm25_gap_violation
-
-from sentence_transformers import SentenceTransformer
+from baseline_chunker import (iter_paragraphs, dump_chunks_json, count_prefix,
+                              greedy_cut_points, word_count)
+from embedding_cache import EmbeddingCache, DEFAULT_MAX_MB
+from embedding_server import EmbeddingClient, format_metrics
+from prepare_training_data import render_pair
+from token_budget import (DEFAULT_MAX_SEQ_LENGTH, load_tokenizer, token_length_fn,
+                          paragraph_token_counts, chunk_token_budget,
+                          token_budget_spans, separator_tokens)
+from chunk_index import BookBuffer, SpanChunk
+from global_segmenter import global_segment, paragraph_embeddings
+from chunk_manifest import (paragraph_hashes, plan_incremental, manifest_path,
+                            load_manifest, write_manifest)
+from embedding_backends import (BACKENDS, EmbeddingModel, cache_name,
+                                load_embedding_model)
+from src.data_processing.bm25_func import EntityIndex
 
 # ==== plug‑in hooks =========================================================
 # Removed embed and similarities helper functions as logic is now inline
 # ============================================================================
 
-def refine_boundaries(chunks: list[str],
+DEFAULT_CHAR_NAMES = [
+    "Erasmus", "Paris", "Thurso", "William Kemp",
+    "Sarah", "Blair", "Calley", "Kireku", "Delblanc", "Daniel",
+    "Liverpool Merchant", "Loango", "Bonny", "Whydah",
+    "Bight of Benin", "Barbados", "Liverpool", "Mersey"
+]
+
+DOC_PREFIX = "search_document: "
+QUERY_PREFIX = "search_query: "
+
+
+def _embed_one(model: EmbeddingModel,
+               prefix: str,
+               text: str,
+               cache: EmbeddingCache | None = None):
+    """Encode a single window, consulting the on-disk cache first."""
+    if cache is not None:
+        emb = cache.get(prefix, text)
+        if emb is not None:
+            return emb
+    emb = model.encode(prefix + text)
+    if cache is not None:
+        cache.put(prefix, text, emb)
+    return emb
+
+
+def _encode_missing(model: EmbeddingModel,
+                    prefix: str,
+                    texts: list[str],
+                    store: dict,
+                    batch_size: int,
+                    cache: EmbeddingCache | None = None) -> int:
+    """Batch-encode every text in *texts* not yet in *store*; return count."""
+    todo = list(dict.fromkeys(t for t in texts if t not in store))
+    if cache is not None:
+        remaining = []
+        for text in todo:
+            emb = cache.get(prefix, text)
+            if emb is None:
+                remaining.append(text)
+            else:
+                store[text] = emb
+        todo = remaining
+    if not todo:
+        return 0
+    embs = model.encode([prefix + t for t in todo], batch_size=batch_size)
+    for text, emb in zip(todo, embs):
+        store[text] = emb
+        if cache is not None:
+            cache.put(prefix, text, emb)
+    return len(todo)
+
+
+def _split_oversize(chunk: SpanChunk,
+                    max_size: int,
+                    length_fn: Callable[[str], int]) -> list[SpanChunk]:
+    """Baseline-chunk one oversize chunk again; returns the pieces as spans."""
+    buffer = chunk.buffer
+    if length_fn is word_count:
+        prefix = np.asarray(buffer.word_prefix[chunk.start:chunk.end + 1],
+                            dtype=np.int64) - buffer.word_prefix[chunk.start]
+    else:
+        prefix = count_prefix([length_fn(p) for p in chunk.paragraphs()])
+    pieces = [SpanChunk(buffer, chunk.start + s, chunk.start + e)
+              for s, e in greedy_cut_points(prefix, max_size)]
+    pieces[-1].suffix = chunk.suffix
+    return pieces
+
+
+def _chunk_size(chunk: SpanChunk, length_fn: Callable[[str], int]) -> int:
+    if length_fn is word_count:
+        return chunk.n_words  # kept up to date as paragraphs move
+    return length_fn(chunk.text())
+
+
+def speculative_window_embeddings(chunks: list[SpanChunk],
+                                  tail_len: int = 2,
+                                  head_len: int = 2,
+                                  thresh_low: float = 0.15,
+                                  max_size: int = 1200,
+                                  batch_size: int = 256,
+                                  model: EmbeddingModel = None,
+                                  cache: EmbeddingCache | None = None,
+                                  length_fn: Callable[[str], int] = word_count
+                                  ) -> tuple[dict, dict]:
+    """
+    Pre-compute the join-window embeddings ``refine_boundaries`` will need.
+
+    Pass 1 encodes the tail of every original chunk and the head of every
+    following chunk in large batches.  Pass 2 re-encodes, again in one batch,
+    only the tails of chunks that the pass‑1 similarities predict will lose
+    their first paragraph to the previous chunk (or be split for size), since
+    those are the only places the sequential walk will see a different tail.
+
+    Returns ``(doc_store, query_store)`` mapping window text → embedding.
+    Any window still missing (a BM25 move the prediction could not see) is
+    encoded on demand by ``refine_boundaries``, so decisions are unchanged.
+    """
+    doc_store, query_store = {}, {}
+    windows = [(chunks[i - 1].tail(tail_len), chunks[i].head(head_len))
+               for i in range(1, len(chunks))]
+
+    # ---- pass 1: every boundary as if no earlier boundary changed ----------
+    _encode_missing(model, DOC_PREFIX, [t for t, _ in windows],
+                    doc_store, batch_size, cache)
+    _encode_missing(model, QUERY_PREFIX, [h for _, h in windows],
+                    query_store, batch_size, cache)
+
+    # ---- pass 2: tails of chunks changed by a predicted move / split -------
+    changed_tails = []
+    for i in range(1, len(chunks) - 1):
+        tail, head = windows[i - 1]
+        chunk = chunks[i]
+        skip = 0
+        sim = model.similarity(doc_store[tail], query_store[head])[0, 0]
+        if sim < thresh_low and len(chunk) > 1:
+            skip = 1
+        rest = SpanChunk(chunk.buffer, chunk.start + skip, chunk.end)
+        if _chunk_size(rest, length_fn) > max_size:
+            changed_tails.append(
+                _split_oversize(rest, max_size, length_fn)[-1].tail(tail_len))
+        elif skip:
+            changed_tails.append(rest.tail(tail_len))
+    _encode_missing(model, DOC_PREFIX, changed_tails, doc_store,
+                    batch_size, cache)
+
+    return doc_store, query_store
+
+
+def refine_boundaries(chunks: list[str] | list[SpanChunk],
                       tail_len: int = 2,
                       head_len: int = 2,
                       thresh_low: float = 0.15,
                       thresh_high: float = 0.65,
-                      char_names: list[str] = [
-                          "Erasmus", "Paris", "Thurso", "William Kemp",
-                          "Sarah", "Blair", "Calley", "Kireku", "Delblanc", "Daniel",
-                          "Liverpool Merchant", "Loango", "Bonny", "Whydah",
-                          "Bight of Benin", "Barbados", "Liverpool", "Mersey"
-                      ],
+                      char_names: list[str] = DEFAULT_CHAR_NAMES,
                       max_bm25_gap: int = 4,
                       max_size: int = 1200,
-                      model: SentenceTransformer = None):
+                      model: EmbeddingModel = None,
+                      batch_size: int | None = None,
+                      cache: EmbeddingCache | None = None,
+                      entity_index: EntityIndex | None = None,
+                      length_fn: Callable[[str], int] = word_count,
+                      decisions: list | None = None):
+    """
+    Refine baseline chunk boundaries using join similarity and BM25 continuity.
+
+    The walk works on ``SpanChunk`` offsets into one shared ``BookBuffer``
+    (string *chunks* are buffered once; ``SpanChunk`` input is used as is),
+    so shifting a paragraph across a join is an integer update and taking
+    the last ``tail_len`` / first ``head_len`` sentences costs O(window).
+    Refined chunks come back in the form they were given: strings for
+    strings, ``SpanChunk`` objects over the same buffer for spans, whose
+    text is only built when they are written out.
+
+    With ``batch_size=None`` every tail/head window is encoded one string at
+    a time as the walk reaches it.  With a ``batch_size`` the windows are
+    encoded up front by ``speculative_window_embeddings`` and the walk only
+    looks them up, falling back to a single encode for mispredicted windows.
+    Both modes make the same decisions.
+
+    If an ``EmbeddingCache`` is given it is checked before every call to
+    ``model.encode`` and filled with whatever had to be encoded.
+
+    The BM25 continuity check runs against a book-wide ``EntityIndex``
+    (built from the buffered paragraphs with ``char_names`` unless one is
+    passed in, in which case it must index the same paragraphs).  The gap
+    of every entity at every original boundary is decided up front in one
+    vectorised pass over its bitmap; the walk only re-checks joins whose
+    neighbouring chunk an earlier move or split has changed.
+
+    ``max_size`` is measured with ``length_fn`` – whitespace words by
+    default, or model tokens via ``token_budget.token_length_fn``.
+
+    If a ``decisions`` list is passed, one ``{"sim": ..., "action": ...}``
+    dict per boundary of the *refined* chunks is appended to it (action
+    ``"move"``, ``"duplicate"``, ``"bm25"``, ``"keep"``, or ``"split"`` with
+    no similarity between pieces of an oversize chunk), for the manifest
+    of ``chunk_manifest.write_manifest``.
+    """
     new_chunks = []
     modification_count = 0  # Initialize modification counter
     modified_current_boundary = False  # Flag to track if current boundary was modified
 
+    as_spans = bool(chunks) and isinstance(chunks[0], SpanChunk)
+    if as_spans:
+        buffer = chunks[0].buffer
+        indexed = [SpanChunk(buffer, c.start, c.end, c.suffix) for c in chunks]
+    else:
+        buffer, indexed = BookBuffer.from_chunks(chunks)
+    spans = [(c.start, c.end) for c in indexed]
+
+    doc_store, query_store = {}, {}
+    if batch_size:
+        doc_store, query_store = speculative_window_embeddings(
+            indexed, tail_len, head_len, thresh_low, max_size, batch_size,
+            model, cache, length_fn)
+    speculation_misses = 0
+
+    if entity_index is None:
+        entity_index = EntityIndex(
+            [buffer.paragraph(i) for i in range(len(buffer))], char_names)
+    planned_violations = entity_index.violations(
+        spans[:-1], spans[1:], max_bm25_gap).any(axis=0)
+
     # Wrap chunks with tqdm for progress bar
-    for i, chunk in enumerate(tqdm(chunks, desc="Refining chunk boundaries")):
+    for i, chunk in enumerate(tqdm(indexed, desc="Refining chunk boundaries")):
         modified_current_boundary = False # Reset flag for each boundary check
         if i == 0:
             new_chunks.append(chunk)
@@ -42,58 +237,178 @@ def refine_boundaries(chunks: list[str],
 
         prev = new_chunks[-1]
         # candidate sentences near the join
-        prev_sents = re.split(r'(?<=[.!?])\\s+', prev)
-        next_sents = re.split(r'(?<=[.!?])\\s+', chunk)
-        tail = " ".join(prev_sents[-tail_len:])
-        head = " ".join(next_sents[:head_len])
+        tail = prev.tail(tail_len)
+        head = chunk.head(head_len)
 
         # Encode tail as document, head as query
-        tail_embedding = model.encode(f"search_document: {tail}")
-        head_embedding = model.encode(f"search_query: {head}")
+        if batch_size:
+            speculation_misses += _encode_missing(
+                model, DOC_PREFIX, [tail], doc_store, batch_size, cache)
+            speculation_misses += _encode_missing(
+                model, QUERY_PREFIX, [head], query_store, batch_size, cache)
+            tail_embedding = doc_store[tail]
+            head_embedding = query_store[head]
+        else:
+            tail_embedding = _embed_one(model, DOC_PREFIX, tail, cache)
+            head_embedding = _embed_one(model, QUERY_PREFIX, head, cache)
         # Calculate similarity
         sim = model.similarity(tail_embedding, head_embedding)[0, 0] # Access the single similarity score
+        action = "keep"
 
         if sim < thresh_low:
             # move first paragraph of current chunk back to previous
-            para_split = re.split(r'\\n{2,}', chunk, maxsplit=1)
-            if len(para_split) == 2:
-                new_chunks[-1] += "\\n\\n" + para_split[0]
-                chunk = para_split[1]
+            if chunk.move_first_paragraph_to(prev):
                 modification_count += 1
                 modified_current_boundary = True
+                action = "move"
         elif sim > thresh_high:
             # duplicate a connecting sentence for continuity
-            new_chunks[-1] += " " + head
+            prev.append_text(" " + head)
             modification_count += 1
             modified_current_boundary = True
+            action = "duplicate"
 
         # BM25 continuity check (pseudo) - only check if not already modified by similarity
         if not modified_current_boundary:
-            for character in char_names:
-                if bm25_gap_violation((new_chunks[-1], chunk), character, max_bm25_gap):
-                    # pull one paragraph back if gap too wide
-                    para_split = re.split(r'\\n{2,}', chunk, maxsplit=1)
-                    if len(para_split) == 2:
-                        new_chunks[-1] += "\\n\\n" + para_split[0]
-                        chunk = para_split[1]
-                        modification_count += 1
-                        modified_current_boundary = True
-                        break # Stop checking characters for this boundary once modified
+            prev_span = (prev.start, prev.end)
+            if prev_span == spans[i - 1]:
+                violated = planned_violations[i - 1]
+            else:
+                violated = entity_index.violations(
+                    [prev_span], [(chunk.start, chunk.end)], max_bm25_gap).any()
+            if violated:
+                # pull one paragraph back if gap too wide
+                if chunk.move_first_paragraph_to(prev):
+                    modification_count += 1
+                    modified_current_boundary = True
+                    action = "bm25"
+        if decisions is not None:
+            decisions.append({"sim": round(float(sim), 6), "action": action})
 
         # enforce hard upper size
-        if len(chunk.split()) > max_size:
+        if _chunk_size(chunk, length_fn) > max_size:
             # optional second pass of baseline chunking just on *this* oversize chunk
-            mini_chunks = chunk_paragraphs(
-                re.split(r'\\n{2,}', chunk), target_words=max_size)
+            mini_chunks = _split_oversize(chunk, max_size, length_fn)
             new_chunks.extend(mini_chunks)
             modification_count += 1 # Count the split as one modification event
+            if decisions is not None:
+                decisions.extend({"sim": None, "action": "split"}
+                                 for _ in mini_chunks[1:])
             # Don't append the original oversized chunk
         else:
             # Only append if the chunk wasn't replaced by mini_chunks
             new_chunks.append(chunk)
 
+    if batch_size:
+        print(f"Speculative embedding: {len(doc_store) + len(query_store)} windows prepared, "
+              f"{speculation_misses} encoded on demand after a misprediction.")
+
+    if not as_spans:
+        new_chunks = [c.text() for c in new_chunks]
     return new_chunks, modification_count # Return modification count
 
+
+def refine_incremental(buffer: BookBuffer,
+                       hashes: list[str],
+                       manifest: dict,
+                       base_spans: Callable[[int, int], list[tuple[int, int]]],
+                       neighbourhood: int = 1,
+                       **refine_kwargs) -> tuple[list[SpanChunk], list[dict], int]:
+    """
+    Redo ``refine_boundaries`` only where the book changed since *manifest*.
+
+    *hashes* are the paragraph hashes of *buffer*.  Chunks the diff keeps
+    (see ``chunk_manifest.plan_incremental``) are reused with their recorded
+    decisions.  Every changed region is baseline-chunked again with
+    ``base_spans(start, end)`` (spans relative to *start*) and refined
+    together with the kept chunk either side of it, so the seams are
+    decided again too.
+
+    Returns ``(chunks, decisions, boundaries redone)``.
+    """
+    if refine_kwargs.get("entity_index") is None:
+        refine_kwargs["entity_index"] = EntityIndex(
+            [buffer.paragraph(i) for i in range(len(buffer))],
+            refine_kwargs.get("char_names", DEFAULT_CHAR_NAMES))
+    old_chunks, old_decisions = manifest["chunks"], manifest["decisions"]
+    plan = plan_incremental(manifest["paragraph_hashes"], hashes,
+                            [(s, e) for s, e, _ in old_chunks], neighbourhood)
+
+    chunks, decisions, redone = [], [], 0
+    j = 0
+    while j < len(plan):
+        if plan[j][0] == "keep":
+            _, k, start, end = plan[j]
+            if chunks:
+                decisions.append(old_decisions[k - 1])
+            chunks.append(SpanChunk(buffer, start, end, old_chunks[k][2]))
+            j += 1
+            continue
+
+        _, start, end = plan[j]
+        region = []
+        if chunks:
+            # its appended text belonged to the join being redone
+            seed = chunks.pop()
+            region.append(SpanChunk(buffer, seed.start, seed.end))
+        region.extend(SpanChunk(buffer, start + s, start + e)
+                      for s, e in base_spans(start, end))
+        if j + 1 < len(plan):
+            _, k, s, e = plan[j + 1]
+            region.append(SpanChunk(buffer, s, e, old_chunks[k][2]))
+        j += 2
+
+        region_decisions = []
+        if len(region) > 1:
+            region, _ = refine_boundaries(region, decisions=region_decisions,
+                                          **refine_kwargs)
+        chunks.extend(region)
+        decisions.extend(region_decisions)
+        redone += len(region_decisions)
+    return chunks, decisions, redone
+
+
+def word_base_spans(buffer: BookBuffer,
+                    target_words: int) -> Callable[[int, int], list[tuple[int, int]]]:
+    """``base_spans`` for ``refine_with_manifest``: greedy word-count chunks."""
+    prefix = np.asarray(buffer.word_prefix, dtype=np.int64)
+    def base_spans(start: int, end: int) -> list[tuple[int, int]]:
+        return greedy_cut_points(prefix[start:end + 1] - prefix[start], target_words)
+    return base_spans
+
+
+def refine_with_manifest(buffer: BookBuffer,
+                         base_spans: Callable[[int, int], list[tuple[int, int]]],
+                         output_path: str | Path,
+                         params: dict,
+                         incremental: bool = False,
+                         neighbourhood: int = 1,
+                         **refine_kwargs) -> list[SpanChunk]:
+    """
+    Refine a whole book and record the run in ``<output_path>.manifest.json``.
+
+    With ``incremental`` and a manifest written with the same *params*,
+    only the boundaries around paragraphs that changed since are redone
+    (``refine_incremental``); otherwise every boundary is.
+    """
+    path = manifest_path(output_path)
+    hashes = paragraph_hashes(buffer)
+    manifest = load_manifest(path, params) if incremental else None
+    if manifest is None:
+        base = [SpanChunk(buffer, s, e) for s, e in base_spans(0, len(buffer))]
+        print(f"Refining {len(base)} baseline chunks...")
+        decisions = []
+        refined, mod_count = refine_boundaries(base, decisions=decisions,
+                                               **refine_kwargs)
+        print(f"Refinement process modified {mod_count} chunk boundaries.")
+    else:
+        refined, decisions, redone = refine_incremental(
+            buffer, hashes, manifest, base_spans, neighbourhood, **refine_kwargs)
+        print(f"Incremental refinement: redid {redone} of {len(decisions)} "
+              f"boundaries, reused the rest from {path}.")
+    write_manifest(path, hashes, refined, decisions, params)
+    return refined
+
 if __name__ == "__main__":
     import argparse
 
@@ -124,32 +439,241 @@ if __name__ == "__main__":
         default=DEFAULT_MODEL_NAME,
         help=f"Name of the SentenceTransformer model to use for embeddings (default: {DEFAULT_MODEL_NAME})."
     )
+    ap.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="sentence-transformers",
+        help="Embedding backend: sentence-transformers (torch) or mlx, a native "
+             "ModernBERT encoder (default: sentence-transformers)."
+    )
+    ap.add_argument(
+        "--device",
+        type=str,
+        default=None,
+        help="Device for the embedding backend, e.g. cpu (default: backend's choice)."
+    )
     ap.add_argument(
         "--output_path",
         type=str,
         default=DEFAULT_OUTPUT_PATH,
         help=f"Path to the output file (default: {DEFAULT_OUTPUT_PATH})."
     )
+    ap.add_argument(
+        "--batch_size",
+        type=int,
+        default=None,
+        help="Encode all join windows up front in batches of this size instead of "
+             "one string per boundary (default: sequential encoding)."
+    )
+    ap.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Directory for the persistent embedding cache (default: no cache)."
+    )
+    ap.add_argument(
+        "--cache_max_mb",
+        type=int,
+        default=DEFAULT_MAX_MB,
+        help=f"Size bound of the embedding cache in MB; least recently used "
+             f"vectors are evicted beyond it (default: {DEFAULT_MAX_MB})."
+    )
+    ap.add_argument(
+        "--targets",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Several target sizes in one run (e.g. 350 480 520 570 680 730 790): the "
+             "book is read and word-counted once and one file is written per target."
+    )
+    ap.add_argument(
+        "--tokenizer_path",
+        type=str,
+        default=None,
+        help="Chunk by model tokens instead of words: tokenizer (e.g. the MLX model "
+             "directory) used to size chunks so prompt template + two consecutive "
+             "chunks fit --max_seq_length. Overrides --target/--targets."
+    )
+    ap.add_argument(
+        "--max_seq_length",
+        type=int,
+        default=DEFAULT_MAX_SEQ_LENGTH,
+        help=f"Training sequence length for --tokenizer_path (default: {DEFAULT_MAX_SEQ_LENGTH}, "
+             f"as in finetune_qwen3.sh)."
+    )
+    ap.add_argument(
+        "--output_template",
+        type=str,
+        default="{stem}_{target}.json",
+        help="Output path for --targets; {stem} is the book file name without "
+             "extension (default: {stem}_{target}.json)."
+    )
+    ap.add_argument(
+        "--segmenter",
+        choices=["refine", "dp"],
+        default="refine",
+        help="'refine' adjusts greedy baseline chunks boundary by boundary; 'dp' embeds "
+             "every paragraph once and picks all boundaries jointly by dynamic "
+             "programming over the similarity curve (default: refine)."
+    )
+    ap.add_argument(
+        "--min_size",
+        type=int,
+        default=None,
+        help="Smallest chunk for --segmenter dp, in words or tokens "
+             "(default: half the target)."
+    )
+    ap.add_argument(
+        "--max_size",
+        type=int,
+        default=None,
+        help="Largest chunk for --segmenter dp, in words (default: 1.5 × target); "
+             "with --tokenizer_path the token budget is always the limit."
+    )
+    ap.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Reuse the manifest written next to the output by an earlier run: only "
+             "boundaries near paragraphs that changed since are recomputed."
+    )
+    ap.add_argument(
+        "--neighbourhood",
+        type=int,
+        default=1,
+        help="With --incremental, also redo this many chunks either side of a "
+             "changed one (default: 1)."
+    )
+    ap.add_argument(
+        "--embedding_server",
+        type=str,
+        nargs="?",
+        const="",
+        default=None,
+        help="Encode through a running embedding_server.py (its default socket, or the "
+             "given Unix socket path or loopback host:port) instead of loading the model "
+             "in this process."
+    )
     args = ap.parse_args()
 
     if args.target != DEFAULT_TARGET_WORDS:
         args.output_path = f"allthekingsmen_{args.target}.json"
         print(f"Using output path: {args.output_path}")
 
-    print(f"Loading sentence transformer model: {args.model_name}")
-    model = SentenceTransformer(args.model_name, trust_remote_code=True)
+    if args.embedding_server is not None:
+        model = EmbeddingClient(args.embedding_server or None)
+        served = model.info()["model_name"]
+        print(f"Using embedding server {args.embedding_server or 'on the default socket'} ({served})")
+        if served != args.model_name:
+            print(f"Warning: server runs {served}, not --model_name {args.model_name}.")
+    else:
+        print(f"Loading {args.backend} model: {args.model_name}")
+        model = load_embedding_model(args.model_name, args.backend, args.device)
+
+    cache = None
+    if args.cache_dir:
+        cache = EmbeddingCache(args.cache_dir, cache_name(args.model_name, args.backend),
+                               args.cache_max_mb)
+        print(f"Using embedding cache: {cache.root} ({len(cache.index)} entries)")
+
+    if args.tokenizer_path:
+        print(f"Loading tokenizer: {args.tokenizer_path}")
+        tokenizer = load_tokenizer(args.tokenizer_path)
+        length_fn = token_length_fn(tokenizer)
+        budget = chunk_token_budget(tokenizer, args.max_seq_length)
+
+        print(f"Loading paragraphs from: {args.book_path}")
+        paras = list(iter_paragraphs(args.book_path))
+        buffer = BookBuffer(paras)
+        counts = paragraph_token_counts(paras, tokenizer,
+                                        cache_path=f"{args.book_path}.tokcounts.npz")
+
+        sep = separator_tokens(tokenizer)
+        if args.segmenter == "dp":
+            print(f"Segmenting globally (~{int(budget * 0.9)}, ≤ {budget} tokens per chunk)...")
+            refined = global_segment(
+                buffer, model, int(budget * 0.9), args.min_size, budget + sep,
+                size_prefix=count_prefix(np.asarray(counts) + sep),
+                doc_prefix=DOC_PREFIX, batch_size=args.batch_size or 256, cache=cache)
+        else:
+            print(f"Creating baseline chunks (≤ {int(budget * 0.9)} of {budget} tokens per chunk)...")
+            params = {"model_name": args.model_name, "tokenizer_path": args.tokenizer_path,
+                      "max_seq_length": args.max_seq_length}
+            refined = refine_with_manifest(
+                buffer, lambda a, b: token_budget_spans(counts[a:b], int(budget * 0.9), sep),
+                args.output_path, params, args.incremental, args.neighbourhood,
+                model=model, max_size=budget, batch_size=args.batch_size, cache=cache,
+                entity_index=EntityIndex(paras, DEFAULT_CHAR_NAMES), length_fn=length_fn)
+
+        pair_lengths = [len(tokenizer.encode(render_pair(a, b)))
+                        for a, b in zip(refined, refined[1:])]
+        over = sum(n > args.max_seq_length for n in pair_lengths)
+        if pair_lengths:
+            print(f"Pairs use {np.mean(pair_lengths) / args.max_seq_length:.1%} of "
+                  f"{args.max_seq_length} tokens on average; {over}/{len(pair_lengths)} exceed it.")
+
+        with open(args.output_path, "w", encoding="utf‑8") as f:
+            dump_chunks_json(refined, f)
+        print(f"Wrote {len(refined)} refined chunks to {args.output_path}")
+    elif args.targets:
+        print(f"Loading paragraphs from: {args.book_path}")
+        buffer = BookBuffer(iter_paragraphs(args.book_path))
+        paras = [buffer.paragraph(i) for i in range(len(buffer))]
+        stem = Path(args.book_path).stem
+        if args.segmenter == "dp":
+            # one embedding pass serves every target
+            print(f"Embedding {len(paras)} paragraphs...")
+            embs = paragraph_embeddings(model, paras, DOC_PREFIX,
+                                        args.batch_size or 256, cache)
+        else:
+            entity_index = EntityIndex(paras, DEFAULT_CHAR_NAMES)
+
+        for target in args.targets:
+            output_path = args.output_template.format(stem=stem, target=target)
+            if args.segmenter == "dp":
+                print(f"\nTarget {target}: segmenting globally...")
+                refined = global_segment(buffer, model, target, args.min_size,
+                                         args.max_size, embs=embs)
+            else:
+                print(f"\nTarget {target}: baseline chunks of ~{int(target * 0.9)} words")
+                refined = refine_with_manifest(
+                    buffer, word_base_spans(buffer, int(target * 0.9)), output_path,
+                    {"model_name": args.model_name, "target": target},
+                    args.incremental, args.neighbourhood,
+                    model=model, batch_size=args.batch_size, cache=cache,
+                    entity_index=entity_index)
+            with open(output_path, "w", encoding="utf‑8") as f:
+                dump_chunks_json(refined, f)
+            print(f"Wrote {len(refined)} refined chunks to {output_path}")
+    elif args.segmenter == "dp":
+        print(f"Loading paragraphs from: {args.book_path}")
+        buffer = BookBuffer(iter_paragraphs(args.book_path))
+
+        print(f"Segmenting {len(buffer)} paragraphs globally (target ~{args.target} words)...")
+        refined = global_segment(buffer, model, args.target, args.min_size,
+                                 args.max_size, doc_prefix=DOC_PREFIX,
+                                 batch_size=args.batch_size or 256, cache=cache)
 
-    print(f"Loading paragraphs from: {args.book_path}")
-    paras = load_paragraphs(args.book_path)
+        with open(args.output_path, "w", encoding="utf‑8") as f:
+            dump_chunks_json(refined, f)
+        print(f"Wrote {len(refined)} chunks to {args.output_path}")
+    else:
+        print(f"Loading paragraphs from: {args.book_path}")
+        buffer = BookBuffer(iter_paragraphs(args.book_path))
 
-    print(f"Creating baseline chunks (target ~{int(args.target * 0.9)} words)...")
-    base = chunk_paragraphs(paras, int(args.target * 0.9))
+        print(f"Creating baseline chunks (target ~{int(args.target * 0.9)} words)...")
+        refined = refine_with_manifest(
+            buffer, word_base_spans(buffer, int(args.target * 0.9)), args.output_path,
+            {"model_name": args.model_name, "target": args.target},
+            args.incremental, args.neighbourhood,
+            model=model, batch_size=args.batch_size, cache=cache)
 
-    print(f"Refining {len(base)} baseline chunks...")
-    refined, mod_count = refine_boundaries(base, model=model) # Capture modification count
-    print(f"Refinement process modified {mod_count} chunk boundaries.") # Print count
+        with open(args.output_path, "w", encoding="utf‑8") as f:
+            dump_chunks_json(refined, f)
+        print(f"Wrote {len(refined)} refined chunks to {args.output_path}")
 
-    Path(args.output_path).write_text(
-        json.dumps({"chunks": refined, "count": len(refined)}, indent=2),
-        encoding="utf‑8")
-    print(f"Wrote {len(refined)} refined chunks to {args.output_path}")
+    if cache is not None:
+        cache.save()
+        print(cache.report())
+    if args.embedding_server is not None:
+        print(f"Embedding server: {format_metrics(model.metrics())}")
+        model.close()
@@ -0,0 +1,127 @@
+# sequence_packing.py
+import json
+from pathlib import Path
+
+import numpy as np
+
+from token_budget import DEFAULT_MAX_SEQ_LENGTH
+
+
+def first_fit_decreasing(lengths, capacity: int) -> list[list[int]]:
+    """
+    Bin-pack items into bins of ``capacity``: longest first, each into the
+    first bin it fits.  A max segment tree over the bins' free space finds
+    that bin in O(log n).  Items longer than ``capacity`` count as full
+    bins.  Returns the item ids of every bin, in bin order.
+    """
+    lengths = np.minimum(np.asarray(lengths, dtype=np.int64), capacity)
+    n = len(lengths)
+    size = 1
+    while size < max(n, 1):
+        size *= 2
+    free = [capacity] * (2 * size)  # every leaf is a (possibly unopened) bin
+    bins: list[list[int]] = []
+    for item in np.argsort(-lengths, kind="stable").tolist():
+        need = int(lengths[item])
+        node = 1
+        while node < size:
+            node = 2 * node if free[2 * node] >= need else 2 * node + 1
+        b = node - size
+        if b == len(bins):
+            bins.append([])
+        bins[b].append(item)
+        free[node] -= need
+        node //= 2
+        while node:
+            free[node] = max(free[2 * node], free[2 * node + 1])
+            node //= 2
+    return bins
+
+
+def tokenize_texts(texts: list[str], tokenizer, batch_size: int = 256) -> list[list[int]]:
+    """Token ids of every text, each ending in EOS as the trainer appends it."""
+    eos = tokenizer.eos_token_id
+    out = []
+    for start in range(0, len(texts), batch_size):
+        for ids in tokenizer(texts[start:start + batch_size])["input_ids"]:
+            if eos is not None and (not ids or ids[-1] != eos):
+                ids = ids + [eos]
+            out.append(ids)
+    return out
+
+
+def pack_sequences(token_lists: list[list[int]],
+                   max_seq_length: int = DEFAULT_MAX_SEQ_LENGTH) -> tuple[list[dict], dict]:
+    """
+    Pack tokenised pairs into blocks of at most ``max_seq_length`` tokens.
+
+    Each block is ``{"input_ids": [...], "segments": [[start, end], ...]}``;
+    attention and loss should be masked per segment.  Pairs longer than
+    ``max_seq_length`` are truncated into a block of their own, as the
+    trainer would.  Returns ``(blocks, report)``.
+    """
+    lengths = np.array([len(t) for t in token_lists], dtype=np.int64)
+    blocks = []
+    for members in first_fit_decreasing(lengths, max_seq_length):
+        ids, segments = [], []
+        for item in sorted(members):  # keep the input order inside a block
+            seq = token_lists[item][:max_seq_length]
+            segments.append([len(ids), len(ids) + len(seq)])
+            ids.extend(seq)
+        blocks.append({"input_ids": ids, "segments": segments})
+    return blocks, packing_report(lengths, blocks, max_seq_length)
+
+
+def packing_report(lengths: np.ndarray, blocks: list[dict], max_seq_length: int) -> dict:
+    """Share of the per-step token budget that holds real tokens, packed vs one pair per step."""
+    kept = int(np.minimum(lengths, max_seq_length).sum())
+    return {
+        "pairs": int(len(lengths)),
+        "blocks": len(blocks),
+        "tokens": kept,
+        "truncated_pairs": int((lengths > max_seq_length).sum()),
+        "max_seq_length": max_seq_length,
+        "mean_pairs_per_block": round(len(lengths) / max(len(blocks), 1), 3),
+        "efficiency": round(kept / max(len(blocks) * max_seq_length, 1), 4),
+        "unpacked_efficiency": round(kept / max(len(lengths) * max_seq_length, 1), 4),
+    }
+
+
+def pack_jsonl(input_path: Path, output_path: Path, tokenizer,
+               max_seq_length: int = DEFAULT_MAX_SEQ_LENGTH) -> dict:
+    """Pack the ``{"text": ...}`` records of *input_path* into *output_path*; returns the report."""
+    with input_path.open("r", encoding="utf-8") as f:
+        texts = [json.loads(line)["text"] for line in f if line.strip()]
+    blocks, report = pack_sequences(tokenize_texts(texts, tokenizer), max_seq_length)
+    with output_path.open("w", encoding="utf-8") as f:
+        for block in blocks:
+            f.write(json.dumps(block) + "\n")
+    return report
+
+
+def format_report(name: str, r: dict) -> str:
+    return (f"{name}: {r['pairs']} pairs → {r['blocks']} blocks of ≤{r['max_seq_length']} tokens "
+            f"({r['mean_pairs_per_block']:.2f} pairs/block); efficiency {r['efficiency']:.1%} "
+            f"vs {r['unpacked_efficiency']:.1%} unpacked; {r['truncated_pairs']} truncated")
+
+
+if __name__ == "__main__":
+    import argparse
+    from token_budget import load_tokenizer
+
+    ap = argparse.ArgumentParser(
+        description="Pack train.jsonl / valid.jsonl pairs into max-length token blocks.")
+    ap.add_argument("data_dir", help="directory with train.jsonl and valid.jsonl")
+    ap.add_argument("--tokenizer_path", required=True)
+    ap.add_argument("--max_seq_length", type=int, default=DEFAULT_MAX_SEQ_LENGTH)
+    args = ap.parse_args()
+
+    tokenizer = load_tokenizer(args.tokenizer_path)
+    data_dir = Path(args.data_dir)
+    reports = {}
+    for split in ("train", "valid"):
+        reports[split] = pack_jsonl(data_dir / f"{split}.jsonl",
+                                    data_dir / f"{split}.packed.jsonl",
+                                    tokenizer, args.max_seq_length)
+        print(format_report(split, reports[split]))
+    (data_dir / "packing_report.json").write_text(json.dumps(reports, indent=2), encoding="utf-8")
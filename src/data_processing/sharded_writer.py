@@ -0,0 +1,255 @@
+# sharded_writer.py
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+MANIFEST_VERSION = 1
+
+
+def shard_name(prefix: str, index: int) -> str:
+    return f"{prefix}-{index:05d}.jsonl"
+
+
+def manifest_name(prefix: str) -> str:
+    return f"{prefix}.manifest.json"
+
+
+class ShardedJsonlWriter:
+    """
+    File-like JSONL writer that rotates to a new ``<prefix>-NNNNN.jsonl``
+    shard after ``max_records`` lines or ``max_bytes`` bytes.
+
+    Every shard is written as ``.tmp`` and renamed only once complete, and
+    the manifest – per-shard records, bytes, sha256 and (with a tokenizer)
+    tokens – is rewritten after each shard.  A failed run therefore leaves
+    complete, listed shards plus at most one partial ``.tmp`` to redo.
+
+    Opening the writer deletes ``<prefix>-NNNNN.jsonl.tmp`` files and the
+    shards listed in the previous manifest that the run does not keep, so a
+    shorter rerun leaves no stale shards; other files are never touched.
+    *metadata* (JSON values describing the run) goes into every manifest,
+    and with ``resume`` the shards listed in an existing manifest (written
+    with the same limits and metadata) are checked, the intact leading ones kept, and as many
+    written lines as they hold are dropped before writing continues at the
+    next shard – for producers that write the same lines again on a rerun.
+    ``write`` takes one or more complete lines (``str`` or ``bytes``);
+    ``source`` tallies the lines per source in the shard's ``per_source``.
+    """
+
+    def __init__(self, output_dir: str | Path, prefix: str, max_records: int | None = None,
+                 max_bytes: int | None = None, tokenizer=None, manifest: str | None = None,
+                 resume: bool = False, metadata: dict | None = None):
+        if not max_records and not max_bytes:
+            raise ValueError("Give max_records and/or max_bytes")
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.prefix, self.max_records, self.max_bytes = prefix, max_records, max_bytes
+        self.tokenizer = tokenizer
+        self.metadata = json.loads(json.dumps(metadata or {}))  # as it reads back from the manifest
+        self.manifest_path = self.output_dir / (manifest or manifest_name(prefix))
+        self.shards: list[dict] = []
+        self._fp = self._hash = None
+        self._manifest = None
+        previous = self._previous_manifest()
+        if resume and previous is not None:
+            self.shards = self._resumable_shards(previous)
+        self._skip = sum(s["records"] for s in self.shards)  # lines already in kept shards
+        self._remove_stale_shards(previous)
+
+    def _tokenizer_name(self) -> str | None:
+        return (str(getattr(self.tokenizer, "name_or_path", "")) or None) \
+            if self.tokenizer is not None else None
+
+    def _previous_manifest(self) -> dict | None:
+        try:
+            manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            print(f"Warning: ignoring unreadable manifest {self.manifest_path}.")
+            return None
+        return manifest if manifest.get("prefix") == self.prefix else None
+
+    def _resumable_shards(self, manifest: dict) -> list[dict]:
+        if (manifest["prefix"], manifest["max_records"], manifest["max_bytes"], manifest["tokenizer"]) \
+                != (self.prefix, self.max_records, self.max_bytes, self._tokenizer_name()):
+            raise ValueError(f"{self.manifest_path} was written with another prefix, shard limit "
+                             f"or tokenizer; rerun without resume")
+        changed = [k for k, v in self.metadata.items() if manifest.get(k) != v]
+        if changed:
+            raise ValueError(f"{self.manifest_path} was written with different {', '.join(changed)}; "
+                             f"rerun without resume")
+        kept = []
+        for shard in manifest["shards"]:
+            problem = _check_shard(self.output_dir / shard["path"], shard)
+            if problem is None and not self._full(shard):
+                problem = "not full"  # the last shard of a shorter run; redo it to match a fresh run
+            if problem is not None:
+                print(f"Resume: redoing {shard['path']} and later shards ({problem}).")
+                break
+            kept.append(shard)
+        print(f"Resume: keeping {len(kept)} shards with {sum(s['records'] for s in kept)} records.")
+        return kept
+
+    def _remove_stale_shards(self, previous: dict | None) -> None:
+        pattern = re.compile(re.escape(self.prefix) + r"-\d{5,}\.jsonl")
+        stale = {s["path"] for s in (previous or {}).get("shards", [])} \
+            - {s["path"] for s in self.shards}
+        for path in self.output_dir.iterdir():
+            if path.name.endswith(".tmp") and pattern.fullmatch(path.name[:-4]) \
+                    or path.name in stale and pattern.fullmatch(path.name):
+                path.unlink()
+
+    def _full(self, s: dict | None = None) -> bool:
+        s = s or self.shards[-1]
+        return bool((self.max_records and s["records"] >= self.max_records)
+                    or (self.max_bytes and s["bytes"] >= self.max_bytes))
+
+    def _tokens(self, data: bytes) -> int:
+        from token_cache import record_tokens
+        return sum(len(record_tokens(json.loads(line), self.tokenizer)[0])
+                   for line in data.splitlines() if line.strip())
+
+    def write(self, data: str | bytes, source: str | None = None) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if not data:
+            return
+        if self._skip:
+            lines = data.count(b"\n")
+            if lines <= self._skip:
+                self._skip -= lines
+                return
+            data = data.split(b"\n", self._skip)[-1]
+            self._skip = 0
+        if self._fp is None or self._full():
+            self._finish_shard()
+            path = self.output_dir / shard_name(self.prefix, len(self.shards))
+            self.shards.append({"path": path.name, "records": 0, "bytes": 0,
+                                "tokens": 0 if self.tokenizer is not None else None})
+            self._fp = open(path.with_name(path.name + ".tmp"), "wb")
+            self._hash = hashlib.sha256()
+        shard = self.shards[-1]
+        self._fp.write(data)
+        self._hash.update(data)
+        shard["records"] += data.count(b"\n")
+        shard["bytes"] += len(data)
+        if self.tokenizer is not None:
+            shard["tokens"] += self._tokens(data)
+        if source is not None:
+            per_source = shard.setdefault("per_source", {})
+            per_source[source] = per_source.get(source, 0) + data.count(b"\n")
+
+    def writelines(self, lines) -> None:
+        for line in lines:
+            self.write(line)
+
+    def write_record(self, record: dict, source: str | None = None) -> None:
+        self.write(json.dumps(record, ensure_ascii=False) + "\n", source)
+
+    def _finish_shard(self) -> None:
+        if self._fp is None:
+            return
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._fp.close()
+        shard = self.shards[-1]
+        shard["sha256"] = self._hash.hexdigest()
+        path = self.output_dir / shard["path"]
+        os.replace(path.with_name(path.name + ".tmp"), path)
+        self._fp = self._hash = None
+        self._write_manifest(complete=False)
+
+    def _write_manifest(self, complete: bool, metadata: dict | None = None) -> dict:
+        done = [s for s in self.shards if "sha256" in s]
+        tokens = [s["tokens"] for s in done]
+        manifest = {
+            "version": MANIFEST_VERSION, "prefix": self.prefix, "complete": complete,
+            "max_records": self.max_records, "max_bytes": self.max_bytes,
+            "tokenizer": self._tokenizer_name(),
+            "total": {"shards": len(done), "records": sum(s["records"] for s in done),
+                      "bytes": sum(s["bytes"] for s in done),
+                      "tokens": sum(tokens) if self.tokenizer is not None else None},
+            **self.metadata, **(metadata or {}),
+            "shards": done,
+        }
+        tmp = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        os.replace(tmp, self.manifest_path)
+        return manifest
+
+    def close(self, metadata: dict | None = None) -> dict:
+        """Finish the last shard and write the final manifest (plus *metadata*); returns it."""
+        if self._manifest is None:
+            self._finish_shard()
+            self._manifest = self._write_manifest(complete=True, metadata=metadata)
+        return self._manifest
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        elif self._fp is not None:
+            self._fp.close()  # leave the partial .tmp shard; the manifest lists the complete ones
+
+
+def shard_paths(manifest_path: str | Path) -> list[Path]:
+    manifest_path = Path(manifest_path)
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    return [manifest_path.parent / s["path"] for s in manifest["shards"]]
+
+
+def _check_shard(path: Path, shard: dict) -> str | None:
+    if not path.is_file():
+        return "missing"
+    if path.stat().st_size != shard["bytes"]:
+        return f"{path.stat().st_size} bytes, expected {shard['bytes']}"
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            h.update(block)
+    return None if h.hexdigest() == shard["sha256"] else "checksum mismatch"
+
+
+def verify_shards(manifest_path: str | Path, workers: int | None = None) -> dict:
+    """``{shard file: problem}`` for every shard that is missing or whose size / sha256 differ."""
+    manifest_path = Path(manifest_path)
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    shards = manifest["shards"]
+    with ThreadPoolExecutor(workers or os.cpu_count() or 1) as pool:  # hashlib releases the GIL
+        problems = pool.map(_check_shard, [manifest_path.parent / s["path"] for s in shards], shards)
+    return {s["path"]: p for s, p in zip(shards, problems) if p is not None}
+
+
+if __name__ == "__main__":
+    import argparse, sys
+
+    ap = argparse.ArgumentParser(description="Verify the shards listed in sharded-JSONL manifests.")
+    ap.add_argument("manifests", nargs="+")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--schema", default=None,
+                    help="also validate every line against this schema (see jsonl_validate.py)")
+    args = ap.parse_args()
+
+    failed = False
+    for m in args.manifests:
+        manifest = json.loads(Path(m).read_text(encoding="utf-8"))
+        problems = verify_shards(m, args.workers)
+        print(f"{m}: {manifest['total']['shards']} shards, {manifest['total']['records']} records"
+              + ("" if manifest["complete"] else " (incomplete run)")
+              + (f", {len(problems)} bad" if problems else ", all checksums OK"))
+        for path, problem in problems.items():
+            print(f"  {path}: {problem}")
+        failed |= bool(problems) or not manifest["complete"]
+        if args.schema and not problems:
+            from jsonl_validate import validate_jsonl
+            report = validate_jsonl(shard_paths(m), args.schema, args.workers)
+            bad = sum(f["bad"] for f in report["files"])
+            print(f"  {bad} lines do not match schema {args.schema}")
+            failed |= bad > 0
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,94 @@
+# token_budget.py
+import hashlib
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+
+from baseline_chunker import count_prefix, greedy_cut_points
+from prepare_training_data import render_pair
+
+DEFAULT_MAX_SEQ_LENGTH = 3827  # MAX_SEQ_LENGTH in finetune_qwen3.sh
+PARAGRAPH_SEPARATOR = "\n\n"
+
+
+def load_tokenizer(tokenizer_path: str):
+    """Load the tokenizer the model is trained with (MLX model dirs ship one)."""
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(tokenizer_path)
+
+
+def token_length_fn(tokenizer) -> Callable[[str], int]:
+    """``length_fn`` for the chunkers that measures text in model tokens."""
+    def n_tokens(text: str) -> int:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return n_tokens
+
+
+def _counts_digest(paragraphs: List[str], tokenizer) -> str:
+    h = hashlib.sha1(str(getattr(tokenizer, "name_or_path", "")).encode("utf-8"))
+    h.update(str(len(tokenizer)).encode("utf-8"))
+    for p in paragraphs:
+        h.update(p.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def paragraph_token_counts(paragraphs: List[str],
+                           tokenizer,
+                           batch_size: int = 1024,
+                           cache_path: str | Path | None = None) -> np.ndarray:
+    """
+    Token count of every paragraph, tokenised in batches.
+
+    With ``cache_path`` the counts are stored in a ``.npz`` next to a digest
+    of (tokenizer, paragraph texts) and reused until either changes.
+    """
+    digest = _counts_digest(paragraphs, tokenizer)
+    if cache_path is not None and Path(cache_path).is_file():
+        cached = np.load(cache_path)
+        if str(cached["digest"]) == digest:
+            return cached["counts"]
+
+    counts = np.empty(len(paragraphs), dtype=np.int64)
+    for start in range(0, len(paragraphs), batch_size):
+        batch = paragraphs[start:start + batch_size]
+        ids = tokenizer(batch, add_special_tokens=False)["input_ids"]
+        counts[start:start + len(batch)] = [len(x) for x in ids]
+
+    if cache_path is not None:
+        with open(cache_path, "wb") as f:
+            np.savez(f, counts=counts, digest=np.array(digest))
+    return counts
+
+
+def pair_overhead(tokenizer) -> int:
+    """Tokens a training pair costs beyond its two chunks (template + specials)."""
+    return len(tokenizer.encode(render_pair("", "")))
+
+
+def chunk_token_budget(tokenizer, max_seq_length: int = DEFAULT_MAX_SEQ_LENGTH) -> int:
+    """
+    Largest chunk size in tokens such that the prompt template plus any two
+    consecutive chunks fits in ``max_seq_length``.
+    """
+    return (max_seq_length - pair_overhead(tokenizer)) // 2
+
+
+def token_budget_spans(counts: np.ndarray,
+                       budget: int,
+                       sep_tokens: int = 1) -> List[tuple[int, int]]:
+    """
+    Greedy paragraph spans whose token size stays within ``budget``.
+
+    Each paragraph is charged its own tokens plus one separator; the last
+    separator of a chunk is not emitted, so the budget is widened by one
+    separator to compensate.  Paragraphs longer than the budget still form
+    a chunk of their own, as in ``chunk_paragraphs``.
+    """
+    prefix = count_prefix(np.asarray(counts) + sep_tokens)
+    return greedy_cut_points(prefix, budget + sep_tokens)
+
+
+def separator_tokens(tokenizer) -> int:
+    return len(tokenizer.encode(PARAGRAPH_SEPARATOR, add_special_tokens=False))
@@ -0,0 +1,213 @@
+# token_cache.py
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from prepare_training_data import COMPLETION_MARKER
+
+CACHE_VERSION = 1
+TOKENS_FILE = "tokens.u32"
+OFFSETS_FILE = "offsets.u64"
+PROMPT_LENGTHS_FILE = "prompt_lengths.u32"
+META_FILE = "meta.json"
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Hash of everything that decides the token ids: vocabulary/merges, chat template, EOS."""
+    h = hashlib.sha256()
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        h.update(backend.to_str().encode("utf-8"))
+    else:
+        h.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode("utf-8"))
+    h.update(b"\0" + str(getattr(tokenizer, "chat_template", None) or "").encode("utf-8"))
+    h.update(b"\0" + str(tokenizer.eos_token_id).encode("utf-8"))
+    return h.hexdigest()
+
+
+def file_fingerprint(path: str | Path, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(source_sha256: str, tokenizer_sha256: str) -> str:
+    """Cache directory key from the ``file_fingerprint`` / ``tokenizer_fingerprint``."""
+    h = hashlib.sha256(f"v{CACHE_VERSION}".encode("utf-8"))
+    h.update(tokenizer_sha256.encode("utf-8"))
+    h.update(source_sha256.encode("utf-8"))
+    return h.hexdigest()[:20]
+
+
+def _apply_chat_template(tokenizer, messages, **kwargs) -> list[int]:
+    return list(tokenizer.apply_chat_template(messages, **kwargs))
+
+
+def record_tokens(record: dict, tokenizer) -> tuple[list[int], int]:
+    """
+    ``(token ids, prompt length)`` of one JSONL record, tokenised the way
+    ``mlx_lm lora`` does for its three record kinds:
+
+    * ``{"text": ...}`` – plain encode plus EOS; the prompt runs up to the
+      ``NEXT EXCERPT`` marker of ``render_pair`` (0 if there is none)
+    * ``{"prompt": ..., "completion": ...}`` – a user/assistant chat
+    * ``{"messages": [...]}`` – the chat template; the prompt is every
+      message before the last
+    """
+    if "messages" in record:
+        messages = record["messages"]
+        ids = _apply_chat_template(tokenizer, messages)
+        prompt = _apply_chat_template(tokenizer, messages[:-1], add_generation_prompt=True)
+        return ids, len(prompt)
+    if "prompt" in record and "completion" in record:
+        user = {"role": "user", "content": record["prompt"]}
+        ids = _apply_chat_template(
+            tokenizer, [user, {"role": "assistant", "content": record["completion"]}])
+        prompt = _apply_chat_template(tokenizer, [user], add_generation_prompt=True)
+        return ids, len(prompt)
+    text = record["text"]
+    ids = list(tokenizer.encode(text))
+    if tokenizer.eos_token_id is not None and (not ids or ids[-1] != tokenizer.eos_token_id):
+        ids.append(tokenizer.eos_token_id)
+    cut = text.find(COMPLETION_MARKER)
+    prompt_len = len(tokenizer.encode(text[:cut + len(COMPLETION_MARKER)])) if cut >= 0 else 0
+    return ids, prompt_len
+
+
+def build_token_cache(source: str | Path, tokenizer, cache_dir: str | Path) -> Path:
+    """
+    Tokenise the JSONL *source* once into ``cache_dir/<stem>-<key>/``:
+
+    * ``tokens.u32``         – every record's ids, back to back
+    * ``offsets.u64``        – record *i* is ``tokens[offsets[i]:offsets[i + 1]]``
+    * ``prompt_lengths.u32`` – prompt tokens of each record (for prompt masking)
+    * ``meta.json``          – source, fingerprints and counts
+
+    The key hashes the tokenizer and the source bytes, so editing either
+    selects a new directory; an existing one is reused as is.  Each build
+    writes to its own temporary directory, so concurrent builders do not
+    clash; the first to finish wins.  Returns the cache directory.
+    """
+    source = Path(source)
+    source_sha256, tokenizer_sha256 = file_fingerprint(source), tokenizer_fingerprint(tokenizer)
+    target = Path(cache_dir) / f"{source.stem}-{cache_key(source_sha256, tokenizer_sha256)}"
+    if (target / META_FILE).is_file():
+        return target
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=target.name + ".", suffix=".tmp", dir=target.parent))
+    os.chmod(tmp, 0o755)  # mkdtemp makes it private
+    try:
+        _write_token_cache(source, tokenizer, tmp, source_sha256, tokenizer_sha256)
+        try:
+            os.replace(tmp, target)
+        except OSError:
+            if (target / META_FILE).is_file():
+                return target  # a concurrent build finished first
+            shutil.rmtree(target)  # leftover without meta.json, e.g. from a crash
+            os.replace(tmp, target)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return target
+
+
+def _write_token_cache(source: Path, tokenizer, tmp: Path, source_sha256: str,
+                       tokenizer_sha256: str) -> None:
+    offsets, prompt_lengths = [0], []
+    with source.open("r", encoding="utf-8") as f, (tmp / TOKENS_FILE).open("wb") as out:
+        for line in f:
+            if not line.strip():
+                continue
+            ids, prompt_len = record_tokens(json.loads(line), tokenizer)
+            np.asarray(ids, dtype=np.uint32).tofile(out)
+            offsets.append(offsets[-1] + len(ids))
+            prompt_lengths.append(prompt_len)
+    np.asarray(offsets, dtype=np.uint64).tofile(tmp / OFFSETS_FILE)
+    np.asarray(prompt_lengths, dtype=np.uint32).tofile(tmp / PROMPT_LENGTHS_FILE)
+    (tmp / META_FILE).write_text(json.dumps({
+        "version": CACHE_VERSION,
+        "source": str(source),
+        "source_sha256": source_sha256,
+        "tokenizer": str(getattr(tokenizer, "name_or_path", "")),
+        "tokenizer_sha256": tokenizer_sha256,
+        "records": len(prompt_lengths),
+        "tokens": offsets[-1],
+    }, indent=2), encoding="utf-8")
+
+
+class TokenCacheDataset:
+    """
+    Samples served straight from a token cache through memory maps.
+
+    ``dataset[i]`` is ``(tokens, prompt_length)`` – the processed-sample
+    shape ``mlx_lm``'s batch iterator consumes, ``tokens`` being a ``uint32``
+    view into the map (no copy, nothing tokenised) – and ``itemlen(i)``
+    its length, as ``mlx_lm``'s ``CacheDataset`` offers.
+    """
+
+    def __init__(self, cache_path: str | Path):
+        self.path = Path(cache_path)
+        self.meta = json.loads((self.path / META_FILE).read_text(encoding="utf-8"))
+        if self.meta["version"] != CACHE_VERSION:
+            raise ValueError(f"{self.path}: token cache version {self.meta['version']}, "
+                             f"expected {CACHE_VERSION}")
+        self.offsets = self._map(OFFSETS_FILE, np.uint64)
+        self.prompt_lengths = self._map(PROMPT_LENGTHS_FILE, np.uint32)
+        self.tokens = self._map(TOKENS_FILE, np.uint32)
+
+    def _map(self, name: str, dtype) -> np.ndarray:
+        path = self.path / name
+        if not path.stat().st_size:
+            return np.zeros(0, dtype=dtype)  # np.memmap cannot map an empty file
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    @classmethod
+    def from_jsonl(cls, source: str | Path, tokenizer, cache_dir: str | Path) -> "TokenCacheDataset":
+        return cls(build_token_cache(source, tokenizer, cache_dir))
+
+    def __len__(self) -> int:
+        return len(self.prompt_lengths)
+
+    def __getitem__(self, i: int) -> tuple[np.ndarray, int]:
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]], int(self.prompt_lengths[i])
+
+    def itemlen(self, i: int) -> int:
+        return int(self.offsets[i + 1] - self.offsets[i])
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets).astype(np.int64)
+
+
+if __name__ == "__main__":
+    import argparse, time
+    from token_budget import load_tokenizer
+
+    ap = argparse.ArgumentParser(
+        description="Pre-tokenise train.jsonl / valid.jsonl into memory-mapped token caches.")
+    ap.add_argument("data_dir", help="directory with train.jsonl and valid.jsonl")
+    ap.add_argument("--tokenizer_path", required=True)
+    ap.add_argument("--cache_dir", default=None,
+                    help="where caches live (default: <data_dir>/.token_cache)")
+    args = ap.parse_args()
+
+    data_dir = Path(args.data_dir)
+    cache_dir = Path(args.cache_dir or data_dir / ".token_cache")
+    tokenizer = load_tokenizer(args.tokenizer_path)
+    for split in ("train", "valid"):
+        source = data_dir / f"{split}.jsonl"
+        if not source.is_file():
+            print(f"{source}: not found, skipping.")
+            continue
+        t0 = time.perf_counter()
+        ds = TokenCacheDataset.from_jsonl(source, tokenizer, cache_dir)
+        lengths = ds.lengths()
+        print(f"{split}: {len(ds)} records, {ds.meta['tokens']} tokens "
+              f"(max {lengths.max() if len(lengths) else 0}) in {ds.path} "
+              f"[{time.perf_counter() - t0:.2f}s]")
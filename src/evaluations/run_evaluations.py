@@ -9,6 +9,8 @@ from pathlib import Path
 project_root = Path(__file__).resolve().parents[1]
 sys.path.append(str(project_root))
 
+from data_processing.jsonl_index import JsonlIndex
+
 def run_inference(model_path, adapter_path, prompt_text, temp, top_p, rep_penalty):
     """Runs the inference script with the given parameters."""
     command = [
@@ -56,6 +58,10 @@ def main():
     parser.add_argument("--output-dir", default="eval_outputs", help="Directory to save evaluation outputs.")
     parser.add_argument("--num-examples", type=int, default=10, help="Number of examples to run from the JSONL file.")
     parser.add_argument("--prompt-key", default="prompt", help="The key in the JSONL file containing the prompt text.")
+    parser.add_argument("--sample", action="store_true", help="Run a random subset of examples (see --seed) instead of the first ones.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for --sample.")
+    parser.add_argument("--start", type=int, default=0, help="Skip the first N examples of the (sampled) order.")
+    parser.add_argument("--resume", action="store_true", help="Append to an existing results.jsonl, skipping the examples it already holds.")
     # Add generation parameters matching the inference script
     parser.add_argument("--temp", type=float, default=0.75, help="Sampling temperature.")
     parser.add_argument("--top-p", type=float, default=0.95, help="Top-p sampling.")
@@ -90,14 +96,36 @@ def main():
     print(f"Input: {args.valid_jsonl_path}")
     print(f"Output will be saved to: {output_file}")
 
-    count = 0
+    # Examples already in results.jsonl, by line number of the input
+    done = set()
+    if args.resume and output_file.is_file():
+        skipped = 0
+        with open(output_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    done.add(json.loads(line)["index"])
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    skipped += 1  # written before results had an index, or cut off mid-line
+        if skipped:
+            print(f"Warning: {skipped} lines of {output_file} have no \"index\"; "
+                  f"their examples will be run again.", file=sys.stderr)
+        print(f"Resuming: {len(done)} examples already done.")
+
+    count = len(done)
     results = []
     try:
-        with open(args.valid_jsonl_path, 'r', encoding='utf-8') as infile, \
-             open(output_file, 'w', encoding='utf-8') as outfile:
-            for line in infile:
+        # The .idx sidecar gives random access, so sampling or skipping needs no rescan
+        index = JsonlIndex(valid_jsonl_path_obj)
+        order = index.sample(len(index), args.seed).tolist() if args.sample else range(len(index))
+        with open(output_file, 'a' if args.resume else 'w', encoding='utf-8') as outfile:
+            for i in order[args.start:]:
                 if count >= args.num_examples:
                     break
+                if i in done:
+                    continue
+                line = index.line(i).decode('utf-8')
                 try:
                     data = json.loads(line.strip())
                 except json.JSONDecodeError:
@@ -124,12 +152,13 @@ def main():
                 if generation is not None:
                     print(f"Generation successful.")
                     result_data = {
+                        "index": i, # Line number in the input, used by --resume
                         "prompt": prompt,
                         "generation": generation,
                         "original_data": data # Keep original data for reference
                     }
                     # Write result to output file immediately
-                    outfile.write(json.dumps(result_data) + '\\n')
+                    outfile.write(json.dumps(result_data) + '\n')
                     outfile.flush() # Ensure it's written in case of interruption
                     results.append(result_data)
                     count += 1
@@ -137,6 +166,7 @@ def main():
                      print(f"Generation failed for example {count + 1}.")
                      # Decide if you want to stop or continue
                      # break
+        index.close()
 
     except FileNotFoundError:
         print(f"Error: Could not open validation file '{args.valid_jsonl_path}'", file=sys.stderr)